@@ -4,15 +4,18 @@ import os
 os.environ["HF_ENDPOINT"] = "https://hf-mirror.com"
 import streamlit as st
 import shutil
+import itertools
 import pandas as pd
 from dotenv import load_dotenv
 import nest_asyncio
 
-# 引入模块
-from config import init_settings
-from modules.ingestion import process_single_file, delete_file_from_vector_db
-from modules.rag_engine import query_with_vision
-from modules.database import init_db, get_all_documents, delete_document_record
+# 引入模块 (只引入轻量模块：检索 / 入库链路依赖 LlamaIndex、Docling、torch，登录后用到时才导入)
+from config import init_settings, INGEST_WORKER_MODE, INGEST_WORKERS, JOB_MAX_ATTEMPTS
+from modules.database import init_db, enqueue_jobs, list_jobs, job_counts, cancel_job
+from modules.catalog import get_catalog, remove_document
+from modules.worker import start_background_workers
+from modules.telemetry import start_exporter, recent_traces, stage_summary, collector_stats
+from modules.warmup import start_warmup, warmup_status
 
 # 加载环境变量
 load_dotenv()
@@ -45,6 +48,141 @@ def check_password():
     
     return False
 
+def render_answer_stream(stream):
+    """逐步渲染流式问答：先显示来源页，再逐字显示答案，返回完整答案"""
+    sources_box = st.empty()
+    answer_box = st.empty()
+    answer = ""
+
+    # 检索/重排/截图阶段还没有任何输出，先转圈
+    with st.spinner("🧠 深度思考中..."):
+        first = next(stream, None)
+
+    for event in itertools.chain([first] if first else [], stream):
+        if event["type"] == "sources":
+            pages = "、".join(f"{f} 第{p}页" for f, p in event["pages"]) or "无截图"
+            sources_box.caption(f"📎 参考 {len(event['sources'])} 个片段 | 截图: {pages}")
+        elif event["type"] == "token":
+            answer += event["text"]
+            answer_box.markdown(answer + "▌")
+    answer_box.markdown(answer)
+    return answer
+
+def render_filter_panel(pdf_map):
+    """问答的检索范围：按文档类型 / 文件 / 标签 / 文档日期过滤，返回过滤条件 dict (都不选时返回 None)"""
+    with st.expander("🔎 检索范围", expanded=False):
+        c1, c2 = st.columns(2)
+        doc_types = c1.multiselect("文档类型", get_catalog().document_types())
+        filenames = c2.multiselect("指定文件", sorted(pdf_map))
+        c3, c4 = st.columns(2)
+        keywords = c3.text_input("标签 (逗号分隔，命中任一即可)")
+        date_range = None
+        if c4.checkbox("按文档日期筛选"):
+            date_range = c4.date_input("文档日期范围", value=())
+        st.caption("都不选时会自动识别问题中提到的文件名、文档类型和年月")
+
+    filters = {
+        "doc_types": doc_types,
+        "filenames": filenames,
+        "keywords": [k.strip() for k in keywords.replace("，", ",").split(",") if k.strip()],
+    }
+    if date_range:
+        filters["date_from"] = date_range[0].isoformat()
+        filters["date_to"] = date_range[-1].isoformat()
+    return filters if any(filters.values()) else None
+
+@st.cache_resource
+def ensure_ingest_workers():
+    """thread 模式：整个 Streamlit 进程只启动一组后台 worker，与会话/浏览器标签页无关"""
+    if INGEST_WORKER_MODE == "thread":
+        return start_background_workers(INGEST_WORKERS)
+    return None
+
+@st.cache_resource
+def ensure_metrics_exporter():
+    """指标导出 (HTTP /metrics 或文件) 每个进程只启动一次"""
+    start_exporter()
+    return True
+
+@st.cache_resource
+def init_runtime():
+    """数据库迁移、模型客户端、后台 worker、指标导出、模型预热：每个进程只做一次，与会话 / rerun 无关"""
+    init_db()
+    init_settings()
+    ensure_ingest_workers()
+    ensure_metrics_exporter()
+    start_warmup()
+    return True
+
+JOB_STATUS_LABELS = {"queued": "⏳ 排队", "running": "⚙️ 处理中", "completed": "✅ 完成", "failed": "❌ 失败", "cancelled": "⛔ 已取消"}
+
+@st.fragment(run_every=2)
+def render_job_panel():
+    """入库任务进度 (每 2 秒只刷新这一块)"""
+    counts = job_counts()
+    if not counts:
+        st.caption("暂无任务")
+        return
+    st.caption(" | ".join(f"{JOB_STATUS_LABELS[k]} {counts.get(k, 0)}" for k in JOB_STATUS_LABELS))
+
+    for job in list_jobs(limit=10):
+        label = JOB_STATUS_LABELS.get(job["status"], job["status"])
+        detail = job["progress"] or job["result_msg"] or ""
+        c1, c2 = st.columns([4, 1])
+        c1.markdown(f"**{job['filename']}**  \n{label} {detail} (第 {job['attempts']}/{job['max_attempts']} 次)")
+        if job["status"] in ("queued", "running"):
+            if c2.button("取消", key=f"cancel_job_{job['id']}"):
+                cancel_job(job["id"])
+                st.rerun(scope="fragment")
+
+@st.fragment(run_every=5)
+def render_metrics_panel():
+    """本进程的运行指标 (每 5 秒只刷新这一块)"""
+    queries = recent_traces("query", limit=20)
+    st.subheader("最近问答")
+    if queries:
+        rows = [{
+            "时间": q["time"],
+            "问题": q["name"],
+            "缓存": q.get("cached", ""),
+            "首字 (ms)": round(q.get("ttft_ms") or 0),
+            "总耗时 (ms)": round(q["total_ms"] or 0),
+            **{stage.split(".", 1)[-1]: round(ms) for stage, ms in q["stages"].items()},
+        } for q in queries]
+        st.dataframe(pd.DataFrame(rows), hide_index=True)
+    else:
+        st.caption("暂无问答记录")
+
+    st.subheader("各阶段耗时")
+    stages = stage_summary()
+    if stages:
+        df = pd.DataFrame(stages).rename(columns={"stage": "阶段", "count": "次数"})
+        st.dataframe(df.round(1), hide_index=True)
+    else:
+        st.caption("暂无数据")
+
+    st.subheader("缓存与调度")
+    stats = collector_stats()
+    if stats:
+        cols = st.columns(len(stats))
+        for col, (name, s) in zip(cols, sorted(stats.items())):
+            with col:
+                st.markdown(f"**{name}**")
+                if "hit_rate" in s:
+                    st.metric("命中率", f"{s['hit_rate']:.0%}")
+                st.json({k: round(v, 2) if isinstance(v, float) else v for k, v in s.items() if k != "hit_rate"}, expanded=False)
+
+    ingests = recent_traces("ingest", limit=10)
+    if ingests:
+        st.subheader("最近入库 (本进程)")
+        st.dataframe(pd.DataFrame([{
+            "时间": t["time"],
+            "文件": t["name"],
+            "结果": t.get("result", ""),
+            "总耗时 (s)": round((t["total_ms"] or 0) / 1000, 1),
+            **{stage.split(".", 1)[-1]: round(ms / 1000, 2) for stage, ms in t["stages"].items()},
+        } for t in ingests]), hide_index=True)
+
 # --- 主程序入口 ---
 def main():
     st.title("🧠 Gemini 智能知识库 Pro (Ubuntu Server版)")
@@ -53,12 +191,11 @@ def main():
     if "messages" not in st.session_state:
         st.session_state.messages = []
 
-    # 初始化 DB 和 模型
-    init_db()
+    # 初始化 DB 和 模型 (进程级缓存，rerun 时直接返回)
     try:
         # 使用 spinner 防止页面跳动
         with st.spinner("🚀 系统初始化中..."):
-            init_settings()
+            init_runtime()
     except Exception as e:
         st.error(f"❌ 初始化失败: {e}")
         st.stop()
@@ -69,31 +206,20 @@ def main():
         # 此处代码与原版保持一致...
         uploaded_files = st.file_uploader("支持 PDF", type=["pdf"], accept_multiple_files=True)
         if uploaded_files:
+            urgent = st.checkbox("优先处理")
             if st.button(f"开始处理 {len(uploaded_files)} 个文件"):
                 os.makedirs("data", exist_ok=True)
-                progress_bar = st.progress(0)
-                status_text = st.empty()
-                success_count = 0
-                
-                for i, uploaded_file in enumerate(uploaded_files):
-                    status_text.text(f"正在处理 ({i+1}/{len(uploaded_files)}): {uploaded_file.name} ...")
+
+                items = []
+                for uploaded_file in uploaded_files:
                     file_path = os.path.join("data", uploaded_file.name)
                     with open(file_path, "wb") as f:
                         f.write(uploaded_file.getbuffer())
-                    
-                    st.toast(f"正在分析: {uploaded_file.name}...")
-                    is_success, msg, _ = process_single_file(file_path)
-                    
-                    if is_success:
-                        success_count += 1
-                    else:
-                        st.error(f"{uploaded_file.name}: {msg}")
-                    progress_bar.progress((i + 1) / len(uploaded_files))
-                
-                status_text.text("处理完成！")
-                if success_count > 0:
-                    st.success(f"🎉 成功入库 {success_count} 个文件")
-                    st.rerun()
+                    items.append((uploaded_file.name, file_path))
+
+                # 只提交任务，由后台 worker 入库；刷新/关闭页面不影响处理
+                enqueue_jobs(items, priority=10 if urgent else 0, max_attempts=JOB_MAX_ATTEMPTS)
+                st.success(f"📨 已提交 {len(items)} 个入库任务")
             
             # 添加退出登录按钮
             st.divider()
@@ -101,15 +227,23 @@ def main():
                 st.session_state.authenticated = False
                 st.rerun()
 
+    with st.sidebar:
+        warming = {k: v for k, v in warmup_status().items() if v in ("排队", "进行中")}
+        if warming:
+            st.caption("🔥 模型预热中: " + ", ".join(warming))
+        st.divider()
+        st.subheader("📋 入库任务")
+        if INGEST_WORKER_MODE == "process":
+            st.caption("任务由独立进程 `python -m modules.worker` 处理")
+        render_job_panel()
+
     # --- 主界面 Logic (Tab 1 & 2) ---
     # 此处代码与原版保持一致，直接复制你的 Tab 逻辑...
-    tab_chat, tab_manage = st.tabs(["💬 智能问答", "🗂️ 语料库管理"])
+    tab_chat, tab_manage, tab_metrics = st.tabs(["💬 智能问答", "🗂️ 语料库管理", "📈 运行监控"])
     
     with tab_chat:
-        pdf_map = {}
-        if os.path.exists("data"):
-            for f in os.listdir("data"):
-                pdf_map[f] = os.path.join("data", f)
+        pdf_map = get_catalog().pdf_map()
+        search_filters = render_filter_panel(pdf_map)
 
         for msg in st.session_state.messages:
             with st.chat_message(msg["role"]):
@@ -121,41 +255,53 @@ def main():
                 st.markdown(prompt)
 
             with st.chat_message("assistant"):
-                with st.spinner("🧠 深度思考中..."):
-                    try:
-                        response = query_with_vision(prompt, pdf_map)
-                        st.markdown(response)
-                        st.session_state.messages.append({"role": "assistant", "content": response})
-                    except Exception as e:
-                        st.error(f"出错: {e}")
+                from modules.rag_engine import stream_query_with_vision
+                try:
+                    response = render_answer_stream(stream_query_with_vision(prompt, pdf_map, search_filters))
+                    st.session_state.messages.append({"role": "assistant", "content": response})
+                except Exception as e:
+                    st.error(f"出错: {e}")
 
     with tab_manage:
         # 此处代码与原版保持一致...
         st.subheader("📚 知识库全景")
-        docs = get_all_documents()
+        STATUS_OPTIONS = {"全部": None, "已完成": "completed", "处理中": "processing", "失败": "failed"}
+        c1, c2, c3 = st.columns([1, 1, 2])
+        status_label = c1.selectbox("状态", list(STATUS_OPTIONS))
+        catalog = get_catalog()
+        doc_type = c2.selectbox("类型", ["全部"] + catalog.document_types())
+        keyword = c3.text_input("搜索文件名 / 摘要 / 标签")
+
+        PAGE_SIZE = 50
+        filters = dict(
+            status=STATUS_OPTIONS[status_label],
+            doc_type=None if doc_type == "全部" else doc_type,
+            keyword=keyword.strip() or None,
+        )
+        _, total = catalog.list(page=1, page_size=1, **filters)
+        page_total = max(1, (total + PAGE_SIZE - 1) // PAGE_SIZE)
+        page = st.number_input(f"页码 (共 {page_total} 页，{total} 条)", min_value=1, max_value=page_total, value=1)
+        docs, _ = catalog.list(page=int(page), page_size=PAGE_SIZE, **filters)
         if docs:
             df = pd.DataFrame(docs)
-            if not df.empty:
-                # 仅展示存在的列
-                display_columns = ["id", "filename", "doc_type", "summary", "tags", "upload_time", "status"]
-                existing_cols = [c for c in display_columns if c in df.columns]
-                st.dataframe(df[existing_cols], width=1000, hide_index=True) # 修正 width 参数
-
-                st.divider()
-                file_to_delete = st.selectbox("选择要删除的文件", df["filename"].unique())
-                if st.button("彻底删除选中文件", type="primary"):
-                    if file_to_delete:
-                        delete_file_from_vector_db(file_to_delete)
-                        delete_document_record(file_to_delete)
-                        try:
-                            fp = os.path.join("data", file_to_delete)
-                            if os.path.exists(fp): os.remove(fp)
-                        except: pass
-                        st.success(f"已删除: {file_to_delete}")
-                        st.rerun()
+            display_columns = ["id", "filename", "doc_type", "summary", "tags", "page_count", "chunk_count", "upload_time", "status"]
+            st.dataframe(df[display_columns], width=1000, hide_index=True)
+
+            st.divider()
+            file_to_delete = st.selectbox("选择要删除的文件 (当前页)", df["filename"].unique())
+            if st.button("彻底删除选中文件", type="primary"):
+                if file_to_delete:
+                    remove_document(file_to_delete)
+                    st.success(f"已删除: {file_to_delete}")
+                    st.rerun()
         else:
             st.info("暂无数据")
 
+    with tab_metrics:
+        if INGEST_WORKER_MODE == "process":
+            st.caption("入库在独立 worker 进程中执行，入库指标见各进程的指标文件 (METRICS_FILE)")
+        render_metrics_panel()
+
 # 🔴 只有通过密码检查才执行 main()
 if check_password():
     main()
\ No newline at end of file
@@ -0,0 +1,103 @@
+# --- START OF FILE bench_embed_scheduler.py ---
+# 对比：逐文件串行 Embedding (旧) vs EmbeddingScheduler 跨文件攒批 + 并发 + 限流退避 (新)
+# 两种方式都打到同一个本地假服务 (注入延迟与 429)
+# 用法: python -m benchmarks.bench_embed_scheduler --files 8 --chunks 120 --rpm 120 --throttle-rate 0.05
+
+import time
+import argparse
+import threading
+
+from benchmarks.common import dump_json
+from benchmarks.fake_embed_server import FakeEmbeddingServer
+
+
+def make_workload(files, chunks):
+    return {
+        f"doc{f}.pdf": [f"文件 {f} 第 {i} 块 设备 DEV-{f:02d}-{i:04d} 的维护说明 section {i % 17}" for i in range(chunks)]
+        for f in range(files)
+    }
+
+
+def run_naive(url, workload):
+    """旧方式：一个文件一个文件地算，LlamaIndex 默认每批 10 条；遇到 429 整个文件失败"""
+    from benchmarks.fakes import HttpEmbedding
+
+    model = HttpEmbedding(url=url, embed_batch_size=10)
+    failed = []
+    t0 = time.perf_counter()
+    for filename, texts in workload.items():
+        try:
+            model.get_text_embedding_batch(texts)
+        except Exception:
+            failed.append(filename)
+    return {"seconds": time.perf_counter() - t0, "failed_files": failed, "client_calls": model.calls}
+
+
+def run_scheduled(url, workload, concurrency, rpm, workers):
+    """新方式：workers 个线程同时提交各自文件的块，由调度器攒批/并发/退避"""
+    from benchmarks.fakes import HttpEmbedding
+    from modules.embed_scheduler import EmbeddingScheduler
+
+    inner = HttpEmbedding(url=url, embed_batch_size=100)
+    scheduler = EmbeddingScheduler(inner, max_batch_size=100, max_concurrency=concurrency,
+                                   requests_per_minute=rpm, max_retries=8)
+    failed = []
+    pending = list(workload.items())
+    lock = threading.Lock()
+
+    def worker():
+        while True:
+            with lock:
+                if not pending:
+                    return
+                filename, texts = pending.pop(0)
+            try:
+                scheduler.get_text_embedding_batch(texts)
+            except Exception:
+                failed.append(filename)
+
+    t0 = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(workers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return {"seconds": time.perf_counter() - t0, "failed_files": failed,
+            "client_calls": inner.calls, "scheduler": scheduler.stats()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Embedding 调度器基准")
+    parser.add_argument("--files", type=int, default=8)
+    parser.add_argument("--chunks", type=int, default=120, help="每个文件的块数")
+    parser.add_argument("--latency-ms", type=float, default=80)
+    parser.add_argument("--rpm", type=int, default=120, help="假服务的每分钟请求上限")
+    parser.add_argument("--throttle-rate", type=float, default=0.05, help="随机 429 概率")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--workers", type=int, default=4, help="同时入库的文件数")
+    parser.add_argument("--json", help="结果写入该 JSON 文件")
+    args = parser.parse_args()
+
+    workload = make_workload(args.files, args.chunks)
+    results = {}
+    for name, runner in (
+        ("naive", lambda url: run_naive(url, workload)),
+        ("scheduled", lambda url: run_scheduled(url, workload, args.concurrency, args.rpm, args.workers)),
+    ):
+        # 每种方式各用一个全新的服务，限流窗口互不影响
+        server = FakeEmbeddingServer(latency_ms=args.latency_ms, rpm=args.rpm,
+                                     throttle_rate=args.throttle_rate).start()
+        try:
+            result = runner(server.url)
+        finally:
+            server.stop()
+        result["server"] = dict(server.stats)
+        results[name] = result
+        print(f"{name:<10} {result['seconds']:.2f}s | 成功请求 {server.stats['requests']} | "
+              f"429 {server.stats['throttled']} | 失败文件 {len(result['failed_files'])}/{args.files}")
+
+    print(dump_json({"args": vars(args), "results": results}, args.json))
+
+
+if __name__ == "__main__":
+    main()
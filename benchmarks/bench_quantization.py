@@ -0,0 +1,213 @@
+# --- START OF FILE bench_quantization.py ---
+# 向量量化前后对比：float32 原始向量 vs int8 标量量化 / 二值量化 (± oversampling + rescore)
+# 指标：recall@k (以 float32 精确检索为标准答案)、单次查询延迟、向量内存占用
+#
+# 两种运行方式：
+#   python -m benchmarks.bench_quantization --docs 20000 --queries 200
+#       本地嵌入模式不支持量化 (暴力检索)，用 numpy 按 Qdrant 的量化方式模拟打分，延迟仅供相对参考
+#   python -m benchmarks.bench_quantization --url http://localhost:6333 --docs 100000
+#       对 Qdrant 服务分别建 float32 / 量化两个集合，走真实的 HNSW + 量化 + rescore
+
+import time
+import random
+import argparse
+
+import numpy as np
+
+from benchmarks.common import summarize, dump_json
+
+_WORDS = ["设备", "维护", "合同", "采购", "电源", "温度", "压力", "阀门", "传感器", "报警", "校准", "周期",
+          "pump", "valve", "sensor", "firmware", "voltage", "torque", "manual", "warranty", "spec", "rev"]
+
+
+def make_corpus(docs, seed=0):
+    """固定随机种子的合成语料：每段由编号 + 若干领域词组成，保证近邻结构稳定可复现"""
+    rng = random.Random(seed)
+    texts = []
+    for i in range(docs):
+        words = rng.sample(_WORDS, 6) + [f"DEV-{rng.randrange(docs // 4 + 1):05d}", f"section{i % 97}"]
+        texts.append(" ".join(words))
+    return texts
+
+
+def make_queries(texts, count, seed=1):
+    """从语料里抽段落，去掉一部分词再加一个干扰词作为问题"""
+    rng = random.Random(seed)
+    queries = []
+    for text in rng.sample(texts, min(count, len(texts))):
+        words = text.split()
+        kept = rng.sample(words, max(2, len(words) * 2 // 3))
+        queries.append(" ".join(kept + [rng.choice(_WORDS)]))
+    return queries
+
+
+def embed(texts, dim):
+    from benchmarks.fakes import FakeEmbedding
+
+    model = FakeEmbedding(dim=dim)
+    return np.asarray([model._embed(t) for t in texts], dtype=np.float32)
+
+
+def exact_thresholds(vectors, queries, k):
+    """每个问题精确检索第 k 名的分数"""
+    return [float(np.partition(-(vectors @ q), k - 1)[k - 1]) * -1 for q in queries]
+
+
+def recall_at_k(found, vectors, query, threshold, k):
+    """
+    找到的结果里精确分数不低于第 k 名的比例。
+    合成语料里同分的段落很多，按 ID 比对会把同分的等价结果算成漏召回，所以按分数判断
+    """
+    if not found:
+        return 0.0
+    scores = vectors[list(found)] @ query
+    return float(np.sum(scores >= threshold - 1e-6)) / k
+
+
+# --- numpy 模拟 (本地) ---
+
+class SimulatedIndex:
+    """按 Qdrant 的量化方式打分：scalar 为 int8 (0.99 分位截断)，binary 为符号位；rescore 时用原始向量重排"""
+
+    def __init__(self, vectors, kind):
+        self.vectors = vectors
+        self.kind = kind
+        if kind == "scalar":
+            lo, hi = np.quantile(vectors, [0.005, 0.995])
+            codes = np.clip(np.round((vectors - lo) / (hi - lo) * 255), 0, 255).astype(np.uint8)
+            # 量化值是原始值的仿射变换，同一个查询下排序只取决于 codes · q
+            self._scoring = codes.astype(np.float32)
+            self.bytes = codes.nbytes
+        elif kind == "binary":
+            self._scoring = np.where(vectors > 0, 1.0, -1.0).astype(np.float32)
+            self.bytes = (vectors.shape[0] * vectors.shape[1] + 7) // 8
+        else:
+            self._scoring = vectors
+            self.bytes = vectors.nbytes
+
+    def search(self, query, k, oversampling=1.0, rescore=False):
+        q = np.where(query > 0, 1.0, -1.0).astype(np.float32) if self.kind == "binary" else query
+        scores = self._scoring @ q
+        limit = min(int(k * oversampling) if rescore else k, len(scores))
+        candidates = np.argpartition(-scores, limit - 1)[:limit]
+        if rescore:
+            exact = self.vectors[candidates] @ query
+            return candidates[np.argsort(-exact)][:k].tolist()
+        return candidates[np.argsort(-scores[candidates])][:k].tolist()
+
+
+def run_simulated(vectors, query_vectors, truth, k, oversampling):
+    results = {}
+    variants = [
+        ("float32", "none", False),
+        ("scalar", "scalar", False),
+        ("scalar+rescore", "scalar", True),
+        ("binary", "binary", False),
+        ("binary+rescore", "binary", True),
+    ]
+    indexes = {}
+    for name, kind, rescore in variants:
+        index = indexes.setdefault(kind, SimulatedIndex(vectors, kind))
+        latencies, recalls = [], []
+        for q, expected in zip(query_vectors, truth):
+            t0 = time.perf_counter()
+            found = index.search(q, k, oversampling=oversampling, rescore=rescore)
+            latencies.append(time.perf_counter() - t0)
+            recalls.append(recall_at_k(found, vectors, q, expected, k))
+        results[name] = {
+            "recall_at_k": sum(recalls) / len(recalls),
+            "latency": summarize(latencies),
+            # rescore 需要的原始向量可以放磁盘，这里只算常驻内存的部分
+            "vector_ram_mb": index.bytes / (1024 * 1024),
+        }
+    return results
+
+
+# --- Qdrant 服务 ---
+
+def _wait_indexed(client, name, timeout=600):
+    from qdrant_client.http import models
+
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if client.get_collection(name).status == models.CollectionStatus.GREEN:
+            return
+        time.sleep(1)
+
+
+def run_server(url, vectors, query_vectors, truth, k, oversampling, quantization, batch_size=512):
+    from qdrant_client import QdrantClient
+    from qdrant_client.http import models
+    from modules.vector_store import create_collection
+
+    client = QdrantClient(url=url)
+    layouts = {"float32": ("none", False), quantization: (quantization, True)}
+    results = {}
+    for name, (kind, on_disk) in layouts.items():
+        collection = f"bench_quant_{name}"
+        if client.collection_exists(collection):
+            client.delete_collection(collection)
+        create_collection(client, collection, vectors.shape[1], quantization=kind, on_disk=on_disk)
+        t0 = time.perf_counter()
+        for start in range(0, len(vectors), batch_size):
+            block = vectors[start:start + batch_size]
+            client.upsert(collection, points=models.Batch(
+                ids=list(range(start, start + len(block))), vectors=block.tolist()), wait=False)
+        _wait_indexed(client, collection)
+        build_seconds = time.perf_counter() - t0
+
+        variants = [(name, None)]
+        if kind != "none":
+            variants = [
+                (name, models.QuantizationSearchParams(rescore=False)),
+                (f"{name}+rescore", models.QuantizationSearchParams(rescore=True, oversampling=oversampling)),
+            ]
+        for label, quant in variants:
+            params = models.SearchParams(hnsw_ef=max(128, k * 4), quantization=quant)
+            latencies, recalls = [], []
+            for q, expected in zip(query_vectors, truth):
+                t0 = time.perf_counter()
+                hits = client.query_points(collection, query=q.tolist(), limit=k, search_params=params).points
+                latencies.append(time.perf_counter() - t0)
+                recalls.append(recall_at_k([h.id for h in hits], vectors, q, expected, k))
+            results[label] = {
+                "recall_at_k": sum(recalls) / len(recalls),
+                "latency": summarize(latencies),
+                "build_seconds": build_seconds,
+            }
+        client.delete_collection(collection)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="向量量化 recall / 延迟对比")
+    parser.add_argument("--docs", type=int, default=20000, help="语料块数")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--dim", type=int, default=256)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--oversampling", type=float, default=2.0)
+    parser.add_argument("--url", help="Qdrant 服务地址；不填则用 numpy 模拟")
+    parser.add_argument("--quantization", choices=("scalar", "binary"), default="scalar", help="服务模式下测试的量化方式")
+    parser.add_argument("--json", help="结果写入该 JSON 文件")
+    args = parser.parse_args()
+
+    texts = make_corpus(args.docs)
+    vectors = embed(texts, args.dim)
+    query_vectors = embed(make_queries(texts, args.queries), args.dim)
+    truth = exact_thresholds(vectors, query_vectors, args.k)
+    print(f"📦 语料 {len(texts)} 块 x {args.dim} 维，问题 {len(query_vectors)} 个，k={args.k}")
+
+    if args.url:
+        results = run_server(args.url, vectors, query_vectors, truth, args.k, args.oversampling, args.quantization)
+    else:
+        results = run_simulated(vectors, query_vectors, truth, args.k, args.oversampling)
+
+    for name, r in results.items():
+        extra = f" | 内存 {r['vector_ram_mb']:.1f} MB" if "vector_ram_mb" in r else ""
+        print(f"{name:<16} recall@{args.k} {r['recall_at_k']:.3f} | p50 {r['latency']['p50_ms']:.2f} ms "
+              f"| p95 {r['latency']['p95_ms']:.2f} ms{extra}")
+    print(dump_json({"args": vars(args), "mode": "server" if args.url else "simulated", "results": results}, args.json))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+# --- START OF FILE bench_retriever_setup.py ---
+# 微基准：每次提问的检索器准备开销，对比 "每次重建" 与 "常驻缓存 + 世代号失效"
+# 用法: python -m benchmarks.bench_retriever_setup --chunks 2000 --queries 50
+
+import argparse
+
+from benchmarks.common import use_temp_workdir, summarize, timed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="检索器准备开销微基准")
+    parser.add_argument("--chunks", type=int, default=1000, help="预先写入的块数")
+    parser.add_argument("--queries", type=int, default=50, help="模拟提问次数")
+    args = parser.parse_args()
+
+    workdir = use_temp_workdir()
+
+    from llama_index.core import Settings
+    from llama_index.core.schema import TextNode
+    from benchmarks.fakes import FakeEmbedding
+
+    Settings.embedding = FakeEmbedding()
+
+    from modules.database import init_db
+    from modules.ingestion import upsert_nodes
+    from modules.rag_engine import build_retriever_engine, get_retriever_engine
+
+    init_db()
+    nodes = []
+    for i in range(args.chunks):
+        text = f"第 {i} 段 设备编号 DEV-{i:05d} 维护说明 section {i % 37}"
+        nodes.append(TextNode(text=text, metadata={"filename": f"doc{i % 20}.pdf"},
+                              embedding=Settings.embedding.get_text_embedding(text)))
+    upsert_nodes(nodes)
+    print(f"📦 已写入 {args.chunks} 个块 (工作目录 {workdir})")
+
+    query = "DEV-00042 的维护说明"
+    before, after = [], []
+    for _ in range(args.queries):
+        retriever, seconds = timed(build_retriever_engine)
+        before.append(seconds)
+    retriever.retrieve(query)
+
+    get_retriever_engine()  # 首次构建 (入库后只发生一次)
+    for _ in range(args.queries):
+        retriever, seconds = timed(get_retriever_engine)
+        after.append(seconds)
+    retriever.retrieve(query)
+
+    for name, values in (("每次重建 (旧)", before), ("常驻缓存 (新)", after)):
+        s = summarize(values)
+        print(f"{name:<12} mean {s['mean_ms']:.3f} ms | p50 {s['p50_ms']:.3f} ms | p95 {s['p95_ms']:.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+# --- START OF FILE bench_startup.py ---
+# 冷启动基准：每项都在全新的子进程里测，避免已导入模块的缓存影响结果
+#   1. 导入耗时：登录页 (app.py 顶层 import) / config / 检索链路 / 入库链路
+#   2. 首次问答延迟：冷启动直接提问 vs 先后台预热 (modules.warmup) 再提问，以及第二次提问作为热态参考
+# 模型用确定性的假模型 (FakeEmbedding / FakeLLM)；装了 sentence-transformers 时会加载真实的 Reranker
+#
+# 用法: python -m benchmarks.bench_startup --repeat 3 --json startup.json
+
+import os
+import ast
+import sys
+import json
+import time
+import argparse
+import subprocess
+
+from benchmarks.common import ROOT, use_temp_workdir, summarize, dump_json
+
+IMPORT_TARGETS = {
+    "config": "import config",
+    "rag_engine": "import modules.rag_engine",
+    "ingestion": "import modules.ingestion",
+}
+
+
+def app_top_level_imports():
+    """app.py 顶层的 import 语句 (登录页在渲染之前要付出的导入成本)"""
+    with open(os.path.join(ROOT, "app.py"), encoding="utf-8") as f:
+        tree = ast.parse(f.read())
+    nodes = [n for n in tree.body if isinstance(n, (ast.Import, ast.ImportFrom))]
+    return "\n".join(ast.unparse(n) for n in nodes)
+
+
+def _run_child(code, cwd=None, env=None):
+    """在新进程里执行代码，最后一行输出为 JSON 结果"""
+    proc = subprocess.run(
+        [sys.executable, "-c", code], cwd=cwd or ROOT, capture_output=True, text=True,
+        env=dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [ROOT, os.environ.get("PYTHONPATH")])), **(env or {})),
+    )
+    lines = [line for line in proc.stdout.splitlines() if line.startswith("{")]
+    if proc.returncode != 0 or not lines:
+        raise RuntimeError(f"子进程失败 (exit={proc.returncode}):\n{proc.stderr[-2000:]}")
+    return json.loads(lines[-1])
+
+
+def measure_import(statements, workdir):
+    code = (
+        "import time, json\n"
+        "t0 = time.perf_counter()\n"
+        f"{statements}\n"
+        "print(json.dumps({'seconds': time.perf_counter() - t0}))\n"
+    )
+    return _run_child(code, cwd=workdir)["seconds"]
+
+
+# --- 子进程入口 ---
+
+def _use_fake_models():
+    from llama_index.core import Settings
+    from benchmarks.fakes import FakeEmbedding, FakeLLM
+
+    Settings.embedding = FakeEmbedding()
+    Settings.llm = FakeLLM()
+
+
+def child_ingest(docs, pages):
+    """准备语料：生成 PDF 并入库 (单独的进程，本地向量库的文件锁随进程释放)"""
+    from benchmarks.run_benchmark import build_corpus
+
+    _use_fake_models()
+    from modules.database import init_db
+    from modules.ingestion import process_single_file
+
+    init_db()
+    facts = build_corpus("data", docs, pages)
+    for name in sorted(os.listdir("data")):
+        process_single_file(os.path.join("data", name))
+    return {"questions": [f["question"] for f in facts[:2]]}
+
+
+def child_first_query(questions, warmup):
+    """一个全新进程从导入到回答前两个问题的耗时；warmup 时先同步跑完预热"""
+    t0 = time.perf_counter()
+    _use_fake_models()
+    from modules.database import init_db
+
+    init_db()
+    result = {"setup_seconds": time.perf_counter() - t0, "warmup_seconds": 0.0}
+
+    if warmup:
+        from modules.warmup import run_warmup, warmup_status, TARGETS
+
+        t = time.perf_counter()
+        run_warmup(list(TARGETS))
+        result["warmup_seconds"] = time.perf_counter() - t
+        result["warmup_status"] = warmup_status()
+
+    t = time.perf_counter()
+    from modules.rag_engine import query_with_vision, get_reranker
+    result["import_seconds"] = time.perf_counter() - t
+
+    pdf_map = {name: os.path.join("data", name) for name in os.listdir("data")}
+    for key, question in zip(("first_query_seconds", "second_query_seconds"), questions):
+        t = time.perf_counter()
+        query_with_vision(question, pdf_map)
+        result[key] = time.perf_counter() - t
+    result["reranker_loaded"] = get_reranker() is not None
+    return result
+
+
+def _child_main(argv):
+    mode, workdir, payload = argv[0], argv[1], json.loads(argv[2])
+    os.chdir(workdir)
+    if mode == "ingest":
+        result = child_ingest(**payload)
+    else:
+        result = child_first_query(**payload)
+    print(json.dumps(result, ensure_ascii=False))
+
+
+def _spawn(mode, workdir, **payload):
+    code = (
+        "from benchmarks.bench_startup import _child_main\n"
+        f"_child_main({[mode, workdir, json.dumps(payload, ensure_ascii=False)]!r})\n"
+    )
+    # 问答结果不能被答案缓存短路
+    return _run_child(code, env={"ANSWER_CACHE_ENABLED": "0"})
+
+
+def main():
+    parser = argparse.ArgumentParser(description="冷启动：导入耗时与首次问答延迟")
+    parser.add_argument("--repeat", type=int, default=3, help="每项测量的次数 (每次都是新进程)")
+    parser.add_argument("--docs", type=int, default=3, help="首次问答测试的 PDF 个数")
+    parser.add_argument("--pages", type=int, default=4)
+    parser.add_argument("--json", help="结果写入该 JSON 文件")
+    args = parser.parse_args()
+
+    args.json = os.path.abspath(args.json) if args.json else None
+    workdir = use_temp_workdir("rag_startup_")
+
+    imports = {"login_page": app_top_level_imports(), **IMPORT_TARGETS}
+    import_results = {}
+    for name, statements in imports.items():
+        import_results[name] = summarize([measure_import(statements, workdir) for _ in range(args.repeat)])
+        print(f"📦 导入 {name:<11} p50 {import_results[name]['p50_ms']:8.0f} ms | max {import_results[name]['max_ms']:8.0f} ms")
+
+    questions = _spawn("ingest", workdir, docs=args.docs, pages=args.pages)["questions"]
+    query_results = {}
+    for label, warmup in (("cold", False), ("warmed", True)):
+        runs = [_spawn("query", workdir, questions=questions, warmup=warmup) for _ in range(args.repeat)]
+        query_results[label] = {
+            key: summarize([r[key] for r in runs])
+            for key in ("setup_seconds", "warmup_seconds", "import_seconds", "first_query_seconds", "second_query_seconds")
+        }
+        query_results[label]["reranker_loaded"] = runs[-1]["reranker_loaded"]
+        if warmup:
+            query_results[label]["warmup_status"] = runs[-1].get("warmup_status")
+        s = query_results[label]
+        print(f"❓ {label:<6} 预热 {s['warmup_seconds']['p50_ms']:7.0f} ms | 导入 {s['import_seconds']['p50_ms']:7.0f} ms "
+              f"| 首问 {s['first_query_seconds']['p50_ms']:7.0f} ms | 第二问 {s['second_query_seconds']['p50_ms']:7.0f} ms")
+    if not query_results["cold"]["reranker_loaded"]:
+        print("ℹ️ Reranker 未加载 (缺少 sentence-transformers 或模型文件)，首问延迟不含模型加载")
+
+    result = {
+        "meta": {"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"), "args": vars(args), "python": sys.version.split()[0]},
+        "imports": import_results,
+        "first_query": query_results,
+    }
+    text = dump_json(result, args.json)
+    if not args.json:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+# --- START OF FILE common.py ---
+# 基准测试公共工具：临时工作目录、计时、分位数
+
+import os
+import sys
+import json
+import time
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+
+def use_temp_workdir(prefix="rag_bench_"):
+    """切到临时目录：corpus.db / storage_db 等相对路径都落在这里，不污染正式数据"""
+    workdir = tempfile.mkdtemp(prefix=prefix)
+    os.chdir(workdir)
+    return workdir
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * pct / 100.0
+    lo = int(k)
+    hi = min(lo + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+
+def summarize(seconds):
+    """秒 -> 毫秒统计"""
+    ms = [s * 1000 for s in seconds]
+    return {
+        "n": len(ms),
+        "mean_ms": sum(ms) / len(ms) if ms else 0.0,
+        "p50_ms": percentile(ms, 50),
+        "p95_ms": percentile(ms, 95),
+        "max_ms": max(ms) if ms else 0.0,
+    }
+
+
+def timed(fn, *args, **kwargs):
+    t0 = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - t0
+
+
+def dump_json(data, path=None):
+    text = json.dumps(data, ensure_ascii=False, indent=2)
+    if path:
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(text)
+    return text
@@ -0,0 +1,112 @@
+# --- START OF FILE fake_embed_server.py ---
+# 本地假 Embedding 服务：可注入延迟和限流 (429)，用于测试 EmbeddingScheduler 的攒批 / 退避行为
+#
+# 单独运行: python -m benchmarks.fake_embed_server --port 8765 --rpm 300 --latency-ms 80 --throttle-rate 0.05
+
+import json
+import time
+import random
+import argparse
+import threading
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from benchmarks.fakes import FakeEmbedding
+
+
+class FakeEmbeddingServer:
+    """
+    POST /embed  {"texts": [...]}  ->  {"embeddings": [[...], ...]}
+    - latency_ms + per_text_ms * 文本数：模拟网络与推理耗时
+    - rpm：滑动 60 秒窗口内超过该请求数返回 429 (0 表示不限)
+    - throttle_rate：按概率随机返回 429 (模拟突发的配额抖动)
+    - max_batch：单次请求文本数上限，超过返回 400
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, latency_ms=50, per_text_ms=0.5, rpm=0,
+                 throttle_rate=0.0, max_batch=100, dim=256, seed=0):
+        self.latency_ms = latency_ms
+        self.per_text_ms = per_text_ms
+        self.rpm = rpm
+        self.throttle_rate = throttle_rate
+        self.max_batch = max_batch
+        self._model = FakeEmbedding(dim=dim)
+        self._random = random.Random(seed)
+        self._window = deque()
+        self._lock = threading.Lock()
+        self.stats = {"requests": 0, "texts": 0, "throttled": 0, "rejected": 0}
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                body = json.loads(self.rfile.read(length) or b"{}")
+                status, payload = server.handle(body.get("texts", []))
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self._httpd = ThreadingHTTPServer((host, port), Handler)
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}/embed"
+
+    def handle(self, texts):
+        if len(texts) > self.max_batch:
+            with self._lock:
+                self.stats["rejected"] += 1
+            return 400, {"error": f"batch too large ({len(texts)} > {self.max_batch})"}
+        if self._should_throttle():
+            return 429, {"error": "RESOURCE_EXHAUSTED: rate limit exceeded"}
+        time.sleep((self.latency_ms + self.per_text_ms * len(texts)) / 1000.0)
+        with self._lock:
+            self.stats["requests"] += 1
+            self.stats["texts"] += len(texts)
+        return 200, {"embeddings": [self._model._embed(t) for t in texts]}
+
+    def _should_throttle(self):
+        with self._lock:
+            now = time.monotonic()
+            while self._window and now - self._window[0] > 60:
+                self._window.popleft()
+            if (self.rpm and len(self._window) >= self.rpm) or self._random.random() < self.throttle_rate:
+                self.stats["throttled"] += 1
+                return True
+            self._window.append(now)
+            return False
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="本地假 Embedding 服务")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=50)
+    parser.add_argument("--rpm", type=int, default=0)
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    parser.add_argument("--max-batch", type=int, default=100)
+    args = parser.parse_args()
+    server = FakeEmbeddingServer(port=args.port, latency_ms=args.latency_ms, rpm=args.rpm,
+                                 throttle_rate=args.throttle_rate, max_batch=args.max_batch)
+    print(f"🧪 假 Embedding 服务: {server.url}")
+    try:
+        server._httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
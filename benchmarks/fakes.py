@@ -0,0 +1,142 @@
+# --- START OF FILE fakes.py ---
+# 离线基准测试用的假模型：结果确定、不联网，可以在没有 API Key 的机器上跑
+
+import re
+import json
+import math
+import time
+import hashlib
+import urllib.error
+import urllib.request
+from typing import Any
+
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.llms import CustomLLM, CompletionResponse, LLMMetadata
+from llama_index.core.llms.callbacks import llm_completion_callback
+
+_TOKEN_RE = re.compile(r"[\u4e00-\u9fff]|[A-Za-z0-9_\-]+")
+
+
+def _tokens(text):
+    return [t.lower() for t in _TOKEN_RE.findall(text)]
+
+
+class FakeEmbedding(BaseEmbedding):
+    """哈希词袋向量：共享词越多余弦越高，足够让检索结果有意义"""
+
+    dim: int = 256
+    latency: float = 0.0  # 模拟网络延迟 (秒/次调用)
+    calls: int = 0
+
+    @classmethod
+    def class_name(cls):
+        return "FakeEmbedding"
+
+    def _embed(self, text):
+        vec = [0.0] * self.dim
+        for tok in _tokens(text):
+            h = int(hashlib.md5(tok.encode("utf-8")).hexdigest(), 16)
+            vec[h % self.dim] += 1.0 if (h >> 8) & 1 else -1.0
+        norm = math.sqrt(sum(v * v for v in vec)) or 1.0
+        return [v / norm for v in vec]
+
+    def _call(self, texts):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        return [self._embed(t) for t in texts]
+
+    def _get_query_embedding(self, query):
+        return self._call([query])[0]
+
+    def _get_text_embedding(self, text):
+        return self._call([text])[0]
+
+    def _get_text_embeddings(self, texts):
+        return self._call(texts)
+
+    async def _aget_query_embedding(self, query):
+        return self._get_query_embedding(query)
+
+
+class RateLimitError(Exception):
+    status_code = 429
+
+
+class HttpEmbedding(BaseEmbedding):
+    """调用 benchmarks/fake_embed_server.py 的客户端；429 抛 RateLimitError，和真实 API 的失败方式一致"""
+
+    url: str = "http://127.0.0.1:8765/embed"
+    timeout: float = 30.0
+    calls: int = 0
+
+    @classmethod
+    def class_name(cls):
+        return "HttpEmbedding"
+
+    def _post(self, texts):
+        self.calls += 1
+        req = urllib.request.Request(
+            self.url,
+            data=json.dumps({"texts": texts}).encode("utf-8"),
+            headers={"Content-Type": "application/json"},
+        )
+        try:
+            with urllib.request.urlopen(req, timeout=self.timeout) as resp:
+                return json.loads(resp.read())["embeddings"]
+        except urllib.error.HTTPError as e:
+            if e.code == 429:
+                raise RateLimitError(f"429 {e.read().decode('utf-8', 'ignore')}") from None
+            raise
+
+    def _get_query_embedding(self, query):
+        return self._post([query])[0]
+
+    def _get_text_embedding(self, text):
+        return self._post([text])[0]
+
+    def _get_text_embeddings(self, texts):
+        return self._post(texts)
+
+    async def _aget_query_embedding(self, query):
+        return self._get_query_embedding(query)
+
+
+class FakeLLM(CustomLLM):
+    """固定回答的 LLM：元数据提示返回合法 JSON，问答提示返回上下文开头"""
+
+    latency: float = 0.0
+    calls: int = 0
+
+    @property
+    def metadata(self):
+        return LLMMetadata(model_name="fake-llm")
+
+    def _answer(self, prompt):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if "doc_type" in prompt:
+            # 元数据提示里每个文档一个 <doc id="...">，逐个作答
+            ids = re.findall(r'<doc id="([^"]+)"', prompt) or ["d1"]
+            return json.dumps({"documents": [
+                {"id": i, "doc_type": "技术手册", "summary": "离线基准测试文档", "keywords": ["benchmark"], "doc_date": "2025-01-01"}
+                for i in ids
+            ]}, ensure_ascii=False)
+        return "根据上下文：" + prompt[-200:].strip()
+
+    @llm_completion_callback()
+    def complete(self, prompt, formatted=False, **kwargs: Any):
+        return CompletionResponse(text=self._answer(prompt))
+
+    @llm_completion_callback()
+    def stream_complete(self, prompt, formatted=False, **kwargs: Any):
+        text = self._answer(prompt)
+
+        def gen():
+            acc = ""
+            for i in range(0, len(text), 8):
+                delta = text[i:i + 8]
+                acc += delta
+                yield CompletionResponse(text=acc, delta=delta)
+        return gen()
@@ -0,0 +1,151 @@
+# --- START OF FILE load_test.py ---
+# 并发压测：多个线程模拟同时提问的 Streamlit 会话，走完整的 stream_query_with_vision
+# (检索 -> 预取截图 / 重排序 -> 截图 -> LLM 流式输出)，统计各并发度下的 问/秒 和延迟分位数
+# 默认用确定性的假模型；--embed-latency / --llm-latency 模拟网络耗时，--writer 在压测期间持续入库以检验读写互斥
+#
+# 用法: python -m benchmarks.load_test --concurrency 1,2,4,8 --queries 40 --llm-latency 0.3 --json load.json
+
+import os
+import time
+import random
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.common import use_temp_workdir, summarize, dump_json
+
+
+def run_level(questions, pdf_map, concurrency):
+    """concurrency 个会话并发，把 questions 全部问完"""
+    from modules.rag_engine import stream_query_with_vision
+
+    latencies, ttfts, errors = [], [], []
+    lock = threading.Lock()
+
+    def ask(question):
+        t0 = time.perf_counter()
+        try:
+            for event in stream_query_with_vision(question, pdf_map):
+                if event["type"] == "done":
+                    with lock:
+                        ttfts.append(event["ttft"])
+        except Exception as e:
+            with lock:
+                errors.append(str(e))
+            return
+        with lock:
+            latencies.append(time.perf_counter() - t0)
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(ask, questions))
+    wall = time.perf_counter() - t0
+    return {
+        "concurrency": concurrency,
+        "queries": len(questions),
+        "errors": errors[:5],
+        "error_count": len(errors),
+        "wall_seconds": wall,
+        "queries_per_second": len(latencies) / wall if wall else 0.0,
+        "latency": summarize(latencies),
+        "ttft": summarize(ttfts),
+    }
+
+
+def clear_page_cache(pdf_map):
+    """各并发度都从冷的截图缓存开始，避免后面的档位全部命中缓存"""
+    from modules.page_cache import get_page_cache
+    from modules.ingestion import file_hash
+
+    cache = get_page_cache()
+    for path in pdf_map.values():
+        cache.invalidate(file_hash(path))
+
+
+def writer_loop(data_dir, stop_event, counter):
+    """压测期间反复重新入库一个变化的文件 (写入向量库 / BM25)，检验检索与写入并发时不出错"""
+    import fitz
+    from modules.ingestion import process_single_file
+    from modules.page_cache import fitz_lock
+
+    path = os.path.join(data_dir, "zz_writer.pdf")
+    i = 0
+    while not stop_event.is_set():
+        with fitz_lock:
+            pdf = fitz.open()
+            pdf.new_page().insert_text((50, 80), f"writer revision {i} 设备 WR-{i:05d}", fontname="china-s")
+            pdf.save(path)
+            pdf.close()
+        ok, msg, _ = process_single_file(path)
+        counter["ok" if ok else "failed"] += 1
+        i += 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description="并发问答压测")
+    parser.add_argument("--docs", type=int, default=6, help="PDF 个数")
+    parser.add_argument("--pages", type=int, default=8, help="每个 PDF 的页数")
+    parser.add_argument("--queries", type=int, default=40, help="每个并发档位的提问数")
+    parser.add_argument("--concurrency", default="1,2,4,8", help="并发档位，逗号分隔")
+    parser.add_argument("--embed-latency", type=float, default=0.05, help="假 Embedding 每次调用的延迟 (秒)")
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="假 LLM 每次调用的延迟 (秒)")
+    parser.add_argument("--warm-pages", action="store_true", help="不在档位之间清空截图缓存")
+    parser.add_argument("--writer", action="store_true", help="压测期间后台持续入库")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="结果写入该 JSON 文件")
+    args = parser.parse_args()
+
+    args.json = os.path.abspath(args.json) if args.json else None
+    # 每个问题都要真正走完检索链路，不能被答案缓存短路
+    os.environ["ANSWER_CACHE_ENABLED"] = "0"
+    workdir = use_temp_workdir("rag_load_")
+
+    from llama_index.core import Settings
+    from benchmarks.fakes import FakeEmbedding, FakeLLM
+    from benchmarks.run_benchmark import build_corpus, run_ingest
+    from modules.database import init_db
+
+    Settings.embedding = FakeEmbedding(latency=args.embed_latency)
+    Settings.llm = FakeLLM(latency=args.llm_latency)
+    init_db()
+
+    data_dir = os.path.join(workdir, "data")
+    facts = build_corpus(data_dir, args.docs, args.pages, seed=args.seed)
+    ingest = run_ingest(data_dir)
+    pdf_map = {name: os.path.join(data_dir, name) for name in os.listdir(data_dir)}
+    print(f"📦 语料 {args.docs} 个 PDF x {args.pages} 页，入库 {ingest['wall_seconds']:.1f}s (工作目录 {workdir})")
+
+    rng = random.Random(args.seed)
+    stop_event = threading.Event()
+    writes = {"ok": 0, "failed": 0}
+    if args.writer:
+        threading.Thread(target=writer_loop, args=(data_dir, stop_event, writes), daemon=True).start()
+
+    levels = []
+    try:
+        for concurrency in [int(c) for c in args.concurrency.split(",") if c.strip()]:
+            if not args.warm_pages:
+                clear_page_cache(pdf_map)
+            questions = [rng.choice(facts)["question"] for _ in range(args.queries)]
+            result = run_level(questions, pdf_map, concurrency)
+            levels.append(result)
+            print(f"👥 并发 {concurrency:>3} | {result['queries_per_second']:6.2f} 问/秒 | "
+                  f"p50 {result['latency']['p50_ms']:7.0f} ms | p95 {result['latency']['p95_ms']:7.0f} ms | "
+                  f"首字 p50 {result['ttft']['p50_ms']:7.0f} ms | 错误 {result['error_count']}")
+    finally:
+        stop_event.set()
+    if args.writer:
+        print(f"✍️ 压测期间入库 {writes['ok']} 次，失败 {writes['failed']} 次")
+
+    result = {
+        "meta": {"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"), "args": vars(args)},
+        "levels": levels,
+        "writes": writes if args.writer else None,
+    }
+    text = dump_json(result, args.json)
+    if not args.json:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
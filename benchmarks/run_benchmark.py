@@ -0,0 +1,309 @@
+# --- START OF FILE run_benchmark.py ---
+# 离线检索评测：合成 PDF 语料 -> process_single_file 入库 -> 问题集按 query_with_vision 的各阶段计时
+# 输出：各阶段延迟分位数、吞吐、峰值内存、recall@k / MRR (重排前 / 重排后)、截图命中率，写成 JSON 便于追踪回归
+# 默认全部使用确定性的假模型 (FakeEmbedding / FakeLLM)，不访问网络；--reranker 时加载真实的 CrossEncoder
+#
+# 用法: python -m benchmarks.run_benchmark --docs 10 --pages 8 --questions 60 --json bench.json
+#       python -m benchmarks.run_benchmark --dense-top-k 30 --rerank-top-n 8 --max-images 3 --baseline bench.json
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import subprocess
+
+from benchmarks.common import ROOT, use_temp_workdir, summarize, dump_json
+
+RECALL_KS = (1, 3, 5, 10)
+
+_FILLER = [
+    "本章说明设备的日常巡检、润滑与清洁要求，操作人员应按照检修周期记录运行参数。",
+    "如发现温度异常或报警灯闪烁，应立即停机并联系维护工程师。",
+    "更换备件前请确认电源已断开，并使用规定扭矩紧固螺栓。",
+    "The maintenance log must be signed by the on-duty engineer after each inspection.",
+]
+
+
+def apply_overrides(args):
+    """config 在导入时读取环境变量，所以要在导入业务模块之前设置"""
+    os.environ["DENSE_TOP_K"] = str(args.dense_top_k)
+    os.environ["RERANK_TOP_N"] = str(args.rerank_top_n)
+    os.environ["HYBRID_ENABLED"] = "1" if args.hybrid else "0"
+    os.environ["CONTEXT_TOKEN_BUDGET"] = str(args.context_budget)
+    # 评测每个问题都要真正走完检索链路，不能被答案缓存短路
+    os.environ["ANSWER_CACHE_ENABLED"] = "0"
+
+
+def build_corpus(directory, docs, pages, seed=0):
+    """
+    生成带标准答案的 PDF 语料：每页描述一台设备 (唯一编号 + 额定电压 + 检修周期)，其余是各页共有的干扰文字。
+    返回 [{"question", "filename", "page"(从 1 开始), "answer"}, ...]
+    """
+    import fitz
+
+    rng = random.Random(seed)
+    os.makedirs(directory, exist_ok=True)
+    facts = []
+    for d in range(docs):
+        filename = f"manual_{d:03d}.pdf"
+        pdf = fitz.open()
+        for p in range(pages):
+            device = f"DEV-{d:03d}{p:03d}"
+            voltage = rng.randint(110, 990)
+            months = rng.randint(3, 24)
+            lines = [
+                f"第 {p + 1} 章  设备 {device} 维护说明",
+                f"设备 {device} 的额定电压为 {voltage} V，检修周期为 {months} 个月。",
+            ] + rng.sample(_FILLER, 3)
+            page = pdf.new_page()
+            page.insert_textbox(fitz.Rect(50, 60, 550, 780), "\n".join(lines), fontname="china-s", fontsize=11)
+            facts.append({
+                "question": f"{device} 的额定电压是多少？",
+                "filename": filename,
+                "page": p + 1,
+                "answer": str(voltage),
+            })
+        pdf.save(os.path.join(directory, filename))
+        pdf.close()
+    return facts
+
+
+def _hit_rank(nodes, fact):
+    """标准答案所在页第一次出现的名次 (从 1 开始)，没出现返回 None"""
+    from modules.rag_engine import node_pages
+
+    for rank, n in enumerate(nodes, start=1):
+        if n.metadata.get("filename") == fact["filename"] and fact["page"] - 1 in node_pages(n.metadata)[1]:
+            return rank
+    return None
+
+
+def _ranking_metrics(ranks):
+    total = len(ranks) or 1
+    metrics = {f"recall@{k}": sum(1 for r in ranks if r and r <= k) / total for k in RECALL_KS}
+    metrics["mrr"] = sum(1.0 / r for r in ranks if r) / total
+    return metrics
+
+
+def run_ingest(data_dir):
+    """逐个文件入库，按 on_stage 回调切分各阶段耗时；附上入库流水线各阶段的吞吐 / 排队统计"""
+    from modules.ingestion import process_single_file
+    from modules.pipeline import get_pipeline
+
+    stage_seconds = {}
+    files = sorted(os.listdir(data_dir))
+    pages = 0
+    failed = []
+    t_all = time.perf_counter()
+    for name in files:
+        marks = []
+        t0 = time.perf_counter()
+        ok, msg, page_count = process_single_file(
+            os.path.join(data_dir, name), on_stage=lambda stage: marks.append((stage, time.perf_counter()))
+        )
+        end = time.perf_counter()
+        for (stage, start), (_, stop) in zip(marks, marks[1:] + [(None, end)]):
+            stage_seconds.setdefault(stage, []).append(stop - start)
+        stage_seconds.setdefault("total", []).append(end - t0)
+        pages += page_count
+        if not ok:
+            failed.append({"file": name, "message": msg})
+    wall = time.perf_counter() - t_all
+    return {
+        "files": len(files),
+        "pages": pages,
+        "failed": failed,
+        "wall_seconds": wall,
+        "pages_per_second": pages / wall if wall else 0.0,
+        "stages": {stage: summarize(values) for stage, values in stage_seconds.items()},
+        "pipeline": get_pipeline().stats(),
+    }
+
+
+def check_ingest(ingest):
+    """入库有失败或检索器建不起来时，问答指标没有意义：给出原因并以非零状态退出"""
+    from modules.rag_engine import get_retriever_engine
+
+    for item in ingest["failed"]:
+        print(f"❌ 入库失败: {item['file']}: {item['message']}")
+    if ingest["failed"]:
+        sys.exit(f"入库失败 {len(ingest['failed'])}/{ingest['files']} 个文件，终止评测")
+    if get_retriever_engine() is None:
+        sys.exit("检索器不可用 (向量库为空或集合不存在)，终止评测")
+
+
+def run_queries(facts, pdf_map, use_reranker, max_images):
+    """按 query_with_vision 的顺序执行各阶段并分别计时 (检索 -> 重排 -> 整理上下文 -> 截图 -> LLM)"""
+    from llama_index.core import Settings
+    from modules.rag_engine import get_retriever_engine, get_reranker, build_context, render_pages, build_prompt
+    from modules.retrieval import HybridRetriever
+    from modules.context_packer import rank_pages
+    from config import RERANK_TOP_N
+
+    reranker = get_reranker() if use_reranker else None
+    if use_reranker and reranker is None:
+        raise RuntimeError("Reranker 加载失败 (需要 sentence-transformers 和模型文件)")
+
+    stage_seconds = {name: [] for name in ("retrieve", "rerank", "context", "render", "llm", "total")}
+    retrieved_ranks, final_ranks, image_hits = [], [], 0
+    context_tokens = []
+    t_all = time.perf_counter()
+    for fact in facts:
+        query = fact["question"]
+        t0 = time.perf_counter()
+
+        t = time.perf_counter()
+        retriever = get_retriever_engine()
+        nodes = retriever.retrieve(query)
+        stage_seconds["retrieve"].append(time.perf_counter() - t)
+
+        t = time.perf_counter()
+        if reranker:
+            final = reranker.postprocess_nodes(
+                nodes, query_str=query, allow_skip=not isinstance(retriever, HybridRetriever)
+            )
+        else:
+            final = nodes[:RERANK_TOP_N]
+        stage_seconds["rerank"].append(time.perf_counter() - t)
+
+        t = time.perf_counter()
+        image_docs, rendered = render_pages(rank_pages(final, max_images), pdf_map, max_images=max_images)
+        stage_seconds["render"].append(time.perf_counter() - t)
+
+        t = time.perf_counter()
+        context_str, image_docs, rendered, _, packed = build_context(final, image_docs, rendered)
+        stage_seconds["context"].append(time.perf_counter() - t)
+        context_tokens.append(packed["total_tokens"])
+
+        t = time.perf_counter()
+        for _ in Settings.llm.stream_complete(build_prompt(query, context_str), image_documents=image_docs):
+            pass
+        stage_seconds["llm"].append(time.perf_counter() - t)
+        stage_seconds["total"].append(time.perf_counter() - t0)
+
+        retrieved_ranks.append(_hit_rank(nodes, fact))
+        final_ranks.append(_hit_rank(final, fact))
+        image_hits += (fact["filename"], fact["page"] - 1) in rendered
+    wall = time.perf_counter() - t_all
+
+    return {
+        "questions": len(facts),
+        "wall_seconds": wall,
+        "queries_per_second": len(facts) / wall if wall else 0.0,
+        "stages": {stage: summarize(values) for stage, values in stage_seconds.items()},
+        "retrieval": _ranking_metrics(retrieved_ranks),
+        "final": _ranking_metrics(final_ranks),
+        "image_hit_rate": image_hits / (len(facts) or 1),
+        "context_tokens": {
+            "mean": sum(context_tokens) / (len(context_tokens) or 1),
+            "max": max(context_tokens, default=0),
+        },
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                              capture_output=True, text=True, timeout=10).stdout.strip() or None
+    except Exception:
+        return None
+
+
+def compare(baseline, current, tolerance=0.1, min_delta_ms=1.0):
+    """与基线结果对比：延迟 p95 变慢超过 tolerance (且至少 min_delta_ms，忽略亚毫秒抖动)、召回 / MRR 下降即列为回归"""
+    regressions = []
+    for section in ("ingest", "query"):
+        for stage, s in current[section]["stages"].items():
+            old = baseline.get(section, {}).get("stages", {}).get(stage)
+            if old and s["p95_ms"] - old["p95_ms"] > max(old["p95_ms"] * tolerance, min_delta_ms):
+                regressions.append(f"{section}.{stage} p95 {old['p95_ms']:.1f} -> {s['p95_ms']:.1f} ms")
+    for group in ("retrieval", "final"):
+        for metric, value in current["query"][group].items():
+            old = baseline.get("query", {}).get(group, {}).get(metric)
+            if old is not None and value < old - 1e-9:
+                regressions.append(f"{group}.{metric} {old:.3f} -> {value:.3f}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="离线检索评测")
+    parser.add_argument("--docs", type=int, default=10, help="PDF 个数")
+    parser.add_argument("--pages", type=int, default=8, help="每个 PDF 的页数")
+    parser.add_argument("--questions", type=int, default=60, help="问题数 (从标准答案里抽样)")
+    parser.add_argument("--dense-top-k", type=int, default=20, help="向量初筛条数 (DENSE_TOP_K)")
+    parser.add_argument("--rerank-top-n", type=int, default=5, help="重排后保留条数 (RERANK_TOP_N)")
+    parser.add_argument("--max-images", type=int, default=2, help="每个问题最多截图页数")
+    parser.add_argument("--context-budget", type=int, default=8000, help="上下文 token 预算 (CONTEXT_TOKEN_BUDGET)")
+    parser.add_argument("--no-hybrid", dest="hybrid", action="store_false", help="关闭 BM25 混合检索")
+    parser.add_argument("--reranker", action="store_true", help="使用真实的 CrossEncoder 重排 (否则按初筛顺序截断)")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="假 LLM 每次调用的延迟 (秒)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="结果写入该 JSON 文件")
+    parser.add_argument("--baseline", help="与之前的结果 JSON 对比，列出回归项")
+    args = parser.parse_args()
+
+    # 结果路径在切换工作目录之前解析
+    args.json = os.path.abspath(args.json) if args.json else None
+    args.baseline = os.path.abspath(args.baseline) if args.baseline else None
+    apply_overrides(args)
+    workdir = use_temp_workdir()
+
+    from llama_index.core import Settings
+    from benchmarks.fakes import FakeEmbedding, FakeLLM
+    from modules.memory_guard import MemoryGuard
+
+    Settings.embedding = FakeEmbedding()
+    Settings.llm = FakeLLM(latency=args.llm_latency)
+
+    from modules.database import init_db
+
+    init_db()
+    data_dir = os.path.join(workdir, "data")
+    facts = build_corpus(data_dir, args.docs, args.pages, seed=args.seed)
+    questions = random.Random(args.seed).sample(facts, min(args.questions, len(facts)))
+    pdf_map = {name: os.path.join(data_dir, name) for name in os.listdir(data_dir)}
+    print(f"📦 语料 {args.docs} 个 PDF x {args.pages} 页，问题 {len(questions)} 个 (工作目录 {workdir})")
+
+    with MemoryGuard() as guard:
+        ingest = run_ingest(data_dir)
+        check_ingest(ingest)
+        query = run_queries(questions, pdf_map, args.reranker, args.max_images)
+
+    result = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "commit": git_commit(),
+            "args": vars(args),
+        },
+        "ingest": ingest,
+        "query": query,
+        "memory": {"start_rss_mb": guard.start_mb, "peak_rss_mb": guard.peak_mb},
+    }
+
+    print(f"📥 入库 {ingest['files']} 个文件 / {ingest['pages']} 页，{ingest['pages_per_second']:.1f} 页/秒，失败 {len(ingest['failed'])}")
+    print(f"❓ 问答 {query['questions']} 个，{query['queries_per_second']:.1f} 问/秒")
+    for stage, s in query["stages"].items():
+        print(f"   {stage:<9} p50 {s['p50_ms']:8.2f} ms | p95 {s['p95_ms']:8.2f} ms")
+    for group, label in (("retrieval", "初筛"), ("final", "重排后")):
+        metrics = " | ".join(f"{k} {v:.3f}" for k, v in query[group].items())
+        print(f"🎯 {label}: {metrics}")
+    print(f"🖼️ 截图命中率 {query['image_hit_rate']:.3f} | 📦 上下文平均 {query['context_tokens']['mean']:.0f} token "
+          f"(最多 {query['context_tokens']['max']}) | 💾 峰值内存 {guard.peak_mb:.0f} MB")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            result["regressions"] = compare(json.load(f), result)
+        for item in result["regressions"]:
+            print(f"⚠️ 回归: {item}")
+        if not result["regressions"]:
+            print("✅ 与基线相比没有回归")
+
+    text = dump_json(result, args.json)
+    if not args.json:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,7 @@
 # --- START OF FILE config.py ---
 
 import os
-from llama_index.llms.google_genai import GoogleGenAI
-from llama_index.embeddings.google_genai import GoogleGenAIEmbedding
-from llama_index.core import Settings
+import threading
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -30,12 +28,225 @@ EMBED_MODEL_NAME = os.getenv("EMBED_MODEL_NAME", "models/text-embedding-004")
 
 # Rerank 模型
 RERANK_MODEL_NAME = os.getenv("RERANK_MODEL_NAME", "BAAI/bge-reranker-v2-m3")
+# Rerank 推理参数：backend 可选 int8 (CPU 动态量化) / onnx / none
+RERANK_BACKEND = os.getenv("RERANK_BACKEND", "int8")
+RERANK_TOP_N = int(os.getenv("RERANK_TOP_N", "5"))
+RERANK_BATCH_SIZE = int(os.getenv("RERANK_BATCH_SIZE", "16"))
+RERANK_MAX_LENGTH = int(os.getenv("RERANK_MAX_LENGTH", "512"))
+# 自适应预算：最多重排多少条候选；第 top_n 名与下一名的向量分差超过该值就跳过重排 (0 表示从不跳过)
+# 分差只在纯向量检索 (HYBRID_ENABLED=0) 时判断，混合检索的 RRF 融合分总是重排
+RERANK_MAX_CANDIDATES = int(os.getenv("RERANK_MAX_CANDIDATES", "20"))
+RERANK_SKIP_MARGIN = float(os.getenv("RERANK_SKIP_MARGIN", "0.15"))
+RERANK_CACHE_SIZE = int(os.getenv("RERANK_CACHE_SIZE", "5000"))
+
+# --- 3. 向量缓存 ---
+# 持久化缓存 (SQLite)，入库和查询的 Embedding 都先查这里；留空则关闭缓存
+EMBED_CACHE_PATH = os.getenv("EMBED_CACHE_PATH", "embed_cache.db")
+EMBED_CACHE_MAX_ENTRIES = int(os.getenv("EMBED_CACHE_MAX_ENTRIES", "200000"))
+
+# --- 4. 页面截图缓存 (VisRAG) ---
+PAGE_CACHE_DIR = os.getenv("PAGE_CACHE_DIR", "page_cache")
+PAGE_CACHE_MEMORY_MB = int(os.getenv("PAGE_CACHE_MEMORY_MB", "256"))
+PAGE_IMAGE_DPI = int(os.getenv("PAGE_IMAGE_DPI", "150"))
+# 截图格式：png (无损) / jpeg / webp；有损格式可设目标大小 (KB，0 表示只按固定质量压缩)
+PAGE_IMAGE_FORMAT = os.getenv("PAGE_IMAGE_FORMAT", "png").lower()
+PAGE_IMAGE_QUALITY = int(os.getenv("PAGE_IMAGE_QUALITY", "80"))
+PAGE_IMAGE_TARGET_KB = int(os.getenv("PAGE_IMAGE_TARGET_KB", "0"))
+# 渲染子进程数：每个子进程有自己的 PyMuPDF，多页同时光栅化和编码 (0 表示在调用线程里渲染，光栅化在进程内串行)
+PAGE_RENDER_PROCESSES = int(os.getenv("PAGE_RENDER_PROCESSES", "2"))
+# 入库时预渲染前 N 页 (0 关闭，-1 全部)
+PAGE_PRERENDER_PAGES = int(os.getenv("PAGE_PRERENDER_PAGES", "0"))
+
+# --- 5. 问答结果缓存 ---
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "1") == "1"
+# 问题向量余弦相似度达到该阈值才算语义命中 (越高越保守)
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+ANSWER_CACHE_TTL = int(os.getenv("ANSWER_CACHE_TTL", "3600"))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "1000"))
+
+# --- 6. 混合检索 (BM25 + 向量) ---
+HYBRID_ENABLED = os.getenv("HYBRID_ENABLED", "1") == "1"
+SPARSE_INDEX_PATH = os.getenv("SPARSE_INDEX_PATH", "sparse_index.db")
+DENSE_TOP_K = int(os.getenv("DENSE_TOP_K", "20"))
+SPARSE_TOP_K = int(os.getenv("SPARSE_TOP_K", "20"))
+# RRF 融合后交给重排序的候选数 (比单路向量检索的 20 条更少)
+HYBRID_TOP_K = int(os.getenv("HYBRID_TOP_K", "12"))
+RRF_K = int(os.getenv("RRF_K", "60"))
+
+# --- 7. 后台入库任务 ---
+# Qdrant 服务地址 (如 http://localhost:6333)；留空则使用本地目录 (同一时间只能被一个进程打开，见第 18 节)
+QDRANT_URL = os.getenv("QDRANT_URL", "")
+# 向量库连接方式 (其余连接参数见第 18 节)：
+# embedded: 本地目录 (有文件锁，只能一个进程打开：前端 + thread 模式 worker，命令行工具要先停前端)
+# server:   Qdrant 服务 (QDRANT_URL)，多个前端进程 / 入库 worker 进程 / 命令行工具可以同时连接
+# memory:   进程内内存库，不落盘，测试 / 压测用的替身 (corpus.db 等仍在磁盘上，每次要用新的工作目录)
+QDRANT_MODE = os.getenv("QDRANT_MODE", "server" if QDRANT_URL else "embedded")
+# thread: 前端进程内起后台线程消费任务；process: 由 `python -m modules.worker` 单独起进程池 (需要 QDRANT_MODE=server)
+INGEST_WORKER_MODE = os.getenv("INGEST_WORKER_MODE", "process" if QDRANT_MODE == "server" else "thread")
+# 同时入库的文件数 (thread 模式的后台线程数 / process 模式的 worker 进程数)
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "4"))
+# 入库流水线各阶段同时处理的数量 (见 modules/pipeline.py)：解析走进程池 (CPU 密集，每个进程各加载一份 Docling 模型，
+# 0 表示在 worker 线程里串行解析)，元数据 / 向量化 / 写入在 worker 线程里执行 (网络 IO)
+# process 模式的 worker 进程各自串行解析，不再开解析子进程
+INGEST_PARSE_WORKERS = int(os.getenv("INGEST_PARSE_WORKERS", "2"))
+INGEST_METADATA_WORKERS = int(os.getenv("INGEST_METADATA_WORKERS", "4"))
+INGEST_EMBED_WORKERS = int(os.getenv("INGEST_EMBED_WORKERS", "2"))
+INGEST_UPSERT_WORKERS = int(os.getenv("INGEST_UPSERT_WORKERS", "1"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+# 失败重试的退避：base * 2^(已尝试次数-1) 秒，最多 max 秒
+JOB_RETRY_BASE_SECONDS = float(os.getenv("JOB_RETRY_BASE_SECONDS", "10"))
+JOB_RETRY_MAX_SECONDS = float(os.getenv("JOB_RETRY_MAX_SECONDS", "600"))
+# worker 超过这么久没有心跳，视为崩溃，任务重新排队
+JOB_HEARTBEAT_TIMEOUT = float(os.getenv("JOB_HEARTBEAT_TIMEOUT", "300"))
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "1.0"))
+
+# --- 8. 大文件流式解析 ---
+# 页数达到该值的 PDF 按页窗口分段解析、边解析边入库 (0 表示所有 PDF 都走流式)
+STREAM_PARSE_MIN_PAGES = int(os.getenv("STREAM_PARSE_MIN_PAGES", "200"))
+PARSE_WINDOW_PAGES = int(os.getenv("PARSE_WINDOW_PAGES", "20"))
+# 流式入库时每批向量化/写入的块数
+STREAM_EMBED_BATCH = int(os.getenv("STREAM_EMBED_BATCH", "128"))
+# 单个文件入库期间的内存增长上限 (MB，相对开始处理该文件时的进程 RSS，另加解析子进程里当前窗口的解析内存)：
+# 超过后缩小解析窗口，窗口已是 1 页仍超出则放弃该文件；0 表示不限制。前端进程里常驻的模型和缓存不计入
+PARSE_MAX_RSS_MB = int(os.getenv("PARSE_MAX_RSS_MB", "4096"))
+
+# --- 9. 结构化分块 ---
+# 用哪个分词器计 token (HuggingFace 模型名)，默认与重排序模型一致
+CHUNK_TOKENIZER = os.getenv("CHUNK_TOKENIZER", RERANK_MODEL_NAME)
+# 每块 token 上限：默认为重排序 max_length 减去给问题预留的 64 个 token (也远低于 Embedding 模型的输入上限)
+CHUNK_MAX_TOKENS = int(os.getenv("CHUNK_MAX_TOKENS", str(RERANK_MAX_LENGTH - 64)))
+
+# --- 10. Embedding 请求调度 ---
+# 单次 API 请求最多多少条文本 / 多少 token (按字数估算，0 表示不限制)
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "100"))
+EMBED_BATCH_MAX_TOKENS = int(os.getenv("EMBED_BATCH_MAX_TOKENS", "0"))
+EMBED_MAX_CONCURRENCY = int(os.getenv("EMBED_MAX_CONCURRENCY", "4"))
+# 配额：每分钟请求数 / token 数 (0 表示不限流)；遇到 429 会自动降速后逐步恢复
+EMBED_RPM = int(os.getenv("EMBED_RPM", "1500"))
+EMBED_TPM = int(os.getenv("EMBED_TPM", "0"))
+EMBED_MAX_RETRIES = int(os.getenv("EMBED_MAX_RETRIES", "6"))
+# 攒批等待时间：等一小会儿，让同时入库的其他文件的块进入同一批
+EMBED_BATCH_LINGER_MS = int(os.getenv("EMBED_BATCH_LINGER_MS", "20"))
+
+# --- 11. 元数据提取 ---
+# 同时在途的 LLM 请求数
+METADATA_MAX_WORKERS = int(os.getenv("METADATA_MAX_WORKERS", "4"))
+# 小文档打包：预览不超过 METADATA_SMALL_DOC_CHARS 字的文档，一次请求最多打包 METADATA_BATCH_DOCS 个 / 共 METADATA_BATCH_CHARS 字
+METADATA_SMALL_DOC_CHARS = int(os.getenv("METADATA_SMALL_DOC_CHARS", "1500"))
+METADATA_BATCH_DOCS = int(os.getenv("METADATA_BATCH_DOCS", "8"))
+METADATA_BATCH_CHARS = int(os.getenv("METADATA_BATCH_CHARS", "8000"))
+# 单个文档送给 LLM 的最大字数
+METADATA_DOC_CHARS = int(os.getenv("METADATA_DOC_CHARS", "3000"))
+# 校验失败的文档单独重试的次数
+METADATA_MAX_RETRIES = int(os.getenv("METADATA_MAX_RETRIES", "1"))
+# 攒批等待时间：并行入库的多个文件在这段时间内提交的请求会被打包
+METADATA_LINGER_MS = int(os.getenv("METADATA_LINGER_MS", "200"))
+# 入库线程最多等多久 (秒)，超时按默认元数据继续入库 (调度线程异常时不会一直卡住)
+METADATA_TIMEOUT = float(os.getenv("METADATA_TIMEOUT", "300"))
+
+# --- 12. 向量库索引与检索过滤 ---
+# HNSW 参数 (集合创建时使用；已有集合启动时同步)，查询时的 ef
+QDRANT_HNSW_M = int(os.getenv("QDRANT_HNSW_M", "16"))
+QDRANT_HNSW_EF_CONSTRUCT = int(os.getenv("QDRANT_HNSW_EF_CONSTRUCT", "128"))
+QDRANT_HNSW_EF = int(os.getenv("QDRANT_HNSW_EF", "128"))
+# 过滤后候选少于该值 (KB) 时直接全量扫描，比走图更快
+QDRANT_FULL_SCAN_THRESHOLD = int(os.getenv("QDRANT_FULL_SCAN_THRESHOLD", "10000"))
+# 从问题里识别文件名 / 文档类型 / 年月作为过滤条件 (过滤后无结果时自动放开)
+QUERY_FILTER_PARSING = os.getenv("QUERY_FILTER_PARSING", "1") == "1"
+# 只提去掉扩展名的文件名时，至少这么多个字符才算指定了文件 ("a"、"report"、"合同" 这类短名太容易误中)
+QUERY_FILENAME_MIN_STEM = int(os.getenv("QUERY_FILENAME_MIN_STEM", "8"))
+
+# --- 13. 向量量化与存储布局 ---
+# 量化方式: scalar (int8，内存约 1/4) / binary (1 bit，约 1/32，适合 >=768 维) / none
+# 已有集合改布局需要离线迁移: python -m modules.vector_store migrate
+QDRANT_QUANTIZATION = os.getenv("QDRANT_QUANTIZATION", "scalar")
+# 原始 float32 向量放磁盘，量化向量常驻内存
+QDRANT_VECTORS_ON_DISK = os.getenv("QDRANT_VECTORS_ON_DISK", "1") == "1"
+# 检索时先用量化向量多取 oversampling 倍候选，再用原始向量重新打分 (rescore)
+QDRANT_OVERSAMPLING = float(os.getenv("QDRANT_OVERSAMPLING", "2.0"))
+QDRANT_RESCORE = os.getenv("QDRANT_RESCORE", "1") == "1"
+
+# --- 14. 运行指标 ---
+# Prometheus 抓取端口 (0 表示不开)，GET /metrics
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+# 定期写入的指标文件 (node_exporter textfile collector)，可含 {pid}；空表示不写
+METRICS_FILE = os.getenv("METRICS_FILE", "")
+METRICS_FILE_INTERVAL = float(os.getenv("METRICS_FILE_INTERVAL", "15"))
+# 保留最近多少条问答 / 入库链路记录 (监控页展示)
+METRICS_TRACE_HISTORY = int(os.getenv("METRICS_TRACE_HISTORY", "200"))
+
+# --- 15. 启动与预热 ---
+# 登录后在后台线程预热的组件 (逗号分隔，留空不预热)：reranker (加载 Cross-Encoder 并试打分) /
+# retriever (连接向量库、建检索器) / parser (加载 Docling 模型和分词器，只在 thread 模式的入库 worker 下生效)
+WARMUP_TARGETS = [t.strip() for t in os.getenv("WARMUP_TARGETS", "reranker,retriever,parser").split(",") if t.strip()]
+
+# --- 16. 查询并发 ---
+# 查询链路共用的线程池：页面截图、BM25 检索与向量检索并行 (所有会话共享)
+QUERY_WORKERS = int(os.getenv("QUERY_WORKERS", "8"))
+# 向量初筛结果出来后、重排序进行的同时，预先渲染排名靠前的候选页 (0 表示不预取)
+QUERY_PREFETCH_PAGES = int(os.getenv("QUERY_PREFETCH_PAGES", "4"))
+
+# --- 17. 上下文组装 ---
+# 发给 Gemini 的上下文 (文本 + 附图) 的 token 预算 (估算值)
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "8000"))
+# 最多附几张页面截图 (按所在页最高的重排序分数挑选)；附图最多占预算的比例
+CONTEXT_MAX_IMAGES = int(os.getenv("CONTEXT_MAX_IMAGES", "2"))
+CONTEXT_IMAGE_BUDGET_RATIO = float(os.getenv("CONTEXT_IMAGE_BUDGET_RATIO", "0.6"))
+# 两个片段字符 3-gram 的重合度 (交集 / 较小一方) 超过该值视为重复，只保留分数高的
+CONTEXT_DEDUP_THRESHOLD = float(os.getenv("CONTEXT_DEDUP_THRESHOLD", "0.8"))
+# 所在页已经作为截图附上的片段不再重复放文本
+CONTEXT_DROP_COVERED = os.getenv("CONTEXT_DROP_COVERED", "1") == "1"
+
+# --- 18. 向量库连接 ---
+# QDRANT_URL / QDRANT_MODE 见第 7 节
+QDRANT_PATH = os.getenv("QDRANT_PATH", "./storage_db")
+QDRANT_API_KEY = os.getenv("QDRANT_API_KEY", "")
+QDRANT_TIMEOUT = int(os.getenv("QDRANT_TIMEOUT", "30"))
+# 服务模式下用 gRPC (端口 QDRANT_GRPC_PORT)，批量写入和检索比 REST 省序列化开销
+QDRANT_PREFER_GRPC = os.getenv("QDRANT_PREFER_GRPC", "0") == "1"
+QDRANT_GRPC_PORT = int(os.getenv("QDRANT_GRPC_PORT", "6334"))
+# 每个进程到服务端的连接池大小 (HTTP 连接数 / gRPC 通道数)，一般不小于 QUERY_WORKERS
+QDRANT_POOL_SIZE = int(os.getenv("QDRANT_POOL_SIZE", "8"))
+# 入库写入每批点数；服务模式下可以用多个进程并行上传 (upload_points 的 parallel)
+QDRANT_UPSERT_BATCH = int(os.getenv("QDRANT_UPSERT_BATCH", "256"))
+QDRANT_UPSERT_PARALLEL = int(os.getenv("QDRANT_UPSERT_PARALLEL", "1"))
+# 服务模式 (集群) 下新建集合的分片数 / 副本数，只在建集合时生效
+QDRANT_SHARDS = int(os.getenv("QDRANT_SHARDS", "1"))
+QDRANT_REPLICATION_FACTOR = int(os.getenv("QDRANT_REPLICATION_FACTOR", "1"))
+# `python -m modules.vector_store serve` 启动本机 Qdrant 可执行文件 (不需要 Docker) 时使用
+QDRANT_BINARY = os.getenv("QDRANT_BINARY", "qdrant")
+QDRANT_SERVER_STORAGE = os.getenv("QDRANT_SERVER_STORAGE", "./qdrant_server")
+
+# --- 19. 文档目录 ---
+# 前端进程内存里的文档目录多久检查一次变更 (秒)；每次检查只是一条按主键取最大序号的查询
+CATALOG_REFRESH_INTERVAL = float(os.getenv("CATALOG_REFRESH_INTERVAL", "1.0"))
+# 变更日志保留条数，落后更多的进程全量重读
+CATALOG_EVENT_RETENTION = int(os.getenv("CATALOG_EVENT_RETENTION", "20000"))
+
+# 模型客户端每个进程只建一次 (Streamlit 每次 rerun 都会走到 init_settings)
+_settings_lock = threading.Lock()
+_settings_ready = False
 
 def init_settings():
-    """初始化 LlamaIndex 全局设置 (Google 原生模式)"""
+    """初始化 LlamaIndex 全局设置 (Google 原生模式)，每个进程只执行一次"""
+    global _settings_ready
+    if _settings_ready:
+        return
+    with _settings_lock:
+        if _settings_ready:
+            return
+        _init_settings()
+        _settings_ready = True
+
+def _init_settings():
     if not API_KEY:
         raise ValueError("❌ 未找到 GOOGLE_API_KEY，请检查 .env 文件！")
 
+    # LlamaIndex / Google SDK 导入较慢，放到真正初始化时再导入 (登录页、worker 监督进程用不到)
+    from llama_index.core import Settings
+    from llama_index.llms.google_genai import GoogleGenAI
+    from llama_index.embeddings.google_genai import GoogleGenAIEmbedding
+
     print(f"🚀 初始化 Google 原生 SDK 模式...")
     print(f"🧠 LLM: {LLM_MODEL_NAME}")
     print(f"🧬 Embedding: {EMBED_MODEL_NAME}")
@@ -50,11 +261,43 @@ def init_settings():
             # Google 原生 SDK 不需要像 OpenAI 那样显式配置 http_client，它会自动读取 os.environ
         )
 
-        # 2. 初始化 Embedding
-        Settings.embedding = GoogleGenAIEmbedding(
+        from modules.embed_scheduler import EmbeddingScheduler
+
+        # 2. 初始化 Embedding (批大小与调度器一致：调度器的一批就是一次 API 请求)
+        embed_model = GoogleGenAIEmbedding(
             model_name=EMBED_MODEL_NAME,
-            api_key=API_KEY
+            api_key=API_KEY,
+            embed_batch_size=EMBED_BATCH_SIZE,
+        )
+
+        # 3. 批量调度器：跨文件攒批、限流、429 退避
+        scheduler = EmbeddingScheduler(
+            embed_model,
+            max_batch_size=EMBED_BATCH_SIZE,
+            max_batch_tokens=EMBED_BATCH_MAX_TOKENS,
+            max_concurrency=EMBED_MAX_CONCURRENCY,
+            requests_per_minute=EMBED_RPM,
+            tokens_per_minute=EMBED_TPM,
+            max_retries=EMBED_MAX_RETRIES,
+            linger_ms=EMBED_BATCH_LINGER_MS,
         )
+        embed_model = scheduler
+
+        # 4. 最外层是持久化向量缓存 (入库 / 查询都经过 Settings.embedding)：
+        #    命中的文本不进调度队列、不占限流额度，已缓存的语料重新入库不会被当成冷启动限速
+        if EMBED_CACHE_PATH:
+            from modules.embed_cache import CachedEmbedding, get_cache_store
+            store = get_cache_store(EMBED_CACHE_PATH, EMBED_CACHE_MAX_ENTRIES)
+            embed_model = CachedEmbedding(scheduler, store)
+            print(f"🗃️ 向量缓存: {EMBED_CACHE_PATH} (已缓存 {store.stats()['entries']} 条)")
+
+        Settings.embedding = embed_model
+
+        # 调度器 / 缓存的统计挂到运行指标上
+        from modules.telemetry import register_collector
+        register_collector("embed_scheduler", scheduler.stats)
+        if EMBED_CACHE_PATH:
+            register_collector("embed_cache", store.stats)
         
         print(f"✅ 模型初始化成功 (Device: {DEVICE})")
         
@@ -0,0 +1,216 @@
+# --- START OF FILE answer_cache.py ---
+
+import re
+import time
+import hashlib
+import threading
+import unicodedata
+from collections import OrderedDict
+
+import numpy as np
+
+from modules.telemetry import register_collector
+from modules.database import get_generation_changes
+from config import ANSWER_CACHE_THRESHOLD, ANSWER_CACHE_TTL, ANSWER_CACHE_MAX_ENTRIES
+
+_TRAILING_PUNCT = re.compile(r"[\s\?？!！。.,，~～]+$")
+
+
+def normalize_query(text):
+    """精确匹配用的归一化：全角半角统一、压缩空白、小写、去掉结尾标点"""
+    text = " ".join(unicodedata.normalize("NFKC", text).split()).lower()
+    return _TRAILING_PUNCT.sub("", text)
+
+
+def make_scope(generation, doc_names, filters_key="", filenames=None):
+    """
+    缓存作用域：(向量库世代号, 文档范围, 检索条件摘要)。
+    filenames 为过滤条件限定的文件 (答案只可能来自这些文件)，文档范围就是它们；为空时范围是全部文档 (None)，
+    摘要里带上全部可用文档，文档增删后不再命中。世代号不参与匹配，只用来发现向量库的变化。
+    """
+    docs = frozenset(filenames) if filenames else None
+    names = sorted(docs if docs is not None else doc_names)
+    digest = hashlib.sha256(("\n".join(names) + "\n" + filters_key).encode("utf-8")).hexdigest()[:16]
+    return (generation, docs, digest)
+
+
+class SemanticAnswerCache:
+    """
+    问答结果缓存：
+    - 精确命中：归一化后的问题文本完全一致，不调用任何模型
+    - 语义命中：问题向量与缓存问题的余弦相似度 >= threshold
+    条目带 TTL，超过 max_entries 按最近使用淘汰 (LRU)。
+    世代号变化时通过 changes_since(旧世代号) 取得变化过的文件，只作废文档范围与之有交集、
+    或范围是全部文档的条目；changes_since 未提供或返回 None (无法确定) 时整体失效。
+    """
+
+    def __init__(self, threshold=0.95, ttl_seconds=3600, max_entries=1000, changes_since=None):
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._changes_since = changes_since
+
+        self._entries = OrderedDict()  # {entry_id: entry}
+        self._exact = {}  # {(scope 去掉世代号, normalized_query): entry_id}
+        self._lock = threading.Lock()
+        self._next_id = 0
+        self._generation = None
+
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    # --- 查询 ---
+
+    def lookup_exact(self, query, scope):
+        with self._lock:
+            self._check_generation(scope)
+            entry_id = self._exact.get((scope[1:], normalize_query(query)))
+            entry = self._live_entry(entry_id)
+            if entry is not None:
+                self.exact_hits += 1
+            return entry
+
+    def lookup_semantic(self, query_embedding, scope):
+        """返回 (entry, 相似度)；未命中时 entry 为 None 并计一次 miss"""
+        q = self._unit(query_embedding)
+        with self._lock:
+            self._check_generation(scope)
+            candidates = [e for e in self._entries.values() if e["scope"] == scope[1:] and not self._expired(e)]
+            if candidates:
+                sims = np.stack([e["embedding"] for e in candidates]) @ q
+                best = int(np.argmax(sims))
+                if sims[best] >= self.threshold:
+                    entry = candidates[best]
+                    self._entries.move_to_end(entry["id"])
+                    entry["hits"] += 1
+                    self.semantic_hits += 1
+                    return entry, float(sims[best])
+            self.misses += 1
+            return None, 0.0
+
+    # --- 写入 ---
+
+    def put(self, query, query_embedding, scope, answer, sources=None, pages=None):
+        with self._lock:
+            if not self._check_generation(scope):
+                # 答案是按旧世代的内容生成的，生成期间库已经变了，不缓存
+                return
+            key = (scope[1:], normalize_query(query))
+            if key in self._exact:
+                self._remove(self._exact[key])
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = {
+                "id": entry_id,
+                "key": key,
+                "scope": scope[1:],
+                "query": query,
+                "embedding": self._unit(query_embedding),
+                "answer": answer,
+                "sources": sources or [],
+                "pages": pages or [],
+                "created": time.time(),
+                "hits": 0,
+            }
+            self._exact[key] = entry_id
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+            self._exact.clear()
+
+    def stats(self):
+        with self._lock:
+            hits = self.exact_hits + self.semantic_hits
+            total = hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "exact_hits": self.exact_hits,
+                "semantic_hits": self.semantic_hits,
+                "misses": self.misses,
+                "hit_rate": hits / total if total else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+    # --- 内部实现 (调用方已持锁) ---
+
+    def _check_generation(self, scope):
+        """
+        入库/删除都会让世代号 +1：作废可能引用了已变化内容的答案。
+        返回 scope 是否为当前世代 (比缓存已见到的世代还旧时返回 False)
+        """
+        generation = scope[0]
+        if self._generation is None or generation == self._generation:
+            self._generation = generation
+            return True
+        if generation < self._generation:
+            return False
+        changed = None
+        if self._changes_since is not None:
+            try:
+                changed = self._changes_since(self._generation)
+            except Exception as e:
+                print(f"⚠️ 读取向量库变更记录失败，答案缓存整体失效: {e}")
+        stale = [
+            entry_id for entry_id, entry in self._entries.items()
+            if changed is None or entry["scope"][0] is None or entry["scope"][0] & changed
+        ]
+        if stale:
+            print(f"🧹 向量库已变化 (世代号 {self._generation} -> {generation})，作废 {len(stale)} 条答案缓存")
+        for entry_id in stale:
+            self._remove(entry_id)
+        self.invalidations += len(stale)
+        self._generation = generation
+        return True
+
+    def _live_entry(self, entry_id):
+        entry = self._entries.get(entry_id) if entry_id is not None else None
+        if entry is None:
+            return None
+        if self._expired(entry):
+            self._remove(entry_id)
+            return None
+        self._entries.move_to_end(entry_id)
+        entry["hits"] += 1
+        return entry
+
+    def _expired(self, entry):
+        return self.ttl_seconds > 0 and time.time() - entry["created"] > self.ttl_seconds
+
+    def _remove(self, entry_id):
+        entry = self._entries.pop(entry_id, None)
+        if entry and self._exact.get(entry["key"]) == entry_id:
+            del self._exact[entry["key"]]
+
+    @staticmethod
+    def _unit(vector):
+        v = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(v)
+        return v / norm if norm else v
+
+
+_answer_cache = None
+_answer_cache_lock = threading.Lock()
+
+def get_answer_cache():
+    """进程内单例，所有 Streamlit 会话共享"""
+    global _answer_cache
+    if _answer_cache is None:
+        with _answer_cache_lock:
+            if _answer_cache is None:
+                _answer_cache = SemanticAnswerCache(
+                    threshold=ANSWER_CACHE_THRESHOLD,
+                    ttl_seconds=ANSWER_CACHE_TTL,
+                    max_entries=ANSWER_CACHE_MAX_ENTRIES,
+                    changes_since=get_generation_changes,
+                )
+                register_collector("answer_cache", _answer_cache.stats)
+    return _answer_cache
@@ -0,0 +1,179 @@
+# --- START OF FILE catalog.py ---
+# 文档目录：进程内存里的文档表索引 (文件名 -> 记录 / 文件路径 / 块数 / 页数)，前端每次 rerun 直接读内存，
+# 不再整表查询、不再 os.listdir("data")。
+# 同步靠 corpus.db 里的变更日志 (catalog_events)：入库 / 删除 / 快照恢复写 documents 表时由触发器记录，
+# 不管写入发生在哪个进程，各进程按序号增量拉取变化的文件名，只重读这些行。
+
+import os
+import time
+import threading
+
+from config import CATALOG_REFRESH_INTERVAL, CATALOG_EVENT_RETENTION
+from modules.database import (
+    read_catalog, trim_catalog_events, get_chunk_hashes, delete_document_record,
+)
+from modules.telemetry import register_collector
+
+
+class DocumentCatalog:
+    """按文件名索引的文档记录；读之前按间隔拉取一次变更"""
+
+    def __init__(self, refresh_interval=CATALOG_REFRESH_INTERVAL, retention=CATALOG_EVENT_RETENTION):
+        self.refresh_interval = refresh_interval
+        self.retention = retention
+        self._lock = threading.Lock()
+        self._docs = {}      # filename -> 文档记录 (不含 meta_json)
+        self._chunks = {}    # filename -> 块数
+        self._order = None   # 按上传时间倒序的记录列表，变化后惰性重建
+        self._types = None
+        self._seq = None     # 已同步到的变更序号，None 表示还没加载
+        self._trimmed_seq = 0
+        self._checked_at = 0.0
+        self._full_loads = 0
+        self._incremental_loads = 0
+
+    # --- 同步 ---
+
+    def refresh(self, force=False):
+        """拉取变更；force=False 时 refresh_interval 内最多检查一次。返回本次更新的文件数"""
+        now = time.monotonic()
+        if not force and self._seq is not None and now - self._checked_at < self.refresh_interval:
+            return 0
+        with self._lock:
+            changes = read_catalog(self._seq)
+            self._checked_at = now
+            if changes["full"]:
+                self._docs = {r["filename"]: r for r in changes["rows"]}
+                self._chunks = dict(changes["chunk_counts"])
+                self._full_loads += 1
+                updated = len(self._docs)
+            elif changes["changed"]:
+                current = {r["filename"]: r for r in changes["rows"]}
+                for filename in changes["changed"]:
+                    if filename in current:
+                        self._docs[filename] = current[filename]
+                        self._chunks[filename] = changes["chunk_counts"].get(filename, 0)
+                    else:
+                        self._docs.pop(filename, None)
+                        self._chunks.pop(filename, None)
+                self._incremental_loads += 1
+                updated = len(changes["changed"])
+            else:
+                return 0
+            self._seq = changes["seq"]
+            self._order = None
+            self._types = None
+            # 日志每增长两倍保留条数清理一次
+            trim = self._seq - self._trimmed_seq >= 2 * self.retention
+            if trim:
+                self._trimmed_seq = self._seq
+        if trim:
+            trim_catalog_events(self.retention)
+        return updated
+
+    def _ordered(self):
+        if self._order is None:
+            self._order = sorted(
+                self._docs.values(), key=lambda d: (d["upload_time"] or "", d["id"] or 0), reverse=True
+            )
+        return self._order
+
+    # --- 查询 ---
+
+    def list(self, page=1, page_size=50, status=None, doc_type=None, keyword=None):
+        """与 database.list_documents 相同的分页 + 筛选，返回 (当前页记录, 符合条件的总数)"""
+        self.refresh()
+        needle = keyword.casefold() if keyword else None
+        with self._lock:
+            rows = self._ordered()
+            if status or doc_type or needle:
+                rows = [
+                    d for d in rows
+                    if (not status or d["status"] == status)
+                    and (not doc_type or d["doc_type"] == doc_type)
+                    and (not needle or any(needle in (d[k] or "").casefold() for k in ("filename", "summary", "tags")))
+                ]
+            start = max(page - 1, 0) * page_size
+            return [dict(d, chunk_count=self._chunks.get(d["filename"], 0)) for d in rows[start:start + page_size]], len(rows)
+
+    def get(self, filename):
+        self.refresh()
+        with self._lock:
+            doc = self._docs.get(filename)
+            return dict(doc, chunk_count=self._chunks.get(filename, 0)) if doc else None
+
+    def path(self, filename):
+        """截图用的原文件路径；记录里没有时退回 data/ 目录"""
+        doc = self.get(filename)
+        if doc and doc["file_path"]:
+            return doc["file_path"]
+        return os.path.join("data", filename)
+
+    def pdf_map(self):
+        """{文件名: 文件路径}，问答截图和"指定文件"筛选用"""
+        self.refresh()
+        with self._lock:
+            return {name: d["file_path"] or os.path.join("data", name) for name, d in self._docs.items()}
+
+    def document_types(self):
+        self.refresh()
+        with self._lock:
+            if self._types is None:
+                self._types = sorted({d["doc_type"] for d in self._docs.values() if d["doc_type"] is not None})
+            return list(self._types)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "documents": len(self._docs),
+                "chunks": sum(self._chunks.values()),
+                "pages": sum(d["page_count"] or 0 for d in self._docs.values()),
+                "seq": self._seq or 0,
+                "full_loads": self._full_loads,
+                "incremental_loads": self._incremental_loads,
+            }
+
+
+_catalog = None
+_catalog_lock = threading.Lock()
+
+def get_catalog():
+    """进程内单例，所有 Streamlit 会话共享"""
+    global _catalog
+    if _catalog is None:
+        with _catalog_lock:
+            if _catalog is None:
+                _catalog = DocumentCatalog()
+                register_collector("catalog", _catalog.stats)
+    return _catalog
+
+
+def remove_document(filename):
+    """
+    彻底删除一个文档：按块表里记录的点 ID 删除向量和 BM25 条目 (不做过滤扫描)，
+    再清理截图缓存、数据库记录和原文件。旧数据没有块记录时退回按文件名过滤删除。
+    """
+    from modules.ingestion import delete_points, delete_file_from_vector_db, release_page_cache
+
+    catalog = get_catalog()
+    doc = catalog.get(filename)
+    point_ids = list(get_chunk_hashes(filename))
+    if point_ids:
+        try:
+            delete_points(point_ids, filename)
+            print(f"🗑️ 已从向量库删除: {filename} ({len(point_ids)} 个点)")
+        except Exception as e:
+            print(f"⚠️ 向量库删除失败 (可能是集合不存在): {e}")
+        if doc:
+            release_page_cache(filename, doc["content_hash"])
+    else:
+        delete_file_from_vector_db(filename)
+    delete_document_record(filename)
+
+    path = doc["file_path"] if doc and doc["file_path"] else os.path.join("data", filename)
+    try:
+        if os.path.exists(path):
+            os.remove(path)
+    except OSError as e:
+        print(f"⚠️ 原文件删除失败: {e}")
+    catalog.refresh(force=True)
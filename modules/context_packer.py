@@ -0,0 +1,191 @@
+# --- START OF FILE context_packer.py ---
+# 上下文组装：重排序之后、调用 Gemini 之前，在 token 预算内挑选附图和文本片段
+#   1. 附图按所在页最高的重排序分数挑选 (不是随机顺序)，先占预算
+#   2. 文本片段按分数从高到低放入：跳过近似重复的片段、所在页已附图的片段，预算不够时截断最后一段
+# token 数都是估算值 (不调用 count_tokens 接口，避免多一次网络往返)
+
+import io
+import re
+import math
+import base64
+
+from config import (
+    CONTEXT_TOKEN_BUDGET, CONTEXT_MAX_IMAGES, CONTEXT_IMAGE_BUDGET_RATIO, CONTEXT_DEDUP_THRESHOLD,
+    CONTEXT_DROP_COVERED,
+)
+from modules.telemetry import inc, observe, current_trace
+
+_CJK_RE = re.compile(r"[\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uff00-\uffef]")
+_SPACE_RE = re.compile(r"\s+")
+
+# Gemini 的图片计费：两边都不超过 384px 按 258 token，更大的图按 768x768 切块，每块 258 token
+IMAGE_TILE_TOKENS = 258
+IMAGE_TILE_SIZE = 768
+IMAGE_SMALL_SIDE = 384
+# 读不出尺寸时按 150 DPI 的 A4 页面估算 (2 x 3 块)
+DEFAULT_IMAGE_TOKENS = IMAGE_TILE_TOKENS * 6
+# 截断后剩余不足这么多 token 的片段直接放弃
+MIN_TRUNCATED_TOKENS = 80
+
+TOKEN_BUCKETS = (256, 512, 1024, 2048, 4096, 8192, 16384, 32768, 65536)
+
+
+def estimate_tokens(text):
+    """中日韩字符约 1 字 1 token，其余约 4 个字符 1 token"""
+    if not text:
+        return 0
+    cjk = len(_CJK_RE.findall(text))
+    return cjk + math.ceil((len(text) - cjk) / 4)
+
+
+def image_size(image_doc):
+    """ImageDocument 里的图片尺寸 (宽, 高)；image 可能是原始字节或 base64 字符串"""
+    from PIL import Image
+
+    data = image_doc.image
+    if isinstance(data, str):
+        data = base64.b64decode(data)
+    with Image.open(io.BytesIO(data)) as img:
+        return img.size
+
+
+def image_tokens(image_doc):
+    try:
+        width, height = image_size(image_doc)
+    except Exception:
+        return DEFAULT_IMAGE_TOKENS
+    if width <= IMAGE_SMALL_SIDE and height <= IMAGE_SMALL_SIDE:
+        return IMAGE_TILE_TOKENS
+    return math.ceil(width / IMAGE_TILE_SIZE) * math.ceil(height / IMAGE_TILE_SIZE) * IMAGE_TILE_TOKENS
+
+
+def _shingles(text, n=3):
+    text = _SPACE_RE.sub("", text.lower())
+    if len(text) <= n:
+        return {text} if text else set()
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+
+def _overlap(a, b):
+    """重合度：交集 / 较小集合。一个片段被另一个包含 (滑窗重叠) 时也接近 1"""
+    if not a or not b:
+        return 0.0
+    return len(a & b) / min(len(a), len(b))
+
+
+def _truncate(text, max_tokens):
+    """按估算 token 截断 (二分找最长前缀)"""
+    lo, hi = 0, len(text)
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if estimate_tokens(text[:mid]) <= max_tokens:
+            lo = mid
+        else:
+            hi = mid - 1
+    return text[:lo]
+
+
+def node_pages(metadata):
+    """块所在页的说明文字和页码列表 (从 0 开始)。结构化分块带 page_start/page_end，旧数据只有 page_label"""
+    try:
+        start = int(metadata.get("page_start") or metadata.get("page_label") or 1)
+        end = int(metadata.get("page_end") or start)
+    except (TypeError, ValueError):
+        return str(metadata.get("page_label", "?")), []
+    label = str(start) if end == start else f"{start}-{end}"
+    return label, list(range(start - 1, end))
+
+
+def rank_pages(nodes, max_images=CONTEXT_MAX_IMAGES):
+    """候选截图页按所在页最高的片段分数排序 (同分保持相关度顺序)，取前 max_images 个"""
+    best = {}
+    for rank, n in enumerate(nodes):
+        score = n.score if n.score is not None else 0.0
+        for p_idx in node_pages(n.metadata)[1]:
+            page = (n.metadata.get("file_name", "unknown"), p_idx)
+            if page not in best or score > best[page][0]:
+                best[page] = (score, -rank)
+    ordered = sorted(best, key=lambda page: best[page], reverse=True)
+    return ordered[:max_images]
+
+
+def pack_context(nodes, image_docs, pages, budget=CONTEXT_TOKEN_BUDGET,
+                 image_ratio=CONTEXT_IMAGE_BUDGET_RATIO, dedup_threshold=CONTEXT_DEDUP_THRESHOLD,
+                 drop_covered=CONTEXT_DROP_COVERED):
+    """
+    nodes: 重排序后的片段 (分数从高到低)；image_docs / pages: 已渲染的截图及其 (file_name, page_idx)。
+    返回 (context_str, image_docs, pages, used_nodes, stats)：
+    used_nodes 是进入文本或被附图覆盖的片段 (前端展示来源用)，stats 为各项计数和估算 token。
+    """
+    stats = {"candidates": len(nodes), "duplicates": 0, "covered": 0, "over_budget": 0, "truncated": 0}
+
+    # 1. 附图：按 rank_pages 给出的顺序放入，超出附图预算的丢掉
+    kept_images, kept_pages, image_total = [], [], 0
+    for doc, page in zip(image_docs, pages):
+        tokens = image_tokens(doc)
+        if kept_images and image_total + tokens > budget * image_ratio:
+            stats["over_budget"] += 1
+            continue
+        kept_images.append(doc)
+        kept_pages.append(page)
+        image_total += tokens
+    covered_pages = set(kept_pages)
+
+    # 2. 文本：高分优先，去重 / 去掉已附图的页，填满剩余预算
+    remaining = budget - image_total
+    parts, used_nodes, kept_shingles, text_total = [], [], [], 0
+    for n in sorted(nodes, key=lambda n: n.score if n.score is not None else 0.0, reverse=True):
+        f_name = n.metadata.get("file_name", "unknown")
+        page_label, page_indices = node_pages(n.metadata)
+        if drop_covered and page_indices and all((f_name, p) in covered_pages for p in page_indices):
+            stats["covered"] += 1
+            used_nodes.append(n)
+            continue
+        shingles = _shingles(n.text)
+        if any(_overlap(shingles, s) >= dedup_threshold for s in kept_shingles):
+            stats["duplicates"] += 1
+            continue
+        header = f"--- 文档: {f_name} [第 {page_label} 页] ---\n"
+        text = n.text
+        tokens = estimate_tokens(header) + estimate_tokens(text)
+        if tokens > remaining:
+            room = remaining - estimate_tokens(header)
+            if room < MIN_TRUNCATED_TOKENS:
+                stats["over_budget"] += 1
+                continue
+            text = _truncate(text, room)
+            tokens = estimate_tokens(header) + estimate_tokens(text)
+            stats["truncated"] += 1
+        parts.append(f"{header}{text}\n\n")
+        used_nodes.append(n)
+        kept_shingles.append(shingles)
+        remaining -= tokens
+        text_total += tokens
+
+    # 保持相关度顺序展示来源
+    order = {id(n): i for i, n in enumerate(nodes)}
+    used_nodes.sort(key=lambda n: order[id(n)])
+    stats.update(
+        text_chunks=len(parts),
+        images=len(kept_images),
+        text_tokens=text_total,
+        image_tokens=image_total,
+        total_tokens=text_total + image_total,
+        budget=budget,
+    )
+    _log(stats)
+    return "".join(parts), kept_images, kept_pages, used_nodes, stats
+
+
+def _log(stats):
+    print(f"📦 上下文: {stats['text_chunks']}/{stats['candidates']} 个片段 + {stats['images']} 张图，"
+          f"约 {stats['total_tokens']} token (文本 {stats['text_tokens']} / 图片 {stats['image_tokens']}，预算 {stats['budget']})；"
+          f"去重 {stats['duplicates']}，已附图 {stats['covered']}，超预算 {stats['over_budget']}，截断 {stats['truncated']}")
+    observe("rag_context_tokens", stats["total_tokens"], "发给模型的上下文估算 token 数", buckets=TOKEN_BUCKETS)
+    for reason in ("duplicates", "covered", "over_budget"):
+        if stats[reason]:
+            inc("rag_context_dropped_total", stats[reason], "上下文组装时丢弃的片段 / 附图", reason=reason)
+    trace = current_trace()
+    if trace is not None:
+        trace.attrs.update(context_tokens=stats["total_tokens"], context_chunks=stats["text_chunks"],
+                           context_images=stats["images"])
@@ -1,16 +1,66 @@
+import os
+import time
 import sqlite3
 import json
+import threading
+from contextlib import contextmanager
 from datetime import datetime
 
 DB_PATH = "corpus.db"
 
-def init_db():
-    """初始化 SQLite 数据库"""
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
+# --- 连接管理 ---
+# 每个线程复用自己的一条连接 (sqlite3 连接不能跨线程共享)，按 (路径, 进程号) 区分，
+# 子进程 / 修改 DB_PATH 后会自动新建连接。
+# WAL 模式下读写互不阻塞；写事务统一用 BEGIN IMMEDIATE，避免并发升级写锁时报 "database is locked"。
+
+_local = threading.local()
+
+_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=10000",
+    "PRAGMA cache_size=-20000",  # 约 20MB 页缓存
+    "PRAGMA temp_store=MEMORY",
+)
+
+def _connect():
+    key = (os.path.abspath(DB_PATH), os.getpid())
+    conn = getattr(_local, "conn", None)
+    if conn is None or getattr(_local, "key", None) != key:
+        conn = sqlite3.connect(DB_PATH, timeout=10, isolation_level=None, check_same_thread=False)
+        conn.row_factory = sqlite3.Row  # 让结果像字典一样访问
+        for pragma in _PRAGMAS:
+            conn.execute(pragma)
+        _local.conn = conn
+        _local.key = key
+    return conn
+
+@contextmanager
+def _transaction():
+    """写事务：成功提交，异常回滚"""
+    conn = _connect()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
+def _query(sql, params=()):
+    return [dict(row) for row in _connect().execute(sql, params).fetchall()]
+
+def _query_one(sql, params=()):
+    row = _connect().execute(sql, params).fetchone()
+    return dict(row) if row else None
+
+# --- 表结构迁移 ---
+# 按 PRAGMA user_version 逐个执行；每一步都写成可重复执行的形式，兼容没有版本号的旧库
+
+def _migration_base(conn):
     # 创建文档表
     # status: 'processing', 'completed', 'failed'
-    c.execute('''
+    conn.execute('''
         CREATE TABLE IF NOT EXISTS documents (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             filename TEXT UNIQUE,
@@ -24,68 +74,603 @@ def init_db():
             error_msg TEXT
         )
     ''')
-    conn.commit()
-    conn.close()
+
+def _migration_content_hash(conn):
+    # 文件内容哈希 (去重/增量) 与完整元数据 JSON (同内容文件复用)
+    existing_cols = {row[1] for row in conn.execute("PRAGMA table_info(documents)")}
+    if "content_hash" not in existing_cols:
+        conn.execute("ALTER TABLE documents ADD COLUMN content_hash TEXT")
+    if "meta_json" not in existing_cols:
+        conn.execute("ALTER TABLE documents ADD COLUMN meta_json TEXT")
+
+    # 块表：每个向量点对应一行，用于增量更新和跨文件复用向量
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS chunks (
+            point_id TEXT PRIMARY KEY,
+            filename TEXT,
+            chunk_hash TEXT
+        )
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_chunks_filename ON chunks(filename)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_chunks_hash ON chunks(chunk_hash)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_documents_hash ON documents(content_hash)")
+
+def _migration_system_state(conn):
+    # 系统状态表：目前只存向量库世代号 (每次写入/删除 +1，用于让检索器等缓存失效)
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS system_state (
+            key TEXT PRIMARY KEY,
+            value INTEGER
+        )
+    ''')
+    conn.execute("INSERT OR IGNORE INTO system_state (key, value) VALUES ('collection_generation', 0)")
+
+def _migration_listing_indexes(conn):
+    # 管理页按上传时间倒序分页、按状态/类型筛选
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_documents_upload_time ON documents(upload_time)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_documents_status ON documents(status, upload_time)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_documents_doc_type ON documents(doc_type, upload_time)")
+
+def _migration_jobs(conn):
+    # 入库任务队列 (后台 worker 消费)，时间字段用 time.time() 秒数，方便计算重试退避和心跳超时
+    # status: 'queued', 'running', 'completed', 'failed', 'cancelled'
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            filename TEXT,
+            file_path TEXT,
+            priority INTEGER DEFAULT 0,
+            status TEXT,
+            attempts INTEGER DEFAULT 0,
+            max_attempts INTEGER DEFAULT 3,
+            run_after REAL DEFAULT 0,
+            cancel_requested INTEGER DEFAULT 0,
+            worker TEXT,
+            progress TEXT,
+            result_msg TEXT,
+            page_count INTEGER,
+            created_at REAL,
+            started_at REAL,
+            heartbeat_at REAL,
+            finished_at REAL
+        )
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_claim ON jobs(status, priority DESC, run_after, id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_filename ON jobs(filename, status)")
+
+def _migration_metadata_cache(conn):
+    # 元数据提取结果按内容哈希缓存 (只存校验通过的结果)
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS metadata_cache (
+            content_hash TEXT PRIMARY KEY,
+            meta_json TEXT,
+            created_at REAL
+        )
+    ''')
+
+def _migration_catalog_events(conn):
+    # 文档目录的变更日志：documents 表的任何写入都由触发器记一条 (入库 worker 在别的进程里写也一样)，
+    # 块表整体替换时由 replace_chunks 记一条；各进程的内存目录 (modules/catalog.py) 按序号增量同步
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS catalog_events (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            filename TEXT
+        )
+    ''')
+    for event, row in (("INSERT", "NEW"), ("UPDATE", "NEW"), ("DELETE", "OLD")):
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_documents_{event.lower()} AFTER {event} ON documents
+            BEGIN
+                INSERT INTO catalog_events (filename) VALUES ({row}.filename);
+            END
+        ''')
+
+def _migration_generation_changes(conn):
+    # 每次世代号 +1 时记下变化的文件 (filename 为 NULL 表示整体变化，如快照导入、集合迁移)，
+    # 答案缓存据此只作废引用了这些文件的条目
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS generation_changes (
+            generation INTEGER,
+            filename TEXT
+        )
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_generation_changes ON generation_changes(generation)")
+
+MIGRATIONS = [
+    _migration_base,
+    _migration_content_hash,
+    _migration_system_state,
+    _migration_listing_indexes,
+    _migration_jobs,
+    _migration_metadata_cache,
+    _migration_catalog_events,
+    _migration_generation_changes,
+]
+
+def init_db():
+    """初始化 SQLite 数据库，执行尚未应用的迁移"""
+    conn = _connect()
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    if version >= len(MIGRATIONS):
+        return
+    with _transaction() as conn:
+        # 加写锁后再读一次，防止多个进程同时迁移
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        for i, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+            migration(conn)
+            conn.execute(f"PRAGMA user_version = {i}")
+            print(f"🗄️ 数据库迁移到版本 {i}: {migration.__name__}")
+
+# --- 文档表 ---
+
+def _now():
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+def _success_row(filename, meta_data, page_count, content_hash):
+    # meta_data 是个字典，关键字段拆解存入列中，完整内容存为 JSON 字符串
+    doc_type = meta_data.get("doc_type", "Unknown")
+    summary = meta_data.get("summary", "")
+    tags = ", ".join(meta_data.get("keywords", []))
+    return (doc_type, summary, tags, page_count, content_hash, json.dumps(meta_data, ensure_ascii=False), filename)
+
+_SUCCESS_SQL = '''
+    UPDATE documents
+    SET status = 'completed', doc_type = ?, summary = ?, tags = ?, page_count = ?, error_msg = NULL,
+        content_hash = ?, meta_json = ?
+    WHERE filename = ?
+'''
 
 def add_document_start(filename, file_path):
     """开始处理前，先占位"""
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    try:
-        c.execute('''
+    with _transaction() as conn:
+        cur = conn.execute('''
             INSERT OR REPLACE INTO documents (filename, file_path, upload_time, status)
             VALUES (?, ?, ?, ?)
-        ''', (filename, file_path, datetime.now().strftime("%Y-%m-%d %H:%M:%S"), "processing"))
-        conn.commit()
-        return c.lastrowid
-    finally:
-        conn.close()
+        ''', (filename, file_path, _now(), "processing"))
+        return cur.lastrowid
 
-def update_document_success(filename, meta_data, page_count):
+def add_documents_start(items):
+    """批量占位，items: [(filename, file_path), ...]"""
+    now = _now()
+    with _transaction() as conn:
+        conn.executemany('''
+            INSERT OR REPLACE INTO documents (filename, file_path, upload_time, status)
+            VALUES (?, ?, ?, 'processing')
+        ''', [(filename, file_path, now) for filename, file_path in items])
+
+def update_document_success(filename, meta_data, page_count, content_hash=None):
     """处理成功，更新元数据"""
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    
-    # meta_data 是个字典，我们需要拆解存入列中，或者存为 JSON 字符串
-    # 这里演示拆解存入关键字段
-    doc_type = meta_data.get("doc_type", "Unknown")
-    summary = meta_data.get("summary", "")
-    tags = ", ".join(meta_data.get("keywords", []))
-    
-    c.execute('''
-        UPDATE documents 
-        SET status = 'completed', doc_type = ?, summary = ?, tags = ?, page_count = ?, error_msg = NULL
-        WHERE filename = ?
-    ''', (doc_type, summary, tags, page_count, filename))
-    conn.commit()
-    conn.close()
+    with _transaction() as conn:
+        conn.execute(_SUCCESS_SQL, _success_row(filename, meta_data, page_count, content_hash))
+
+def update_documents_success(items):
+    """批量标记成功，items: [(filename, meta_data, page_count, content_hash), ...]"""
+    with _transaction() as conn:
+        conn.executemany(_SUCCESS_SQL, [_success_row(*item) for item in items])
 
 def update_document_failed(filename, error_msg):
     """处理失败"""
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute('''
-        UPDATE documents 
-        SET status = 'failed', error_msg = ?
-        WHERE filename = ?
-    ''', (str(error_msg), filename))
-    conn.commit()
-    conn.close()
+    with _transaction() as conn:
+        conn.execute('''
+            UPDATE documents
+            SET status = 'failed', error_msg = ?
+            WHERE filename = ?
+        ''', (str(error_msg), filename))
 
 def get_all_documents():
-    """获取所有文档列表 (用于前端展示)"""
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row  # 让结果像字典一样访问
-    c = conn.cursor()
-    c.execute("SELECT * FROM documents ORDER BY upload_time DESC")
-    rows = [dict(row) for row in c.fetchall()]
-    conn.close()
-    return rows
+    """获取所有文档列表"""
+    return _query("SELECT * FROM documents ORDER BY upload_time DESC")
+
+def list_documents(page=1, page_size=50, status=None, doc_type=None, keyword=None):
+    """
+    分页 + 筛选 (用于管理页)，返回 (当前页记录, 符合条件的总数)。
+    keyword 在文件名 / 摘要 / 标签里模糊匹配。
+    """
+    where, params = [], []
+    if status:
+        where.append("status = ?")
+        params.append(status)
+    if doc_type:
+        where.append("doc_type = ?")
+        params.append(doc_type)
+    if keyword:
+        where.append("(filename LIKE ? OR summary LIKE ? OR tags LIKE ?)")
+        params.extend([f"%{keyword}%"] * 3)
+    where_sql = f"WHERE {' AND '.join(where)}" if where else ""
+
+    total = _connect().execute(f"SELECT COUNT(*) FROM documents {where_sql}", params).fetchone()[0]
+    rows = _query(
+        f'''
+        SELECT id, filename, file_path, upload_time, doc_type, summary, tags, page_count, status, error_msg
+        FROM documents {where_sql}
+        ORDER BY upload_time DESC, id DESC
+        LIMIT ? OFFSET ?
+        ''',
+        params + [page_size, max(page - 1, 0) * page_size],
+    )
+    return rows, total
+
+def get_document_types():
+    """已有的文档类型 (管理页筛选下拉框)"""
+    return [r["doc_type"] for r in _query(
+        "SELECT DISTINCT doc_type FROM documents WHERE doc_type IS NOT NULL ORDER BY doc_type"
+    )]
+
+def get_document(filename):
+    """按文件名获取单条文档记录，不存在返回 None"""
+    return _query_one("SELECT * FROM documents WHERE filename = ?", (filename,))
+
+def find_document_by_hash(content_hash, exclude_filename=None):
+    """查找内容相同且已入库成功的文档 (用于同内容不同文件名的复用)"""
+    return _query_one('''
+        SELECT * FROM documents
+        WHERE content_hash = ? AND status = 'completed' AND filename != ?
+        LIMIT 1
+    ''', (content_hash, exclude_filename or ""))
+
+def hash_in_use(content_hash, exclude_filename=None):
+    """除 exclude_filename 以外是否还有文档 (任意状态) 是这份内容；页面截图缓存按内容哈希共用"""
+    return _query_one(
+        "SELECT 1 AS used FROM documents WHERE content_hash = ? AND filename != ? LIMIT 1",
+        (content_hash, exclude_filename or ""),
+    ) is not None
 
 def delete_document_record(filename):
     """删除数据库记录"""
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("DELETE FROM documents WHERE filename = ?", (filename,))
-    conn.commit()
-    conn.close()
\ No newline at end of file
+    with _transaction() as conn:
+        conn.execute("DELETE FROM documents WHERE filename = ?", (filename,))
+        conn.execute("DELETE FROM chunks WHERE filename = ?", (filename,))
+
+# --- 块表 ---
+
+def get_chunk_hashes(filename):
+    """获取某文件当前在向量库中的所有块 {point_id: chunk_hash}"""
+    rows = _connect().execute("SELECT point_id, chunk_hash FROM chunks WHERE filename = ?", (filename,))
+    return {r["point_id"]: r["chunk_hash"] for r in rows}
+
+def find_points_by_chunk_hash(chunk_hashes):
+    """按块哈希查找已有向量点 {chunk_hash: point_id} (任意文件)"""
+    found = {}
+    hashes = list(chunk_hashes)
+    conn = _connect()
+    # SQLite 单条语句的参数个数有限制，分批查询
+    for i in range(0, len(hashes), 500):
+        batch = hashes[i:i + 500]
+        placeholders = ",".join("?" * len(batch))
+        for r in conn.execute(f"SELECT chunk_hash, point_id FROM chunks WHERE chunk_hash IN ({placeholders})", batch):
+            found.setdefault(r["chunk_hash"], r["point_id"])
+    return found
+
+def replace_chunks(filename, chunk_rows):
+    """用最新的块列表覆盖某文件的块记录，chunk_rows: [(point_id, chunk_hash), ...]"""
+    with _transaction() as conn:
+        conn.execute("DELETE FROM chunks WHERE filename = ?", (filename,))
+        conn.executemany(
+            "INSERT OR REPLACE INTO chunks (point_id, filename, chunk_hash) VALUES (?, ?, ?)",
+            [(point_id, filename, chunk_hash) for point_id, chunk_hash in chunk_rows]
+        )
+        conn.execute("INSERT INTO catalog_events (filename) VALUES (?)", (filename,))
+
+# --- 系统状态 ---
+
+# 世代号变更记录保留的世代数 (答案缓存落后更多时直接整体失效)
+GENERATION_CHANGES_KEPT = 1000
+
+def get_collection_generation():
+    """向量库当前世代号 (跨进程可见：入库 worker 和前端读的是同一个值)"""
+    row = _query_one("SELECT value FROM system_state WHERE key = 'collection_generation'")
+    return row["value"] if row else 0
+
+def bump_collection_generation(filenames=None):
+    """
+    向量库内容发生变化 (写入/删除) 后调用，世代号 +1。
+    filenames 为本次变化涉及的文件；不传表示整个库都可能变了。
+    """
+    names = set(filenames) if filenames is not None else {None}
+    # 说不清是哪个文件 (没有文件名) 就按整体变化记
+    names = [None] if None in names else sorted(names)
+    with _transaction() as conn:
+        conn.execute("UPDATE system_state SET value = value + 1 WHERE key = 'collection_generation'")
+        generation = conn.execute(
+            "SELECT value FROM system_state WHERE key = 'collection_generation'"
+        ).fetchone()[0]
+        conn.executemany(
+            "INSERT INTO generation_changes (generation, filename) VALUES (?, ?)",
+            [(generation, name) for name in names]
+        )
+        conn.execute(
+            "DELETE FROM generation_changes WHERE generation <= ?", (generation - GENERATION_CHANGES_KEPT,)
+        )
+
+def get_generation_changes(since):
+    """
+    世代号 since 之后变化过的文件集合；其中有整体变化，或 since 早于保留的变更记录时返回 None
+    """
+    current = get_collection_generation()
+    if current - since > GENERATION_CHANGES_KEPT:
+        return None
+    rows = _query(
+        "SELECT DISTINCT filename FROM generation_changes WHERE generation > ? AND generation <= ?",
+        (since, current)
+    )
+    names = {row["filename"] for row in rows}
+    return None if None in names else names
+
+# --- 元数据缓存 ---
+
+def get_cached_metadata(content_hashes):
+    """按内容哈希批量读取已缓存的元数据 {content_hash: meta}"""
+    found = {}
+    hashes = list(dict.fromkeys(content_hashes))
+    conn = _connect()
+    for i in range(0, len(hashes), 500):
+        batch = hashes[i:i + 500]
+        placeholders = ",".join("?" * len(batch))
+        for r in conn.execute(f"SELECT content_hash, meta_json FROM metadata_cache WHERE content_hash IN ({placeholders})", batch):
+            found[r["content_hash"]] = json.loads(r["meta_json"])
+    return found
+
+def put_cached_metadata(items):
+    """items: [(content_hash, meta), ...]"""
+    with _transaction() as conn:
+        conn.executemany(
+            "INSERT OR REPLACE INTO metadata_cache (content_hash, meta_json, created_at) VALUES (?, ?, ?)",
+            [(h, json.dumps(meta, ensure_ascii=False), time.time()) for h, meta in items]
+        )
+
+# --- 文档目录同步 ---
+
+CATALOG_COLUMNS = "id, filename, file_path, upload_time, doc_type, summary, tags, page_count, status, error_msg, content_hash"
+
+def _chunk_counts(conn, filenames=None):
+    if filenames is None:
+        return {r[0]: r[1] for r in conn.execute("SELECT filename, COUNT(*) FROM chunks GROUP BY filename")}
+    counts = {}
+    names = list(filenames)
+    for i in range(0, len(names), 500):
+        batch = names[i:i + 500]
+        placeholders = ",".join("?" * len(batch))
+        for r in conn.execute(f"SELECT filename, COUNT(*) FROM chunks WHERE filename IN ({placeholders}) GROUP BY filename", batch):
+            counts[r[0]] = r[1]
+    return counts
+
+def read_catalog(after_seq=None):
+    """
+    读取文档目录的变更 (同一个读事务里取事件序号和文档行，两者一致)。
+    after_seq 为 None、或其后的事件已被清理时全量读取。返回
+    {"seq": 最新序号, "full": 是否全量, "changed": 变更的文件名集合, "rows": 这些文件当前的行, "chunk_counts": {文件名: 块数}}
+    """
+    conn = _connect()
+    conn.execute("BEGIN")
+    try:
+        lo, hi = conn.execute("SELECT MIN(seq), MAX(seq) FROM catalog_events").fetchone()
+        hi = hi or 0
+        if after_seq is not None and hi <= after_seq:
+            return {"seq": after_seq, "full": False, "changed": set(), "rows": [], "chunk_counts": {}}
+        if after_seq is None or (lo is not None and lo > after_seq + 1):
+            rows = [dict(r) for r in conn.execute(f"SELECT {CATALOG_COLUMNS} FROM documents")]
+            return {"seq": hi, "full": True, "changed": None, "rows": rows, "chunk_counts": _chunk_counts(conn)}
+        changed = {r[0] for r in conn.execute("SELECT DISTINCT filename FROM catalog_events WHERE seq > ?", (after_seq,))}
+        names = list(changed)
+        rows = []
+        for i in range(0, len(names), 500):
+            batch = names[i:i + 500]
+            placeholders = ",".join("?" * len(batch))
+            rows.extend(dict(r) for r in conn.execute(
+                f"SELECT {CATALOG_COLUMNS} FROM documents WHERE filename IN ({placeholders})", batch
+            ))
+        return {"seq": hi, "full": False, "changed": changed, "rows": rows, "chunk_counts": _chunk_counts(conn, names)}
+    finally:
+        conn.execute("COMMIT")
+
+def trim_catalog_events(keep):
+    """只保留最近 keep 条变更事件 (落后更多的进程会自动全量重读)，返回删除条数"""
+    with _transaction() as conn:
+        cur = conn.execute(
+            "DELETE FROM catalog_events WHERE seq <= (SELECT MAX(seq) FROM catalog_events) - ?", (keep,)
+        )
+        return cur.rowcount
+
+def count_catalog_events():
+    return _query_one("SELECT COUNT(*) AS n FROM catalog_events")["n"]
+
+# --- 快照导出 / 恢复 ---
+# 只导出与知识库内容相关的表；任务队列是运行时状态，不进快照
+
+SNAPSHOT_TABLES = ("documents", "chunks", "metadata_cache")
+
+def _check_snapshot_table(table):
+    if table not in SNAPSHOT_TABLES:
+        raise ValueError(f"不支持导出的表: {table}")
+
+def count_rows(table):
+    _check_snapshot_table(table)
+    return _query_one(f"SELECT COUNT(*) AS n FROM {table}")["n"]
+
+def iter_table_rows(table, batch_size=1000):
+    """按 rowid 顺序逐批读出整张表 (dict)，大表也不会一次性读进内存"""
+    _check_snapshot_table(table)
+    cursor = _connect().execute(f"SELECT * FROM {table} ORDER BY rowid")
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            return
+        for row in rows:
+            yield dict(row)
+
+def restore_table_rows(table, rows, replace=False, batch_size=1000):
+    """
+    把快照里的行写回表中 (一个事务)。只写当前表结构里有的列，旧版本快照缺的列用默认值。
+    replace=True 时先清空整张表。返回写入行数。
+    """
+    _check_snapshot_table(table)
+    columns = [r["name"] for r in _query(f"PRAGMA table_info({table})")]
+    total = 0
+    with _transaction() as conn:
+        if replace:
+            conn.execute(f"DELETE FROM {table}")
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= batch_size:
+                total += _insert_rows(conn, table, columns, batch)
+                batch = []
+        if batch:
+            total += _insert_rows(conn, table, columns, batch)
+    return total
+
+def _insert_rows(conn, table, columns, rows):
+    cols = [c for c in columns if c in rows[0]]
+    placeholders = ",".join("?" * len(cols))
+    conn.executemany(
+        f"INSERT OR REPLACE INTO {table} ({','.join(cols)}) VALUES ({placeholders})",
+        [tuple(row.get(c) for c in cols) for row in rows]
+    )
+    return len(rows)
+
+# --- 任务队列 ---
+
+def enqueue_jobs(items, priority=0, max_attempts=3):
+    """
+    批量提交入库任务，items: [(filename, file_path), ...]，返回任务 ID 列表。
+    同名文件已有排队中的任务时只更新它 (不重复排队)。
+    """
+    now = time.time()
+    job_ids = []
+    with _transaction() as conn:
+        for filename, file_path in items:
+            row = conn.execute(
+                "SELECT id FROM jobs WHERE filename = ? AND status = 'queued'", (filename,)
+            ).fetchone()
+            if row:
+                conn.execute(
+                    "UPDATE jobs SET file_path = ?, priority = MAX(priority, ?), run_after = 0 WHERE id = ?",
+                    (file_path, priority, row["id"]),
+                )
+                job_ids.append(row["id"])
+                continue
+            cur = conn.execute('''
+                INSERT INTO jobs (filename, file_path, priority, status, max_attempts, run_after, created_at, progress)
+                VALUES (?, ?, ?, 'queued', ?, 0, ?, '排队中')
+            ''', (filename, file_path, priority, max_attempts, now))
+            job_ids.append(cur.lastrowid)
+    return job_ids
+
+def claim_job(worker_id):
+    """取出一个可执行的任务 (优先级高的先执行，同优先级先进先出) 并标记为 running；没有则返回 None"""
+    now = time.time()
+    with _transaction() as conn:
+        row = conn.execute('''
+            SELECT id FROM jobs
+            WHERE status = 'queued' AND run_after <= ?
+            ORDER BY priority DESC, run_after, id
+            LIMIT 1
+        ''', (now,)).fetchone()
+        if row is None:
+            return None
+        conn.execute('''
+            UPDATE jobs
+            SET status = 'running', attempts = attempts + 1, worker = ?, started_at = ?, heartbeat_at = ?,
+                progress = '开始处理'
+            WHERE id = ?
+        ''', (worker_id, now, now, row["id"]))
+        return dict(conn.execute("SELECT * FROM jobs WHERE id = ?", (row["id"],)).fetchone())
+
+def touch_job(job_id, progress=None):
+    """心跳 (可顺带更新进度文字)，返回该任务是否被请求取消"""
+    with _transaction() as conn:
+        if progress is None:
+            conn.execute("UPDATE jobs SET heartbeat_at = ? WHERE id = ?", (time.time(), job_id))
+        else:
+            conn.execute("UPDATE jobs SET heartbeat_at = ?, progress = ? WHERE id = ?", (time.time(), progress, job_id))
+        row = conn.execute("SELECT cancel_requested FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    return bool(row and row["cancel_requested"])
+
+def finish_job(job_id, status, message, page_count=None):
+    """任务结束：status 为 completed / failed / cancelled"""
+    with _transaction() as conn:
+        conn.execute('''
+            UPDATE jobs
+            SET status = ?, result_msg = ?, page_count = ?, progress = NULL, finished_at = ?
+            WHERE id = ?
+        ''', (status, message, page_count, time.time(), job_id))
+
+def retry_job(job_id, message, delay_seconds):
+    """失败后重新排队，delay_seconds 秒后才能再被领取"""
+    with _transaction() as conn:
+        conn.execute('''
+            UPDATE jobs
+            SET status = 'queued', result_msg = ?, run_after = ?, worker = NULL, progress = '等待重试'
+            WHERE id = ?
+        ''', (message, time.time() + delay_seconds, job_id))
+
+def cancel_job(job_id):
+    """取消任务：排队中的直接取消；执行中的打上标记，由 worker 在下一个阶段边界停下。返回取消后的状态"""
+    with _transaction() as conn:
+        row = conn.execute("SELECT status FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        if row["status"] == "queued":
+            conn.execute(
+                "UPDATE jobs SET status = 'cancelled', progress = NULL, finished_at = ? WHERE id = ?",
+                (time.time(), job_id),
+            )
+            return "cancelled"
+        if row["status"] == "running":
+            conn.execute("UPDATE jobs SET cancel_requested = 1, progress = '正在取消' WHERE id = ?", (job_id,))
+        return row["status"]
+
+def recover_stale_jobs(heartbeat_timeout):
+    """
+    心跳超时的 running 任务 (worker 崩溃/被杀) 重新排队；重试次数用完的记为失败。
+    返回被回收的任务数。
+    """
+    cutoff = time.time() - heartbeat_timeout
+    with _transaction() as conn:
+        stale = conn.execute('''
+            SELECT id, filename, attempts, max_attempts, cancel_requested FROM jobs
+            WHERE status = 'running' AND heartbeat_at < ?
+        ''', (cutoff,)).fetchall()
+        for job in stale:
+            if job["cancel_requested"]:
+                status, progress = "cancelled", None
+            elif job["attempts"] >= job["max_attempts"]:
+                status, progress = "failed", None
+            else:
+                status, progress = "queued", "等待重试"
+            conn.execute('''
+                UPDATE jobs SET status = ?, progress = ?, worker = NULL, result_msg = 'worker 中断',
+                    finished_at = CASE WHEN ? = 'queued' THEN NULL ELSE ? END
+                WHERE id = ?
+            ''', (status, progress, status, time.time(), job["id"]))
+            if status != "queued":
+                conn.execute(
+                    "UPDATE documents SET status = 'failed', error_msg = 'worker 中断' WHERE filename = ?",
+                    (job["filename"],),
+                )
+    return len(stale)
+
+def find_orphan_documents():
+    """状态停在 processing、却没有排队/执行中任务的文档 (旧版本在前端线程里入库时被中断留下的)"""
+    return _query('''
+        SELECT d.filename, d.file_path FROM documents d
+        WHERE d.status = 'processing' AND NOT EXISTS (
+            SELECT 1 FROM jobs j WHERE j.filename = d.filename AND j.status IN ('queued', 'running')
+        )
+    ''')
+
+def list_jobs(limit=50, statuses=None):
+    """最近的任务 (进行中的排在前面)"""
+    where, params = "", []
+    if statuses:
+        where = f"WHERE status IN ({','.join('?' * len(statuses))})"
+        params = list(statuses)
+    return _query(f'''
+        SELECT * FROM jobs {where}
+        ORDER BY CASE status WHEN 'running' THEN 0 WHEN 'queued' THEN 1 ELSE 2 END, id DESC
+        LIMIT ?
+    ''', params + [limit])
+
+def job_counts():
+    """各状态的任务数 {status: count}"""
+    return {r["status"]: r["n"] for r in _query("SELECT status, COUNT(*) AS n FROM jobs GROUP BY status")}
@@ -0,0 +1,235 @@
+# --- START OF FILE embed_cache.py ---
+
+import time
+import array
+import sqlite3
+import hashlib
+import threading
+import unicodedata
+from typing import Any
+
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.bridge.pydantic import PrivateAttr
+
+
+def normalize_text(text):
+    """归一化：全角半角统一 + 压缩空白，避免只差空格的文本重复计算"""
+    return " ".join(unicodedata.normalize("NFKC", text).split())
+
+
+def text_key(text):
+    return hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+
+
+class EmbeddingCacheStore:
+    """
+    SQLite 持久化的向量缓存：(模型, 文本哈希) -> float32 向量。
+    超过 max_entries 时按最近访问时间淘汰 (LRU)。多线程共享同一个连接，用锁串行化。
+    """
+
+    def __init__(self, path, max_entries=200000):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS embeddings (
+                model TEXT,
+                text_hash TEXT,
+                vector BLOB,
+                last_access REAL,
+                PRIMARY KEY (model, text_hash)
+            )
+        ''')
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_access ON embeddings(last_access)")
+        self._conn.commit()
+        self._count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def get_many(self, model, keys):
+        """批量查询，返回 {text_hash: vector}；命中的条目刷新访问时间"""
+        found = {}
+        unique = list(dict.fromkeys(keys))
+        with self._lock:
+            for i in range(0, len(unique), 500):
+                batch = unique[i:i + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT text_hash, vector FROM embeddings WHERE model = ? AND text_hash IN ({placeholders})",
+                    [model] + batch,
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = array.array("f", blob).tolist()
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_access = ? WHERE model = ? AND text_hash = ?",
+                    [(now, model, key) for key in found],
+                )
+                self._conn.commit()
+            self.hits += sum(1 for k in keys if k in found)
+            self.misses += sum(1 for k in keys if k not in found)
+        return found
+
+    def put_many(self, model, items):
+        """items: [(text_hash, vector), ...]"""
+        if not items:
+            return
+        now = time.time()
+        with self._lock:
+            before = self._conn.total_changes
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO embeddings (model, text_hash, vector, last_access) VALUES (?, ?, ?, ?)",
+                [(model, key, array.array("f", vector).tobytes(), now) for key, vector in items],
+            )
+            self._count += self._conn.total_changes - before
+            if self._count > self.max_entries:
+                self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        # 一次多淘汰 10%，避免每次写入都触发删除
+        target = int(self.max_entries * 0.9)
+        self._conn.execute('''
+            DELETE FROM embeddings WHERE rowid IN (
+                SELECT rowid FROM embeddings ORDER BY last_access ASC LIMIT ?
+            )
+        ''', (self._count - target,))
+        self._count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        print(f"🧹 向量缓存淘汰完成，剩余 {self._count} 条")
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": self._count,
+            "max_entries": self.max_entries,
+        }
+
+
+class CachedEmbedding(BaseEmbedding):
+    """
+    包装任意 Embedding 模型：先查缓存，只把未命中的文本交给底层模型。
+    查询向量和文档向量分开缓存 (Gemini 对两者使用不同的 task_type)。
+    底层是 EmbeddingScheduler 时整批交给它切分；部分批次失败也先把已算出的向量写进缓存。
+    """
+
+    _inner: Any = PrivateAttr()
+    _store: Any = PrivateAttr()
+
+    def __init__(self, inner, store, **kwargs):
+        kwargs.setdefault("model_name", inner.model_name)
+        kwargs.setdefault("embed_batch_size", max(inner.embed_batch_size, 100))
+        super().__init__(**kwargs)
+        self._inner = inner
+        self._store = store
+
+    @classmethod
+    def class_name(cls):
+        return "CachedEmbedding"
+
+    @property
+    def inner(self):
+        return self._inner
+
+    def stats(self):
+        return self._store.stats()
+
+    def _scope(self, kind):
+        return f"{self.model_name}#{kind}"
+
+    def _lookup(self, kind, texts):
+        keys = [text_key(t) for t in texts]
+        return keys, self._store.get_many(self._scope(kind), keys)
+
+    def _missing_texts(self, texts, keys, found):
+        # 同一批里重复的文本只算一次
+        seen = set()
+        out = []
+        for t, k in zip(texts, keys):
+            if k not in found and k not in seen:
+                seen.add(k)
+                out.append(t)
+        return out
+
+    def get_text_embedding_batch(self, texts, show_progress=False, **kwargs):
+        # 未命中的文本整批交给底层 (调度器按 API 上限切分、并发请求)，不走基类按 embed_batch_size 串行切分
+        return self._get_text_embeddings(list(texts))
+
+    async def aget_text_embedding_batch(self, texts, show_progress=False, **kwargs):
+        return await self._aget_text_embeddings(list(texts))
+
+    def _save_partial(self, kind, missing, error):
+        results = getattr(error, "results", None)
+        if not results:
+            return
+        done = [(text_key(t), v) for t, v in zip(missing, results) if v is not None]
+        self._store.put_many(self._scope(kind), [(k, array.array("f", v).tolist()) for k, v in done])
+        if done:
+            print(f"🗃️ Embedding 部分失败，已缓存完成的 {len(done)}/{len(missing)} 条")
+
+    def _merge(self, kind, keys, found, computed):
+        """把新算出的向量写回缓存，并按原顺序拼出结果"""
+        unique_keys = list(dict.fromkeys(k for k in keys if k not in found))
+        # 统一按 float32 精度返回，首次计算和命中缓存的结果完全一致
+        computed = [array.array("f", v).tolist() for v in computed]
+        for key, vector in zip(unique_keys, computed):
+            found[key] = vector
+        self._store.put_many(self._scope(kind), list(zip(unique_keys, computed)))
+        return [found[k] for k in keys]
+
+    def _embed_batch(self, kind, texts, compute):
+        keys, found = self._lookup(kind, texts)
+        missing = self._missing_texts(texts, keys, found)
+        try:
+            computed = compute(missing) if missing else []
+        except Exception as e:
+            self._save_partial(kind, missing, e)
+            raise
+        return self._merge(kind, keys, found, computed)
+
+    async def _aembed_batch(self, kind, texts, acompute):
+        keys, found = self._lookup(kind, texts)
+        missing = self._missing_texts(texts, keys, found)
+        try:
+            computed = await acompute(missing) if missing else []
+        except Exception as e:
+            self._save_partial(kind, missing, e)
+            raise
+        return self._merge(kind, keys, found, computed)
+
+    def _get_query_embedding(self, query):
+        return self._embed_batch("query", [query], lambda ts: [self._inner.get_query_embedding(t) for t in ts])[0]
+
+    def _get_text_embedding(self, text):
+        return self._get_text_embeddings([text])[0]
+
+    def _get_text_embeddings(self, texts):
+        return self._embed_batch("text", texts, self._inner.get_text_embedding_batch)
+
+    async def _aget_query_embedding(self, query):
+        async def compute(ts):
+            return [await self._inner.aget_query_embedding(t) for t in ts]
+        return (await self._aembed_batch("query", [query], compute))[0]
+
+    async def _aget_text_embedding(self, text):
+        return (await self._aget_text_embeddings([text]))[0]
+
+    async def _aget_text_embeddings(self, texts):
+        return await self._aembed_batch("text", texts, self._inner.aget_text_embedding_batch)
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+def get_cache_store(path, max_entries):
+    """同一路径在进程内只打开一次 (Streamlit 每次 rerun 都会调用 init_settings)"""
+    with _stores_lock:
+        if path not in _stores:
+            _stores[path] = EmbeddingCacheStore(path, max_entries)
+        return _stores[path]
@@ -0,0 +1,311 @@
+# --- START OF FILE embed_scheduler.py ---
+
+import time
+import queue
+import random
+import asyncio
+import threading
+from typing import Any
+from concurrent.futures import ThreadPoolExecutor
+
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.bridge.pydantic import PrivateAttr
+
+
+def is_rate_limit_error(e):
+    """429 / 配额耗尽 (google-genai 的 ClientError.code、HTTP 客户端的 status_code，或错误文本)"""
+    for attr in ("code", "status_code", "status"):
+        if getattr(e, attr, None) == 429:
+            return True
+    text = str(e).lower()
+    return "429" in text or "resource_exhausted" in text or "rate limit" in text or "quota" in text
+
+
+def estimate_tokens(text):
+    # 粗略估算：中文约 1 字 1 token，英文约 4 字符 1 token，取折中
+    return max(1, len(text) // 3)
+
+
+class TokenBucket:
+    """
+    令牌桶限流，速率可自适应：
+    - 遇到 429：速率减半 (不低于 min_ratio * 配置速率)
+    - 连续成功：每次按配置速率的 5% 恢复，直到回到配置速率
+    rate_per_minute <= 0 表示不限流。
+    """
+
+    def __init__(self, rate_per_minute, min_ratio=0.1):
+        self.max_rate = rate_per_minute / 60.0
+        self.rate = self.max_rate
+        self.min_rate = self.max_rate * min_ratio
+        self.capacity = max(self.max_rate, 1.0)  # 最多攒 1 秒的额度
+        self.tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.max_rate > 0
+
+    def acquire(self, amount=1.0):
+        if not self.enabled:
+            return
+        # 单次需求超过桶容量时按容量算，否则永远拿不到
+        amount = min(amount, self.capacity)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                wait = (amount - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def throttle(self):
+        if self.enabled:
+            with self._lock:
+                self.rate = max(self.min_rate, self.rate * 0.5)
+                self.tokens = 0.0
+
+    def recover(self):
+        if self.enabled and self.rate < self.max_rate:
+            with self._lock:
+                self.rate = min(self.max_rate, self.rate + self.max_rate * 0.05)
+
+
+class PartialEmbeddingError(RuntimeError):
+    """
+    某一批最终失败。results 与输入同序，已完成批次的位置是向量、其余为 None；
+    外层的 CachedEmbedding 把完成的部分写进缓存，文件重试时只需补算失败的部分。
+    """
+
+    def __init__(self, error, results):
+        super().__init__(str(error))
+        self.error = error
+        self.results = results
+
+
+class _Request:
+    """一次调用方请求：可能被拆进多个批次，全部批次完成后唤醒调用方"""
+
+    def __init__(self, count):
+        self.results = [None] * count
+        self.remaining = count
+        self.error = None
+        self.done = threading.Event()
+        self._lock = threading.Lock()
+
+    def fulfill(self, index, vector):
+        with self._lock:
+            self.results[index] = vector
+            self.remaining -= 1
+            if self.remaining == 0:
+                self.done.set()
+
+    def fail(self, error):
+        with self._lock:
+            if self.error is None:
+                self.error = error
+            self.done.set()
+
+
+class EmbeddingScheduler(BaseEmbedding):
+    """
+    包装 Embedding 模型的批量调度器：
+    1. 所有线程 (多个文件同时入库) 的文本进入同一个队列，凑成尽量满的批次再请求
+    2. 最多 max_concurrency 个请求并发；并发占满时队列继续攒批
+    3. 请求数 / token 两个令牌桶限流，遇到 429 自适应降速 + 指数退避重试
+    4. 每个批次独立完成、独立重试；重试用完仍失败的批次对半拆开再试，只让出错的文本所在的请求失败，
+       同批的其他文件照常完成。调用方的请求最终失败时抛出 PartialEmbeddingError，带上已完成的向量
+    放在 CachedEmbedding 里面：命中缓存的文本不进队列、不占限流额度。
+    """
+
+    _inner: Any = PrivateAttr()
+    _requests: Any = PrivateAttr()
+    _tokens: Any = PrivateAttr()
+    _queue: Any = PrivateAttr()
+    _slots: Any = PrivateAttr()
+    _executor: Any = PrivateAttr()
+    _dispatcher: Any = PrivateAttr()
+    _start_lock: Any = PrivateAttr()
+    _stats: Any = PrivateAttr()
+    _stats_lock: Any = PrivateAttr()
+    _max_batch_size: int = PrivateAttr()
+    _max_batch_tokens: int = PrivateAttr()
+    _linger: float = PrivateAttr()
+    _max_retries: int = PrivateAttr()
+
+    def __init__(self, inner, max_batch_size=100, max_batch_tokens=0, max_concurrency=4,
+                 requests_per_minute=0, tokens_per_minute=0, max_retries=6, linger_ms=20, **kwargs):
+        kwargs.setdefault("model_name", inner.model_name)
+        kwargs.setdefault("embed_batch_size", max_batch_size)
+        super().__init__(**kwargs)
+        self._inner = inner
+        self._requests = TokenBucket(requests_per_minute)
+        self._tokens = TokenBucket(tokens_per_minute)
+        self._queue = queue.Queue()
+        self._slots = threading.Semaphore(max_concurrency)
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="embed")
+        self._dispatcher = None
+        self._start_lock = threading.Lock()
+        self._stats = {"requests": 0, "texts": 0, "throttled": 0, "retries": 0, "failed_batches": 0, "split_batches": 0}
+        self._stats_lock = threading.Lock()
+        self._max_batch_size = max_batch_size
+        self._max_batch_tokens = max_batch_tokens
+        self._linger = linger_ms / 1000.0
+        self._max_retries = max_retries
+
+    @classmethod
+    def class_name(cls):
+        return "EmbeddingScheduler"
+
+    @property
+    def inner(self):
+        return self._inner
+
+    def stats(self):
+        with self._stats_lock:
+            s = dict(self._stats)
+        s["request_rate_per_min"] = self._requests.rate * 60
+        s["avg_batch_size"] = s["texts"] / s["requests"] if s["requests"] else 0.0
+        return s
+
+    # --- 对外接口 ---
+
+    def get_text_embedding_batch(self, texts, show_progress=False, **kwargs):
+        # 整批交给调度器，由调度器按 API 上限切分 (不走基类按 embed_batch_size 串行切分的逻辑)
+        return self._embed_many(list(texts))
+
+    async def aget_text_embedding_batch(self, texts, show_progress=False, **kwargs):
+        return await asyncio.to_thread(self._embed_many, list(texts))
+
+    def _get_text_embeddings(self, texts):
+        return self._embed_many(texts)
+
+    def _get_text_embedding(self, text):
+        return self._embed_many([text])[0]
+
+    def _get_query_embedding(self, query):
+        # 查询对延迟敏感：不排队攒批，直接请求，但同样受限流和重试保护
+        return self._call_with_retry(lambda: self._inner.get_query_embedding(query), 1, estimate_tokens(query))
+
+    async def _aget_query_embedding(self, query):
+        return await asyncio.to_thread(self._get_query_embedding, query)
+
+    async def _aget_text_embedding(self, text):
+        return (await asyncio.to_thread(self._embed_many, [text]))[0]
+
+    async def _aget_text_embeddings(self, texts):
+        return await asyncio.to_thread(self._embed_many, texts)
+
+    # --- 调度 ---
+
+    def _embed_many(self, texts):
+        if not texts:
+            return []
+        self._ensure_dispatcher()
+        request = _Request(len(texts))
+        for i, text in enumerate(texts):
+            self._queue.put((request, i, text))
+        request.done.wait()
+        if request.error is not None:
+            raise PartialEmbeddingError(request.error, list(request.results)) from request.error
+        return request.results
+
+    def _ensure_dispatcher(self):
+        if self._dispatcher is None:
+            with self._start_lock:
+                if self._dispatcher is None:
+                    self._dispatcher = threading.Thread(target=self._dispatch_loop, daemon=True, name="embed-dispatcher")
+                    self._dispatcher.start()
+
+    def _dispatch_loop(self):
+        carry = None
+        while True:
+            first = carry or self._queue.get()
+            carry = None
+            batch = [first]
+            batch_tokens = estimate_tokens(first[2])
+            deadline = time.monotonic() + self._linger
+            while len(batch) < self._max_batch_size:
+                try:
+                    item = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                tokens = estimate_tokens(item[2])
+                if self._max_batch_tokens and batch_tokens + tokens > self._max_batch_tokens:
+                    carry = item  # 放进下一批
+                    break
+                batch.append(item)
+                batch_tokens += tokens
+            # 并发已满时在这里阻塞，新来的文本留在队列里，下一批就能凑得更满
+            self._slots.acquire()
+            self._executor.submit(self._run_batch, batch, batch_tokens)
+
+    def _run_batch(self, batch, batch_tokens):
+        try:
+            self._embed_items(batch, batch_tokens, self._max_retries)
+        finally:
+            self._slots.release()
+
+    def _embed_items(self, items, tokens, max_retries):
+        # 同一批里已经失败的请求 (另一批报错) 不必再算
+        live = [item for item in items if item[0].error is None]
+        if not live:
+            return
+        texts = [item[2] for item in live]
+        try:
+            # 直接调用单次请求的接口：get_text_embedding_batch 会按内层模型自己的 embed_batch_size 再切成多次请求，
+            # 而限流只按一次请求计
+            vectors = self._call_with_retry(lambda: self._inner._get_text_embeddings(texts), len(texts), tokens, max_retries)
+        except Exception as e:
+            if len(live) > 1 and not is_rate_limit_error(e):
+                # 可能是其中某条文本有问题 (过长、内容被拒)：对半拆开各试一次，把它隔离出来，
+                # 同批里其他文件的文本照常完成。配额耗尽时拆开也没用，整批失败
+                self._count("split_batches")
+                mid = len(live) // 2
+                for half in (live[:mid], live[mid:]):
+                    self._embed_items(half, sum(estimate_tokens(item[2]) for item in half), 0)
+                return
+            self._count("failed_batches")
+            for request, _, _ in live:
+                request.fail(e)
+            return
+        for (request, index, _), vector in zip(live, vectors):
+            request.fulfill(index, vector)
+
+    def _count(self, key, amount=1):
+        # 多个请求线程同时更新
+        with self._stats_lock:
+            self._stats[key] += amount
+
+    def _call_with_retry(self, fn, text_count, tokens, max_retries=None):
+        max_retries = self._max_retries if max_retries is None else max_retries
+        attempt = 0
+        while True:
+            self._requests.acquire(1)
+            self._tokens.acquire(tokens)
+            try:
+                result = fn()
+            except Exception as e:
+                attempt += 1
+                if attempt > max_retries:
+                    raise
+                self._count("retries")
+                if is_rate_limit_error(e):
+                    self._count("throttled")
+                    self._requests.throttle()
+                    self._tokens.throttle()
+                # 指数退避 + 抖动，避免并发请求同时重试
+                delay = min(60.0, 0.5 * 2 ** (attempt - 1)) * (0.5 + random.random())
+                print(f"⏳ Embedding 请求失败 (第 {attempt} 次)，{delay:.1f}s 后重试: {e}")
+                time.sleep(delay)
+                continue
+            self._requests.recover()
+            self._tokens.recover()
+            with self._stats_lock:
+                self._stats["requests"] += 1
+                self._stats["texts"] += text_count
+            return result
@@ -1,33 +1,59 @@
 import os
-import qdrant_client
-import streamlit as st  # 🔴 新增：引入 streamlit
-from llama_index.core import VectorStoreIndex, StorageContext, Settings
-from llama_index.vector_stores.qdrant import QdrantVectorStore
-from llama_index.readers.docling import DoclingReader
-from llama_index.core import SimpleDirectoryReader
+import json
+import uuid
+import hashlib
+import threading
+from llama_index.core import Settings
+from llama_index.core.schema import MetadataMode, TextNode
+from llama_index.core.readers.file.base import default_file_metadata_func
 from qdrant_client.http import models
 
 # 引入新模块
-from modules.database import add_document_start, update_document_success, update_document_failed
+from modules.database import (
+    add_document_start, update_document_success, update_document_failed,
+    get_document, find_document_by_hash, hash_in_use, get_chunk_hashes, find_points_by_chunk_hash, replace_chunks,
+    bump_collection_generation,
+)
 from modules.metadata import extract_metadata_from_text
+from modules.page_cache import get_page_cache, fitz_lock
+from modules.sparse_index import get_sparse_index
+from modules.memory_guard import MemoryGuard, current_rss_mb
+from modules.pipeline import get_pipeline
+from modules.vector_store import ensure_collection, get_shared_client
+from modules.telemetry import traced, trace, inc
+from config import (
+    PAGE_PRERENDER_PAGES, QDRANT_MODE, QDRANT_PATH, QDRANT_UPSERT_BATCH, QDRANT_UPSERT_PARALLEL, CHUNK_TOKENIZER, CHUNK_MAX_TOKENS,
+    STREAM_PARSE_MIN_PAGES, PARSE_WINDOW_PAGES, STREAM_EMBED_BATCH, PARSE_MAX_RSS_MB,
+)
 
-STORAGE_PATH = "./storage_db"
+STORAGE_PATH = QDRANT_PATH
 COLLECTION_NAME = "gemini_rag"
 
-# 🔴 核心修改：使用缓存装饰器，确保全局只有一个 client 实例
-@st.cache_resource
+# 块 ID 的命名空间 (uuid5)，保证同一文件里同样的块每次得到同样的点 ID
+_CHUNK_ID_NAMESPACE = uuid.UUID("6f1d2c1e-8a53-4d6b-9d0e-3c4f7a2b9e10")
+
+def file_hash(file_path):
+    """文件内容 SHA-256 (分块读取，大文件也不会占内存)"""
+    h = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def text_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
 def get_client():
-    if not os.path.exists(STORAGE_PATH):
-        os.makedirs(STORAGE_PATH)
-    # 本地模式下，只需初始化一次
-    return qdrant_client.QdrantClient(path=STORAGE_PATH)
+    """每个进程一个客户端 (嵌入 / 服务 / 内存模式见 QDRANT_MODE 和 modules/vector_store.py)"""
+    return get_shared_client()
 
 def delete_file_from_vector_db(filename):
     """从 Qdrant 中物理删除指定文件的所有向量"""
     # 这里调用的 get_client() 会返回缓存的同一个实例，不会触发文件锁
     client = get_client() 
     try:
-        # 使用 Filter 删除
+        # 使用 Filter 删除 (filename 有 payload 索引，不会全量扫描)
+        ensure_collection(client, COLLECTION_NAME)
         client.delete(
             collection_name=COLLECTION_NAME,
             points_selector=models.FilterSelector(
@@ -41,63 +67,513 @@ def delete_file_from_vector_db(filename):
                 )
             ),
         )
+        get_sparse_index().delete_file(filename)
+        bump_collection_generation([filename])
         print(f"🗑️ 已从向量库删除: {filename}")
     except Exception as e:
         print(f"⚠️ 向量库删除失败 (可能是集合不存在): {e}")
 
-def process_single_file(file_path):
+    # 同步清掉该文件的页面截图缓存
+    try:
+        record = get_document(filename)
+        if record:
+            release_page_cache(filename, record.get("content_hash"))
+    except Exception as e:
+        print(f"⚠️ 截图缓存清理失败: {e}")
+
+def release_page_cache(filename, content_hash):
+    """filename 不再使用这份内容时清掉它的页面截图；其他文件 (同内容不同文件名) 还在用就保留"""
+    if content_hash and not hash_in_use(content_hash, exclude_filename=filename):
+        get_page_cache().invalidate(content_hash)
+
+# --- 入库流水线的各个阶段 ---
+# 拆成独立函数，process_single_file 按文件大小组合调用 (整份解析 / 按页窗口流式)；
+# 解析在解析进程池里执行，元数据 / 向量化 / 写入占用流水线对应阶段的处理位 (见 modules/pipeline.py)
+
+_docling_reader = None
+_chunker = None
+_parse_lock = threading.Lock()
+_init_lock = threading.Lock()
+
+def _get_docling_reader():
+    """每个进程只初始化一次 DoclingReader (解析子进程中复用，避免重复加载模型)；Docling 导入很慢，首次使用时才导入"""
+    global _docling_reader
+    if _docling_reader is None:
+        with _init_lock:
+            if _docling_reader is None:
+                from llama_index.readers.docling import DoclingReader
+                _docling_reader = DoclingReader(export_type="markdown")
+    return _docling_reader
+
+def _get_chunker():
+    """
+    Docling HybridChunker：按文档结构 (标题/段落/表格) 分块，再按 token 预算拆分过长的块、合并过短的同级块。
+    token 用重排序模型的分词器计数，默认上限给问题留出位置，重排时块不会被截断。
+    """
+    global _chunker
+    if _chunker is None:
+        with _init_lock:
+            if _chunker is None:
+                _chunker = _build_chunker()
+    return _chunker
+
+def _build_chunker():
+    from docling.chunking import HybridChunker
+    try:
+        from docling_core.transforms.chunker.tokenizer.huggingface import HuggingFaceTokenizer
+        tokenizer = HuggingFaceTokenizer.from_pretrained(model_name=CHUNK_TOKENIZER, max_tokens=CHUNK_MAX_TOKENS)
+        return HybridChunker(tokenizer=tokenizer, merge_peers=True)
+    except ImportError:
+        # 旧版 docling-core：直接传模型名和 max_tokens
+        return HybridChunker(tokenizer=CHUNK_TOKENIZER, max_tokens=CHUNK_MAX_TOKENS, merge_peers=True)
+
+def warm_up_parser():
+    """预热：导入 Docling、加载版面/表格模型和分块用的分词器，第一次入库不用再等"""
+    converter = _get_docling_reader().doc_converter
+    initialize = getattr(converter, "initialize_pipeline", None)
+    if initialize is not None:
+        from docling.datamodel.base_models import InputFormat
+        with _parse_lock:
+            initialize(InputFormat.PDF)
+    _get_chunker()
+
+def parse_file(file_path, page_range=None):
+    """Docling 解析为 DoclingDocument (CPU 密集)；page_range 为 (起始页, 结束页)，从 1 开始"""
+    converter = _get_docling_reader().doc_converter
+    # 同一进程内多个线程共用一个 DocumentConverter，串行解析 (并行靠解析进程池，见 parse_document)
+    with _parse_lock:
+        if page_range:
+            return converter.convert(file_path, page_range=page_range).document
+        return converter.convert(file_path).document
+
+def make_preview(nodes, limit=5000):
+    """拼接前几个块的正文，作为元数据提取的输入 (够长就停，不拼接全文)"""
+    parts, size = [], 0
+    for n in nodes:
+        parts.append(n.text)
+        size += len(n.text) + 1
+        if size >= limit:
+            break
+    return "\n".join(parts)[:limit]
+
+def _chunk_provenance(chunk):
+    """块覆盖的页码 (升序去重) 和版面框 [[页码, l, t, r, b], ...]"""
+    pages, bboxes = [], []
+    for item in chunk.meta.doc_items:
+        for prov in item.prov:
+            if prov.page_no not in pages:
+                pages.append(prov.page_no)
+            b = prov.bbox
+            bboxes.append([prov.page_no, round(b.l, 1), round(b.t, 1), round(b.r, 1), round(b.b, 1)])
+    return sorted(pages), bboxes
+
+def chunk_document(dl_doc, file_path, seen=None):
+    """
+    结构化分块。
+    每块带上精确的页码范围 (page_start/page_end，page_label 取起始页) 与版面框，块正文前拼上所属标题。
+    节点 ID 由 (文件名, 块哈希, 序号) 决定，同样的内容总能得到同样的块和 ID，增量更新才能对得上。
+    分批处理同一个文件时传入同一个 seen，序号才能跨批次连续。
+    """
     filename = os.path.basename(file_path)
+    base_meta = default_file_metadata_func(file_path)
+    chunker = _get_chunker()
+    seen = {} if seen is None else seen
+    nodes = []
+    for chunk in chunker.chunk(dl_doc):
+        text = chunker.contextualize(chunk)
+        if not text.strip():
+            continue
+        pages, bboxes = _chunk_provenance(chunk)
+        chunk_hash = text_hash(text)
+        occurrence = seen.get(chunk_hash, 0)
+        seen[chunk_hash] = occurrence + 1
+        metadata = {
+            **base_meta,
+            "page_label": str(pages[0]) if pages else "1",
+            "page_start": pages[0] if pages else 1,
+            "page_end": pages[-1] if pages else 1,
+            "bboxes": bboxes,
+            "headings": " > ".join(chunk.meta.headings or []),
+            "chunk_hash": chunk_hash,
+        }
+        node = TextNode(
+            id_=str(uuid.uuid5(_CHUNK_ID_NAMESPACE, f"{filename}:{chunk_hash}:{occurrence}")),
+            text=text,
+            metadata=metadata,
+            # 元数据只存 payload，向量化的只有 (带标题的) 正文
+            excluded_embed_metadata_keys=list(metadata),
+            excluded_llm_metadata_keys=list(metadata),
+        )
+        nodes.append(node)
+    return nodes
+
+def parse_and_chunk(file_path, page_range=None, seen=None):
+    """
+    解析 + 分块，在解析子进程里执行 (模块级函数才能 pickle)。
+    只回传块，不回传 DoclingDocument，减少进程间拷贝。返回 (块, 页数, seen, 解析内存 MB)：
+    按页窗口解析时页数为 None；解析内存是这次解析让所在进程的常驻内存增长了多少。
+    """
+    before = current_rss_mb()
+    dl_doc = parse_file(file_path, page_range)
+    parse_mb = max(current_rss_mb() - before, 0.0)
+    seen = {} if seen is None else seen
+    nodes = chunk_document(dl_doc, file_path, seen)
+    page_count = None if page_range else document_page_count(dl_doc, file_path)
+    return nodes, page_count, seen, parse_mb
+
+@traced("ingest.parse")
+def parse_document(file_path, page_range=None, seen=None):
+    """阶段 1：解析 + 分块，交给解析进程池 (排队等待的时间也计入)，返回值同 parse_and_chunk"""
+    return get_pipeline().parse(parse_and_chunk, file_path, page_range, seen)
+
+@traced("ingest.metadata")
+def build_metadata(preview_text, filename, content_hash=None):
+    """阶段 2：AI 提取元数据；同内容的文件已经入库过则直接复用，不再调用 LLM"""
+    if content_hash:
+        twin = find_document_by_hash(content_hash, exclude_filename=filename)
+        if twin and twin.get("meta_json"):
+            print(f"♻️ 复用同内容文件的元数据: {twin['filename']}")
+            return json.loads(twin["meta_json"])
+    return extract_metadata_from_text(preview_text, filename, content_hash)
+
+def apply_metadata(nodes, meta, filename):
+    """注入元数据。文档级元数据对同一文件的每个块都一样，只存 payload，不参与向量化"""
+    for node in nodes:
+        node.metadata.update(meta)
+        node.metadata["filename"] = filename
+        keys = list(node.metadata.keys())
+        node.excluded_embed_metadata_keys = keys
+        node.excluded_llm_metadata_keys = keys
+
+def plan_upsert(filename, nodes):
+    """对比块表，算出需要新写入的块和需要删除的旧点"""
+    existing = get_chunk_hashes(filename)
+    new_ids = {n.node_id for n in nodes}
+    return {
+        "nodes": nodes,
+        "to_add": [n for n in nodes if n.node_id not in existing],
+        "stale_ids": [pid for pid in existing if pid not in new_ids],
+        # 块表里没有记录 (新文件或旧版本入库的数据)：按文件名整体清理后重建
+        "full_rebuild": not existing,
+    }
+
+def _dense_vector(vector):
+    # 命名向量时 Qdrant 返回 dict
+    if isinstance(vector, dict):
+        return next((v for v in vector.values() if isinstance(v, list)), None)
+    return vector
+
+def _reuse_embeddings(nodes):
+    """按块哈希从向量库取回已有向量 (同文件未变的块 / 其他文件里相同的块)"""
+    found = find_points_by_chunk_hash({n.metadata["chunk_hash"] for n in nodes})
+    if not found:
+        return 0
+    try:
+        records = get_client().retrieve(
+            collection_name=COLLECTION_NAME,
+            ids=list(set(found.values())),
+            with_vectors=True,
+        )
+    except Exception as e:
+        print(f"⚠️ 读取已有向量失败，全部重新计算: {e}")
+        return 0
+
+    vectors = {str(r.id): _dense_vector(r.vector) for r in records}
+    reused = 0
+    for node in nodes:
+        vector = vectors.get(found.get(node.metadata["chunk_hash"]))
+        if vector is not None:
+            node.embedding = list(vector)
+            reused += 1
+    return reused
+
+@traced("ingest.embed")
+def embed_nodes(nodes):
+    """阶段 3：计算向量，只对向量库里找不到相同正文的块调用 Embedding"""
+    pending = [n for n in nodes if n.embedding is None]
+    reused = _reuse_embeddings(pending) if pending else 0
+    pending = [n for n in pending if n.embedding is None]
+
+    if pending:
+        texts = [n.get_content(metadata_mode=MetadataMode.EMBED) for n in pending]
+        embeddings = Settings.embedding.get_text_embedding_batch(texts)
+        for node, embedding in zip(pending, embeddings):
+            node.embedding = embedding
+    print(f"🧬 向量化 {len(pending)} 块，复用 {reused} 块")
+    return nodes
+
+def delete_points(point_ids, filename=None):
+    """按点 ID 删除向量 (增量更新时清理已不存在的块)；filename 为这些点所属的文件"""
+    if not point_ids:
+        return
+    get_client().delete(
+        collection_name=COLLECTION_NAME,
+        points_selector=models.PointIdsList(points=list(point_ids)),
+    )
+    get_sparse_index().delete_points(point_ids)
+    bump_collection_generation([filename] if filename else None)
+
+def remove_stale_points(filename, plan):
+    if plan["full_rebuild"]:
+        delete_file_from_vector_db(filename)
+    else:
+        delete_points(plan["stale_ids"], filename)
+
+@traced("ingest.upsert")
+def upsert_nodes(nodes):
+    """阶段 4：写入向量库 (集合不存在时按配置创建，并建好 payload 索引)"""
+    if not nodes:
+        return []
+    client = get_client() # 🔴 获取全局单例 Client
+    ensure_collection(client, COLLECTION_NAME, dim=len(nodes[0].embedding))
+    from llama_index.vector_stores.qdrant import QdrantVectorStore
+
+    # 按批上传；服务模式下可以多进程并行 (嵌入 / 内存模式的客户端不能跨进程)
+    vector_store = QdrantVectorStore(
+        client=client, collection_name=COLLECTION_NAME, batch_size=QDRANT_UPSERT_BATCH,
+        parallel=QDRANT_UPSERT_PARALLEL if QDRANT_MODE == "server" else 1,
+    )
+    ids = vector_store.add(nodes)
+    # 同步维护 BM25 倒排索引 (只索引正文)
+    get_sparse_index().add([
+        (n.node_id, n.metadata.get("filename"), n.get_content(metadata_mode=MetadataMode.NONE)) for n in nodes
+    ])
+    bump_collection_generation(n.metadata.get("filename") for n in nodes)
+    return ids
+
+def record_chunks(filename, plan):
+    replace_chunks(filename, [(n.node_id, n.metadata["chunk_hash"]) for n in plan["nodes"]])
+
+def find_unchanged(filename, content_hash):
+    """同名文件已成功入库且内容未变，返回其记录；否则返回 None"""
+    existing = get_document(filename)
+    if existing and existing["status"] == "completed" and existing.get("content_hash") == content_hash:
+        return existing
+    if existing:
+        # 内容变了：旧版本的页面截图不会再被用到 (除非还有别的文件是这份内容)
+        release_page_cache(filename, existing.get("content_hash"))
+    return None
+
+@traced("ingest.prerender")
+def prerender_pages(file_path, content_hash):
+    """按配置预渲染页面截图 (失败不影响入库)"""
+    if PAGE_PRERENDER_PAGES == 0:
+        return
+    try:
+        get_page_cache().prerender(file_path, content_hash, PAGE_PRERENDER_PAGES)
+    except Exception as e:
+        print(f"⚠️ 预渲染失败: {e}")
+
+# --- 大文件流式入库 ---
+
+class IngestionCancelled(Exception):
+    """入库过程中被取消 (由 on_stage 回调抛出)"""
+
+def pdf_page_count(file_path):
+    import fitz
+    with fitz_lock, fitz.open(file_path) as pdf:
+        return len(pdf)
+
+def document_page_count(dl_doc, file_path):
+    if file_path.lower().endswith(".pdf"):
+        return pdf_page_count(file_path)
+    return len(dl_doc.pages) or 1
+
+def iter_page_windows(file_path, window_pages, guard):
+    """
+    按页窗口调用 Docling (page_range) 并分块，逐个窗口产出这一窗口的块 (页码保持原文件页码)。
+    DoclingDocument 只在解析进程里存在，分块后即释放；每个窗口之后检查内存，超出上限时缩小窗口。
+    """
+    total = pdf_page_count(file_path)
+    in_subprocess = get_pipeline().parses_in_subprocess
+    window = max(window_pages, 1)
+    seen = {}
+    start = 1
+    while start <= total:
+        end = min(start + window - 1, total)
+        nodes, _, seen, parse_mb = parse_document(file_path, (start, end), seen)
+        yield nodes
+        start = end + 1
+        # 在解析子进程里解析时，本进程的 RSS 看不到解析占用的内存，单独计入
+        window = guard.check(window, parse_mb if in_subprocess else 0.0)
+
+def iter_chunk_batches(file_path, guard, window_pages=PARSE_WINDOW_PAGES, batch_size=STREAM_EMBED_BATCH):
+    """把逐窗口解析出的块按 batch_size 个一批产出"""
+    buffer = []
+    for nodes in iter_page_windows(file_path, window_pages, guard):
+        buffer.extend(nodes)
+        while len(buffer) >= batch_size:
+            yield buffer[:batch_size]
+            buffer = buffer[batch_size:]
+    if buffer:
+        yield buffer
+
+def ingest_streaming(file_path, filename, content_hash, guard, stage):
+    """
+    流式入库：解析一批、向量化一批、写入一批，内存里只保留当前批次的块。
+    元数据只用第一批 (前几页) 的正文提取。返回 (元数据, 页数)；文件为空时元数据为 None。
+    """
+    existing = get_chunk_hashes(filename)
+    if not existing:
+        # 新文件或旧版本入库的数据：先按文件名整体清理
+        delete_file_from_vector_db(filename)
+
+    pipeline = get_pipeline()
+    chunk_rows = []
+    added_ids = []
+    meta = None
+    try:
+        for batch in iter_chunk_batches(file_path, guard):
+            if meta is None:
+                stage("提取元数据")
+                with pipeline.stage("metadata"):
+                    meta = build_metadata(make_preview(batch), filename, content_hash)
+            apply_metadata(batch, meta, filename)
+            chunk_rows.extend((n.node_id, n.metadata["chunk_hash"]) for n in batch)
+
+            stage(f"向量化/写入 (已处理 {len(chunk_rows)} 块)")
+            to_add = [n for n in batch if n.node_id not in existing]
+            with pipeline.stage("embed"):
+                embed_nodes(to_add)
+            # 先记下再写入：写入中途失败时，这一批里已经落库的点也要清掉
+            added_ids.extend(n.node_id for n in to_add)
+            with pipeline.stage("upsert"):
+                upsert_nodes(to_add)
+    except Exception:
+        # 取消 / 解析失败 / 超出内存上限 / 向量化失败：已经写入的批次没有块记录，
+        # 按 ID 删除的路径找不到它们，这里清掉，不留半个文件在库里 (旧版本的块和块记录保持不变)
+        _discard_partial(filename, existing, added_ids)
+        raise
+
+    if meta is None:
+        return None, 0
+    new_ids = {point_id for point_id, _ in chunk_rows}
+    delete_points([pid for pid in existing if pid not in new_ids], filename)
+    replace_chunks(filename, chunk_rows)
+    return meta, pdf_page_count(file_path)
+
+def _discard_partial(filename, existing, added_ids):
+    if not added_ids:
+        return
+    try:
+        if existing:
+            delete_points(added_ids, filename)
+        else:
+            # 开头已按文件名整体清理过，库里只有本次写入的点
+            delete_file_from_vector_db(filename)
+        print(f"🧹 已清理中断入库写入的 {len(added_ids)} 个点: {filename}")
+    except Exception as e:
+        print(f"⚠️ 清理中断入库的向量失败: {e}")
+
+def _ingest_in_memory(file_path, filename, content_hash, stage):
+    """整份文件一次解析后入库 (普通大小的文件)，返回 (元数据, 页数)；解析为空时元数据为 None"""
+    pipeline = get_pipeline()
+    # 2. Docling 解析 + 分块 (解析进程池)
+    stage("解析")
+    nodes, page_count, _, _ = parse_document(file_path)
+    if not nodes:
+        return None, 0
+    prerender_pages(file_path, content_hash)
+
+    # 3. AI 提取元数据 & 4. 注入元数据
+    stage("提取元数据")
+    with pipeline.stage("metadata"):
+        meta = build_metadata(make_preview(nodes), filename, content_hash)
+    apply_metadata(nodes, meta, filename)
+
+    # 5. 只向量化新增/变化的块
+    stage("向量化")
+    plan = plan_upsert(filename, nodes)
+    with pipeline.stage("embed"):
+        embed_nodes(plan["to_add"])
+
+    # 6. 删除过期块，写入新块 (之后不再响应取消，避免只写了一半)
+    stage("写入向量库")
+    with pipeline.stage("upsert"):
+        remove_stale_points(filename, plan)
+        upsert_nodes(plan["to_add"])
+        record_chunks(filename, plan)
+    return meta, page_count
+
+# 文件本身的问题 (不存在、解析为空、格式不支持、损坏)：同一个文件重试结果也一样
+UNPARSEABLE_PREFIX = "无法解析"
+PERMANENT_FAILURES = ("源文件不存在", "解析结果为空")
+
+def is_unparseable(exc):
+    """格式不支持、文件损坏 / 加密：PyMuPDF 打不开，或 Docling 转换失败"""
+    import fitz
+    if isinstance(exc, (fitz.FileDataError, fitz.EmptyFileError)):
+        return True
+    try:
+        from docling.exceptions import ConversionError
+    except ImportError:
+        return False
+    return isinstance(exc, ConversionError)
+
+def is_retryable(message):
+    """失败后是否值得重试 (网络、限流、内存不足等临时问题)；文件本身的问题直接判为失败"""
+    return message not in PERMANENT_FAILURES and not message.startswith(UNPARSEABLE_PREFIX)
+
+def ingest_result(ok, message):
+    if ok:
+        return "skipped" if message.startswith("内容未变化") else "success"
+    return "cancelled" if message == "已取消" else "failed"
+
+def process_single_file(file_path, on_stage=None):
+    """
+    串行执行完整入库流程，返回 (是否成功, 说明, 页数)。
+    on_stage(阶段名) 在每个阶段开始前调用 (后台任务用它上报进度/心跳)，抛出 IngestionCancelled 即中止。
+    各阶段耗时记入运行指标，整个文件记为一条入库链路。
+    """
+    filename = os.path.basename(file_path)
+    with trace("ingest", filename) as t:
+        ok, message, page_count = _process_single_file(file_path, filename, on_stage or (lambda name: None))
+        t.attrs.update(result=ingest_result(ok, message), pages=page_count)
+    inc("rag_ingest_files_total", 1, "入库文件数 (按结果)", result=t.attrs["result"])
+    return ok, message, page_count
+
+def _process_single_file(file_path, filename, stage):
+
+    # 0. 内容未变化的重复上传直接跳过
+    content_hash = file_hash(file_path)
+    unchanged = find_unchanged(filename, content_hash)
+    if unchanged:
+        print(f"⏭️ [内容未变化，跳过] {filename}")
+        return True, "内容未变化，跳过", unchanged.get("page_count") or 0
     
     # 1. 数据库占位
     add_document_start(filename, file_path)
     print(f"🔄 [开始处理] {filename} ...")
     
+    guard = MemoryGuard(PARSE_MAX_RSS_MB)
     try:
-        # 2. Docling 解析
-        reader = DoclingReader(export_type="markdown")
-        file_extractor = {".pdf": reader}
-        dir_reader = SimpleDirectoryReader(
-            input_files=[file_path],
-            file_extractor=file_extractor
-        )
-        documents = dir_reader.load_data()
-        
-        if not documents:
+        with guard:
+            if file_path.lower().endswith(".pdf") and pdf_page_count(file_path) >= STREAM_PARSE_MIN_PAGES:
+                # 大文件：按页窗口流式解析/入库，内存占用与总页数无关
+                stage("解析")
+                meta, page_count = ingest_streaming(file_path, filename, content_hash, guard, stage)
+                if meta is not None:
+                    prerender_pages(file_path, content_hash)
+            else:
+                meta, page_count = _ingest_in_memory(file_path, filename, content_hash, stage)
+
+        if meta is None:
             update_document_failed(filename, "解析为空")
             return False, "解析结果为空", 0
 
-        # 3. AI 提取元数据
-        full_text_preview = "\n".join([d.text for d in documents])[:5000]
-        meta = extract_metadata_from_text(full_text_preview, filename)
-        
-        # 4. 注入元数据
-        for doc in documents:
-            doc.metadata.update(meta)
-            doc.metadata["filename"] = filename
-
-        # 5. 存入向量库
-        client = get_client() # 🔴 获取全局单例 Client
-        
-        # ⚠️ 注意：每次 process 都要检查集合是否存在，如果不存在会自动创建
-        # 但 QdrantVectorStore 可能会尝试重新初始化，这里我们要小心处理
-        vector_store = QdrantVectorStore(client=client, collection_name=COLLECTION_NAME)
-        storage_context = StorageContext.from_defaults(vector_store=vector_store)
-        
-        # 先删除旧向量 (如果重新上传同名文件)
-        delete_file_from_vector_db(filename)
-
-        VectorStoreIndex.from_documents(
-            documents,
-            storage_context=storage_context,
-            embed_model=Settings.embedding
-        )
-        
-        # 6. 更新数据库状态
-        update_document_success(filename, meta, len(documents))
-        return True, "成功入库", len(documents)
+        # 7. 更新数据库状态
+        update_document_success(filename, meta, page_count, content_hash)
+        print(f"📈 {filename}: 峰值内存 {guard.peak_mb:.0f} MB (开始时 {guard.start_mb:.0f} MB，增长 {guard.peak_growth_mb:.0f} MB)")
+        return True, f"成功入库 (峰值内存 {guard.peak_mb:.0f} MB)", page_count
 
+    except IngestionCancelled:
+        print(f"⛔ [已取消] {filename}")
+        update_document_failed(filename, "已取消")
+        return False, "已取消", 0
     except Exception as e:
         import traceback
         traceback.print_exc()
         update_document_failed(filename, str(e))
-        return False, f"处理失败: {str(e)}", 0
\ No newline at end of file
+        if is_unparseable(e):
+            return False, f"{UNPARSEABLE_PREFIX}: {str(e)}", 0
+        return False, f"处理失败: {str(e)}", 0
@@ -0,0 +1,84 @@
+# --- START OF FILE memory_guard.py ---
+
+import gc
+import os
+import threading
+
+
+def current_rss_mb():
+    """当前进程常驻内存 (MB)。Linux 读 /proc，其他平台退化为 ru_maxrss (历史峰值)"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import resource
+        import sys
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+    except Exception:
+        return 0.0
+
+
+class MemoryGuard:
+    """
+    单个文件入库期间的内存监控：
+    - 后台线程定期采样 RSS，记录本文件处理期间的峰值 (peak_mb)
+    - 上限 limit_mb 限制的是本文件处理期间的内存增长 (当前 RSS - 开始时的 RSS，加上解析子进程里当前窗口占用的内存)，
+      进程里原本常驻的 Streamlit、重排序模型、Docling 模型、截图缓存不算在内
+    - check(window) 在每个解析窗口结束后调用：超过上限先 gc，仍超出则把窗口减半，
+      窗口已经是 1 页还超出就抛 MemoryError，放弃该文件而不是拖垮整个进程
+    注意：RSS 是整个进程的值，同一进程里并行处理多个文件时，其他文件的增长也会计入。
+    """
+
+    def __init__(self, limit_mb=0, interval=0.5):
+        self.limit_mb = limit_mb
+        self.interval = interval
+        self.start_mb = 0.0
+        self.peak_mb = 0.0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        self.start_mb = self.peak_mb = current_rss_mb()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self._observe()
+        return False
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self._observe()
+
+    @property
+    def peak_growth_mb(self):
+        return max(self.peak_mb - self.start_mb, 0.0)
+
+    def _observe(self):
+        rss = current_rss_mb()
+        if rss > self.peak_mb:
+            self.peak_mb = rss
+        return rss
+
+    def growth_mb(self, external_mb=0.0):
+        """开始处理本文件以来的内存增长；external_mb 为解析子进程里当前窗口占用的内存 (本进程 RSS 里看不到)"""
+        return max(self._observe() - self.start_mb, 0.0) + external_mb
+
+    def check(self, window, external_mb=0.0):
+        """返回下一个窗口应使用的页数"""
+        if not self.limit_mb or self.growth_mb(external_mb) <= self.limit_mb:
+            return window
+        gc.collect()
+        growth = self.growth_mb(external_mb)
+        if growth <= self.limit_mb:
+            return window
+        if window > 1:
+            print(f"⚠️ 内存增长 {growth:.0f} MB 超过上限 {self.limit_mb} MB，解析窗口缩小到 {window // 2} 页")
+            return window // 2
+        raise MemoryError(f"内存增长 {growth:.0f} MB 超过上限 {self.limit_mb} MB")
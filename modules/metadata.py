@@ -1,49 +1,410 @@
 # --- START OF FILE metadata.py ---
 
+import re
 import json
+import time
+import queue
+import threading
+from collections import deque
+from xml.sax.saxutils import quoteattr
+from concurrent.futures import ThreadPoolExecutor
+
 from llama_index.core import Settings
 
-def extract_metadata_from_text(text_content, filename):
-    """
-    使用 LLM 提取文档元数据
-    """
-    # 截取前 3000 字
-    context = text_content[:3000]
-    
-    prompt = f"""
-    你是一个专业的文档分析助手。请分析以下文档片段（来自文件：{filename}）：
-    
-    ---文档开始---
-    {context}
-    ---文档结束---
-    
-    请提取以下信息，并严格以 JSON 格式输出，不要包含 Markdown 标记：
+from modules.telemetry import register_collector, span
+from config import (
+    METADATA_MAX_WORKERS, METADATA_BATCH_DOCS, METADATA_BATCH_CHARS, METADATA_SMALL_DOC_CHARS,
+    METADATA_DOC_CHARS, METADATA_MAX_RETRIES, METADATA_LINGER_MS, METADATA_TIMEOUT,
+)
+
+FALLBACK_METADATA = {
+    "doc_type": "General",
+    "summary": "元数据提取失败",
+    "keywords": [],
+    "doc_date": None,
+}
+
+_DATE_RE = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+
+# Gemini 结构化输出的 response schema：模型只会返回符合该结构的 JSON (字段内容仍由 validate_metadata 校验)
+RESPONSE_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "documents": {
+            "type": "ARRAY",
+            "items": {
+                "type": "OBJECT",
+                "properties": {
+                    "id": {"type": "STRING"},
+                    "doc_type": {"type": "STRING"},
+                    "summary": {"type": "STRING"},
+                    "keywords": {"type": "ARRAY", "items": {"type": "STRING"}},
+                    "doc_date": {"type": "STRING", "nullable": True},
+                },
+                "required": ["id", "doc_type", "summary", "keywords", "doc_date"],
+            },
+        },
+    },
+    "required": ["documents"],
+}
+
+# 传给 GoogleGenAI.complete 的生成参数 (合并进 GenerateContentConfig)
+GENERATION_CONFIG = {"response_mime_type": "application/json", "response_schema": RESPONSE_SCHEMA}
+
+
+def _percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * pct / 100.0
+    lo = int(k)
+    hi = min(lo + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+
+def validate_metadata(data):
+    """按 schema 校验并规整一条元数据，不合格抛 ValueError"""
+    if not isinstance(data, dict):
+        raise ValueError("不是 JSON 对象")
+    doc_type = data.get("doc_type")
+    summary = data.get("summary")
+    if not isinstance(doc_type, str) or not doc_type.strip():
+        raise ValueError("doc_type 缺失")
+    if not isinstance(summary, str) or not summary.strip():
+        raise ValueError("summary 缺失")
+
+    keywords = data.get("keywords") or []
+    if isinstance(keywords, str):
+        keywords = [k for k in re.split(r"[,，、;；]", keywords)]
+    if not isinstance(keywords, list):
+        raise ValueError("keywords 不是列表")
+    keywords = [str(k).strip() for k in keywords if str(k).strip()][:5]
+
+    # 日期格式不对不算失败 (文档里本来就可能没有日期)，只是丢弃
+    doc_date = data.get("doc_date")
+    if not (isinstance(doc_date, str) and _DATE_RE.match(doc_date.strip())):
+        doc_date = None
+
+    return {
+        "doc_type": doc_type.strip()[:20],
+        "summary": summary.strip()[:100],
+        "keywords": keywords,
+        "doc_date": doc_date.strip() if doc_date else None,
+    }
+
+
+def parse_json_response(text):
+    """从模型输出里取出 JSON (容忍 ```json 代码块和前后多余文字)"""
+    text = text.replace("```json", "").replace("```", "").strip()
+    starts = [i for i in (text.find("{"), text.find("[")) if i >= 0]
+    if not starts:
+        raise ValueError("输出中没有 JSON")
+    start = min(starts)
+    end = max(text.rfind("}"), text.rfind("]"))
+    return json.loads(text[start:end + 1])
+
+
+def build_prompt(docs):
+    """docs: [(id, filename, text), ...]，一次请求里可以有多个文档；文件名按 XML 属性转义，引号、尖括号不会破坏 <doc> 标记"""
+    blocks = "\n".join(
+        f'<doc id={quoteattr(doc_id)} filename={quoteattr(filename)}>\n{text}\n</doc>' for doc_id, filename, text in docs
+    )
+    return f"""
+    你是一个专业的文档分析助手。下面有 {len(docs)} 个文档片段，每个用 <doc id="..."> 标出。
+
+    {blocks}
+
+    请对每个文档分别提取以下信息，以 JSON 格式输出：
     1. "doc_type": 文档类型 (如: 合同, 技术手册, 财报, 其他)
     2. "summary": 50字以内的简短摘要
     3. "keywords": [关键实体1, 关键实体2] (最多5个)
-    4. "doc_date": 文档中提到的主要日期 (YYYY-MM-DD)
-    
-    输出示例:
+    4. "doc_date": 文档中提到的主要日期 (YYYY-MM-DD)，没有则为 null
+
+    输出格式 (documents 里每个文档一项，id 与输入一致):
     {{
-        "doc_type": "合同",
-        "summary": "关于采购协议",
-        "keywords": ["服务器", "采购"],
-        "doc_date": "2025-01-01"
+        "documents": [
+            {{"id": "d1", "doc_type": "合同", "summary": "关于采购协议", "keywords": ["服务器", "采购"], "doc_date": "2025-01-01"}}
+        ]
     }}
     """
-    
-    try:
-        # 回归最简单的调用方式
-        response = Settings.llm.complete(prompt)
-        
-        json_str = response.text.replace("```json", "").replace("```", "").strip()
-        metadata = json.loads(json_str)
-        return metadata
-    except Exception as e:
-        print(f"⚠️ 元数据提取失败: {e}")
+
+
+def _token_usage(response, prompt):
+    """(输入 token, 输出 token, 是否为估算)。拿不到模型返回的用量时按字数估算"""
+    raw = getattr(response, "raw", None) or {}
+    usage = raw.get("usage_metadata") if isinstance(raw, dict) else getattr(raw, "usage_metadata", None)
+    if usage is not None:
+        get = usage.get if isinstance(usage, dict) else (lambda k, d=None: getattr(usage, k, d))
+        prompt_tokens = get("prompt_token_count")
+        completion_tokens = get("candidates_token_count")
+        if prompt_tokens is not None:
+            return prompt_tokens, completion_tokens or 0, False
+    return len(prompt) // 3, len(response.text) // 3, True
+
+
+class _Job:
+    def __init__(self, filename, text, content_hash):
+        self.filename = filename
+        self.text = text
+        self.content_hash = content_hash
+        self.result = None
+        self.done = threading.Event()
+
+
+class MetadataService:
+    """
+    元数据提取服务：
+    1. 按内容哈希缓存 (SQLite)，同样的内容只提取一次
+    2. 各线程提交的请求先攒一小会儿，小文档打包进同一次结构化输出请求 (Gemini response schema)
+    3. 最多 max_workers 个 LLM 请求并发
+    4. 逐条按 schema 校验，只有不合格/缺失的文档单独重试；最终失败才回退到默认元数据 (不缓存)
+    5. 记录每次调用的耗时和 token 用量
+    6. 调用方最多等 timeout 秒，超时回退到默认元数据 (同样不缓存)
+    """
+
+    def __init__(self, max_workers=4, batch_docs=8, batch_chars=8000, small_doc_chars=1500,
+                 doc_chars=3000, max_retries=1, linger_ms=200, timeout=300.0):
+        self.batch_docs = batch_docs
+        self.batch_chars = batch_chars
+        self.small_doc_chars = small_doc_chars
+        self.doc_chars = doc_chars
+        self.max_retries = max_retries
+        self.linger = linger_ms / 1000.0
+        self.timeout = timeout
+
+        self._queue = queue.Queue()
+        self._slots = threading.Semaphore(max_workers)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="metadata")
+        self._dispatcher = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._calls = deque(maxlen=1000)
+        self.cache_hits = 0
+        self.retries = 0
+        self.failures = 0
+
+    # --- 对外接口 ---
+
+    def extract(self, text, filename, content_hash=None):
+        return self.extract_many([(text, filename, content_hash)])[0]
+
+    def extract_many(self, items):
+        """items: [(正文预览, 文件名, 内容哈希或 None), ...]，返回同序的元数据列表"""
+        from modules.database import get_cached_metadata
+
+        cached = get_cached_metadata([h for _, _, h in items if h])
+        results = [None] * len(items)
+        jobs = []
+        for i, (text, filename, content_hash) in enumerate(items):
+            if content_hash and content_hash in cached:
+                results[i] = cached[content_hash]
+                with self._stats_lock:
+                    self.cache_hits += 1
+            else:
+                job = _Job(filename, text[:self.doc_chars], content_hash)
+                jobs.append((i, job))
+
+        if jobs:
+            self._ensure_dispatcher()
+            for _, job in jobs:
+                self._queue.put(job)
+            deadline = time.monotonic() + self.timeout
+            for i, job in jobs:
+                if job.done.wait(max(deadline - time.monotonic(), 0)):
+                    results[i] = job.result
+                    continue
+                print(f"⚠️ 元数据提取超时 ({self.timeout:.0f}s)，使用默认元数据: {job.filename}")
+                with self._stats_lock:
+                    self.failures += 1
+                results[i] = dict(FALLBACK_METADATA)
+        return results
+
+    def stats(self):
+        with self._stats_lock:
+            calls = list(self._calls)
+            hits, retries, failures = self.cache_hits, self.retries, self.failures
+        latencies = [c["seconds"] * 1000 for c in calls]
         return {
-            "doc_type": "General",
-            "summary": "元数据提取失败",
-            "keywords": [],
-            "doc_date": None
-        }
\ No newline at end of file
+            "calls": len(calls),
+            "documents": sum(c["docs"] for c in calls),
+            "p50_ms": _percentile(latencies, 50),
+            "p95_ms": _percentile(latencies, 95),
+            "prompt_tokens": sum(c["prompt_tokens"] for c in calls),
+            "completion_tokens": sum(c["completion_tokens"] for c in calls),
+            "cache_hits": hits,
+            "retries": retries,
+            "failures": failures,
+        }
+
+    # --- 调度 ---
+
+    def _ensure_dispatcher(self):
+        if self._dispatcher is None:
+            with self._start_lock:
+                if self._dispatcher is None:
+                    self._dispatcher = threading.Thread(target=self._dispatch_loop, daemon=True, name="metadata-dispatcher")
+                    self._dispatcher.start()
+
+    def _dispatch_loop(self):
+        while True:
+            pending = [self._queue.get()]
+            deadline = time.monotonic() + self.linger
+            while True:
+                try:
+                    pending.append(self._queue.get(timeout=max(deadline - time.monotonic(), 0)))
+                except queue.Empty:
+                    break
+            try:
+                self._dispatch(pending)
+            except Exception as e:
+                # 调度线程不能退出：这一轮没交出去的文档直接回退，后面的请求照常处理
+                print(f"⚠️ 元数据调度失败: {e}")
+                self._fallback(pending)
+
+    def _dispatch(self, jobs):
+        for group in self._pack(jobs):
+            self._slots.acquire()
+            try:
+                self._executor.submit(self._run_group, group)
+            except Exception:
+                self._slots.release()
+                raise
+
+    def _pack(self, jobs):
+        """大文档单独一组；小文档按篇数和总字数打包"""
+        groups, current, chars = [], [], 0
+        for job in jobs:
+            size = len(job.text)
+            if size > self.small_doc_chars:
+                groups.append([job])
+                continue
+            if current and (len(current) >= self.batch_docs or chars + size > self.batch_chars):
+                groups.append(current)
+                current, chars = [], 0
+            current.append(job)
+            chars += size
+        if current:
+            groups.append(current)
+        return groups
+
+    def _run_group(self, group):
+        try:
+            failed = self._request(group)
+            for attempt in range(self.max_retries):
+                if not failed:
+                    break
+                with self._stats_lock:
+                    self.retries += len(failed)
+                # 只重试失败的文档，而且逐个请求，避免再被同组的其他文档拖累
+                retry = []
+                for job in failed:
+                    retry.extend(self._request([job]))
+                failed = retry
+            for job in failed:
+                print(f"⚠️ 元数据提取失败: {job.filename}")
+            self._fallback(failed)
+        except Exception as e:
+            print(f"⚠️ 元数据提取失败: {e}")
+            self._fallback(group)
+        finally:
+            self._slots.release()
+
+    def _fallback(self, jobs):
+        """还没完成的文档用默认元数据结束 (不缓存)"""
+        for job in jobs:
+            if not job.done.is_set():
+                with self._stats_lock:
+                    self.failures += 1
+                self._finish(job, dict(FALLBACK_METADATA), cache=False)
+
+    def _request(self, group):
+        """发一次请求，完成校验通过的文档，返回需要重试的文档"""
+        ids = {f"d{i + 1}": job for i, job in enumerate(group)}
+        prompt = build_prompt([(doc_id, job.filename, job.text) for doc_id, job in ids.items()])
+        t0 = time.time()
+        try:
+            with span("metadata.llm"):
+                # 结构化输出：JSON mime 类型 + response schema，不再靠提示词约束格式
+                response = Settings.llm.complete(prompt, generation_config=GENERATION_CONFIG)
+        except Exception as e:
+            print(f"⚠️ 元数据请求失败 ({len(group)} 个文档): {e}")
+            return group
+        self._record(len(group), time.time() - t0, response, prompt)
+
+        try:
+            data = parse_json_response(response.text)
+        except ValueError as e:
+            print(f"⚠️ 元数据输出不是合法 JSON ({len(group)} 个文档): {e}")
+            return group
+        if isinstance(data, dict) and "documents" in data:
+            items = data["documents"]
+        elif isinstance(data, list):
+            items = data
+        else:
+            items = [dict(data, id="d1")] if len(group) == 1 else []
+
+        failed = dict(ids)
+        for item in items if isinstance(items, list) else []:
+            job = failed.get(str(item.get("id"))) if isinstance(item, dict) else None
+            if job is None:
+                continue
+            try:
+                meta = validate_metadata(item)
+            except ValueError as e:
+                print(f"⚠️ 元数据校验失败 ({job.filename}): {e}")
+                continue
+            self._finish(job, meta)
+            del failed[str(item.get("id"))]
+        return list(failed.values())
+
+    def _finish(self, job, meta, cache=True):
+        if cache and job.content_hash:
+            from modules.database import put_cached_metadata
+            try:
+                put_cached_metadata([(job.content_hash, meta)])
+            except Exception as e:
+                print(f"⚠️ 元数据缓存写入失败: {e}")
+        job.result = meta
+        job.done.set()
+
+    def _record(self, docs, seconds, response, prompt):
+        prompt_tokens, completion_tokens, estimated = _token_usage(response, prompt)
+        with self._stats_lock:
+            self._calls.append({
+                "docs": docs,
+                "seconds": seconds,
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+            })
+        note = " (估算)" if estimated else ""
+        print(f"🏷️ 元数据请求 {docs} 个文档 {seconds:.2f}s | tokens 输入 {prompt_tokens} / 输出 {completion_tokens}{note}")
+
+
+_service = None
+_service_lock = threading.Lock()
+
+def get_metadata_service():
+    """进程内单例"""
+    global _service
+    if _service is None:
+        with _service_lock:
+            if _service is None:
+                _service = MetadataService(
+                    max_workers=METADATA_MAX_WORKERS,
+                    batch_docs=METADATA_BATCH_DOCS,
+                    batch_chars=METADATA_BATCH_CHARS,
+                    small_doc_chars=METADATA_SMALL_DOC_CHARS,
+                    doc_chars=METADATA_DOC_CHARS,
+                    max_retries=METADATA_MAX_RETRIES,
+                    linger_ms=METADATA_LINGER_MS,
+                    timeout=METADATA_TIMEOUT,
+                )
+                register_collector("metadata", _service.stats)
+    return _service
+
+
+def extract_metadata_from_text(text_content, filename, content_hash=None):
+    """
+    使用 LLM 提取文档元数据 (经由 MetadataService：缓存 / 打包 / 并发 / 校验重试)
+    """
+    return get_metadata_service().extract(text_content, filename, content_hash)
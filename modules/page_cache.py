@@ -0,0 +1,278 @@
+# --- START OF FILE page_cache.py ---
+
+import io
+import os
+import shutil
+import threading
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from modules.telemetry import register_collector
+from config import (
+    PAGE_CACHE_DIR, PAGE_CACHE_MEMORY_MB, PAGE_IMAGE_DPI, PAGE_IMAGE_FORMAT,
+    PAGE_IMAGE_QUALITY, PAGE_IMAGE_TARGET_KB, PAGE_RENDER_PROCESSES,
+)
+
+MIME_TYPES = {"png": "image/png", "jpeg": "image/jpeg", "webp": "image/webp"}
+
+# 进程内所有 PyMuPDF 调用共用 (查询时的并行截图、入库时的预渲染)
+fitz_lock = threading.Lock()
+
+
+def rasterize_page(file_path, page_idx, dpi):
+    """光栅化一页，返回 (mode, 宽, 高, 像素字节)；页码越界返回 None。PyMuPDF 不是线程安全的，进程内调用要持有 fitz_lock"""
+    import fitz
+
+    with fitz.open(file_path) as doc:
+        if not 0 <= page_idx < len(doc):
+            return None
+        pix = doc[page_idx].get_pixmap(dpi=dpi)
+        return ("RGBA" if pix.alpha else "RGB", pix.width, pix.height, pix.samples)
+
+
+def encode_page(raw, fmt, quality=80, target_kb=0):
+    """PIL 编码 (编码时释放 GIL)：PNG 无损；JPEG/WebP 设置了目标大小时逐步降低质量直到不超过目标"""
+    from PIL import Image
+
+    mode, width, height, samples = raw
+    img = Image.frombytes(mode, [width, height], samples)
+    if fmt == "png":
+        buf = io.BytesIO()
+        img.save(buf, format="PNG")
+        return buf.getvalue()
+    img = img.convert("RGB")
+    while True:
+        buf = io.BytesIO()
+        img.save(buf, format=fmt.upper(), quality=quality)
+        data = buf.getvalue()
+        if not target_kb or len(data) <= target_kb * 1024 or quality <= 30:
+            return data
+        quality -= 10
+
+
+def render_page(file_path, page_idx, dpi, fmt, quality=80, target_kb=0):
+    """在渲染子进程里执行：每个子进程各自的 PyMuPDF，不需要 fitz_lock，只回传编码后的图片"""
+    raw = rasterize_page(file_path, page_idx, dpi)
+    return None if raw is None else encode_page(raw, fmt, quality, target_kb)
+
+
+class PageImageCache:
+    """
+    PDF 页面截图缓存：键为 (文件哈希, 页码, dpi, 格式)。
+    内存里是按字节预算淘汰的 LRU，背后是磁盘目录 (page_cache/<文件哈希>/...)，进程重启后仍可命中。
+    """
+
+    def __init__(self, cache_dir, memory_budget_bytes, fmt="png", quality=80, target_kb=0, processes=0):
+        self.cache_dir = cache_dir
+        self.memory_budget_bytes = memory_budget_bytes
+        self.fmt = fmt
+        self.quality = quality
+        self.target_kb = target_kb
+        self.processes = processes
+        self._pool = None
+        self._pool_lock = threading.Lock()
+
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+        self._hash_memo = {}  # {path: (mtime, size, hash)}，避免每次查询都重新计算文件哈希
+        self._inflight = {}  # {key: Event}，同一页正在渲染时其他线程等它完成，不重复渲染
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.renders = 0
+
+    # --- 对外接口 ---
+
+    def get_page_image(self, file_path, page_idx, dpi=PAGE_IMAGE_DPI, fmt=None, file_hash=None):
+        """返回页面图片字节；页码越界返回 None"""
+        fmt = fmt or self.fmt
+        file_hash = file_hash or self._file_hash(file_path)
+        key = (file_hash, page_idx, dpi, fmt)
+
+        data = self._memory_get(key)
+        if data is not None:
+            self.memory_hits += 1
+            return data
+
+        disk_path = self._disk_path(key)
+        if os.path.exists(disk_path):
+            with open(disk_path, "rb") as f:
+                data = f.read()
+            self.disk_hits += 1
+            self._memory_put(key, data)
+            return data
+
+        with self._lock:
+            event = self._inflight.get(key)
+            owner = event is None
+            if owner:
+                event = self._inflight[key] = threading.Event()
+        if not owner:
+            # 预取线程正在渲染这一页：等它写入缓存后直接取
+            event.wait()
+            data = self._memory_get(key)
+            if data is not None:
+                self.memory_hits += 1
+                return data
+            return self._render_and_store(key, file_path, disk_path)
+
+        try:
+            return self._render_and_store(key, file_path, disk_path)
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            event.set()
+
+    def prerender(self, file_path, file_hash, max_pages, dpi=PAGE_IMAGE_DPI, fmt=None):
+        """入库时预先渲染前 max_pages 页 (-1 表示全部) 写入磁盘缓存"""
+        import fitz
+
+        fmt = fmt or self.fmt
+        with fitz_lock, fitz.open(file_path) as doc:
+            page_total = len(doc)
+        count = page_total if max_pages < 0 else min(max_pages, page_total)
+        rendered = 0
+        for p_idx in range(count):
+            disk_path = self._disk_path((file_hash, p_idx, dpi, fmt))
+            if os.path.exists(disk_path):
+                continue
+            data = self._render(file_path, p_idx, dpi, fmt)
+            if data is not None:
+                self._disk_put(disk_path, data)
+                rendered += 1
+        print(f"🖼️ 预渲染 {os.path.basename(file_path)}：{rendered}/{count} 页")
+        return rendered
+
+    def invalidate(self, file_hash):
+        """删除某个文件的全部缓存页 (内存 + 磁盘)"""
+        if not file_hash:
+            return
+        with self._lock:
+            for key in [k for k in self._memory if k[0] == file_hash]:
+                self._memory_bytes -= len(self._memory.pop(key))
+            self._hash_memo = {p: v for p, v in self._hash_memo.items() if v[2] != file_hash}
+        shutil.rmtree(os.path.join(self.cache_dir, file_hash), ignore_errors=True)
+
+    def stats(self):
+        lookups = self.memory_hits + self.disk_hits + self.renders
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "renders": self.renders,
+            "hit_rate": (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+            "memory_bytes": self._memory_bytes,
+            "memory_entries": len(self._memory),
+        }
+
+    # --- 内部实现 ---
+
+    def _file_hash(self, file_path):
+        from modules.ingestion import file_hash
+
+        st = os.stat(file_path)
+        memo = self._hash_memo.get(file_path)
+        if memo and memo[0] == st.st_mtime_ns and memo[1] == st.st_size:
+            return memo[2]
+        digest = file_hash(file_path)
+        self._hash_memo[file_path] = (st.st_mtime_ns, st.st_size, digest)
+        return digest
+
+    def _disk_path(self, key):
+        file_hash, page_idx, dpi, fmt = key
+        return os.path.join(self.cache_dir, file_hash, f"p{page_idx}_{dpi}.{fmt}")
+
+    def _disk_put(self, disk_path, data):
+        os.makedirs(os.path.dirname(disk_path), exist_ok=True)
+        tmp_path = f"{disk_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, disk_path)  # 原子替换，并发进程不会读到半截文件
+
+    def _memory_get(self, key):
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+            return data
+
+    def _memory_put(self, key, data):
+        if len(data) > self.memory_budget_bytes:
+            return
+        with self._lock:
+            if key in self._memory:
+                self._memory_bytes -= len(self._memory.pop(key))
+            self._memory[key] = data
+            self._memory_bytes += len(data)
+            while self._memory_bytes > self.memory_budget_bytes:
+                _, old = self._memory.popitem(last=False)
+                self._memory_bytes -= len(old)
+
+    def _render_and_store(self, key, file_path, disk_path):
+        _, page_idx, dpi, fmt = key
+        data = self._render(file_path, page_idx, dpi, fmt)
+        if data is None:
+            return None
+        self.renders += 1
+        self._disk_put(disk_path, data)
+        self._memory_put(key, data)
+        return data
+
+    def _render(self, file_path, page_idx, dpi, fmt):
+        if self.processes > 0:
+            # 渲染子进程并行光栅化 + 编码，查询线程池里同时提交的多页不再排队
+            pool = self._get_pool()
+            try:
+                return pool.submit(render_page, file_path, page_idx, dpi, fmt, self.quality, self.target_kb).result()
+            except BrokenProcessPool:
+                # 子进程被杀：丢掉这个池 (下次重建)，这一页退回进程内渲染
+                self._discard_pool(pool)
+                print("⚠️ 渲染进程池异常，改为进程内渲染")
+
+        # 进程内：PyMuPDF 不支持多线程同时调用，只有光栅化持锁，编码 (PIL，释放 GIL) 放在锁外
+        with fitz_lock:
+            raw = rasterize_page(file_path, page_idx, dpi)
+        return None if raw is None else encode_page(raw, fmt, self.quality, self.target_kb)
+
+    def _get_pool(self):
+        with self._pool_lock:
+            if self._pool is None:
+                # spawn：当前进程里已经有线程和模型客户端，fork 容易死锁
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.processes, mp_context=multiprocessing.get_context("spawn"),
+                )
+            return self._pool
+
+    def _discard_pool(self, pool):
+        with self._pool_lock:
+            if self._pool is pool:
+                self._pool = None
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def shutdown(self):
+        with self._pool_lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=True)
+
+
+_page_cache = None
+_page_cache_lock = threading.Lock()
+
+def get_page_cache():
+    """进程内单例"""
+    global _page_cache
+    if _page_cache is None:
+        with _page_cache_lock:
+            if _page_cache is None:
+                _page_cache = PageImageCache(
+                    PAGE_CACHE_DIR,
+                    PAGE_CACHE_MEMORY_MB * 1024 * 1024,
+                    fmt=PAGE_IMAGE_FORMAT,
+                    quality=PAGE_IMAGE_QUALITY,
+                    target_kb=PAGE_IMAGE_TARGET_KB,
+                    processes=PAGE_RENDER_PROCESSES,
+                )
+                register_collector("page_cache", _page_cache.stats)
+    return _page_cache
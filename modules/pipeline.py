@@ -0,0 +1,207 @@
+# --- START OF FILE pipeline.py ---
+"""
+入库流水线的阶段调度 (同一进程里的所有入库 worker 共用)：
+
+- parse:    Docling 解析 + 分块在进程池里执行，每个子进程各自加载一份 Docling 模型，
+            多个 worker 领到的文件同时解析，不再在同一个 DocumentConverter 上排队
+- metadata: 元数据提取 (MetadataService 跨文件打包 LLM 请求)
+- embed:    向量化 (EmbeddingScheduler 跨文件攒批、限流)
+- upsert:   写入向量库 / BM25 索引
+
+每个文件按顺序经过各阶段，不同文件同时处于不同阶段 (一个在解析，另一个在向量化)；
+每个阶段限制同时处理的数量，超出的在阶段入口排队。各阶段的吞吐和排队深度作为运行指标导出。
+"""
+
+import time
+import threading
+import multiprocessing
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from config import INGEST_PARSE_WORKERS, INGEST_METADATA_WORKERS, INGEST_EMBED_WORKERS, INGEST_UPSERT_WORKERS
+
+STAGES = ("parse", "metadata", "embed", "upsert")
+
+
+def _init_parse_process():
+    """解析子进程启动时加载 Docling 模型和分词器；失败只打印，真正解析时会按原路径报错"""
+    try:
+        from modules.ingestion import warm_up_parser
+        warm_up_parser()
+    except Exception as e:
+        print(f"⚠️ 解析进程预热失败: {e}")
+
+
+def _noop():
+    return None
+
+
+class StageStats:
+    """单个阶段：同时处理数上限、完成 / 失败数、累计耗时、正在处理 / 排队等待的数量"""
+
+    def __init__(self, name, workers):
+        self.name = name
+        self.workers = max(1, workers)
+        self.processed = 0
+        self.failed = 0
+        self.busy_seconds = 0.0
+        self.running = 0
+        self.waiting = 0
+        self.max_waiting = 0
+        self._slots = threading.BoundedSemaphore(self.workers)
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def slot(self):
+        """占用阶段的一个处理位 (满了就排队)，退出时记一次完成或失败"""
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.waiting += 1
+                self.max_waiting = max(self.max_waiting, self.waiting)
+            self._slots.acquire()
+            with self._lock:
+                self.waiting -= 1
+        with self._lock:
+            self.running += 1
+        t0 = time.perf_counter()
+        ok = False
+        try:
+            yield
+            ok = True
+        finally:
+            seconds = time.perf_counter() - t0
+            self._slots.release()
+            with self._lock:
+                self.running -= 1
+                self.busy_seconds += seconds
+                if ok:
+                    self.processed += 1
+                else:
+                    self.failed += 1
+
+    def snapshot(self, elapsed):
+        with self._lock:
+            done = self.processed + self.failed
+            return {
+                "workers": self.workers,
+                "processed": self.processed,
+                "failed": self.failed,
+                "throughput": self.processed / elapsed if elapsed > 0 else 0.0,
+                "avg_seconds": self.busy_seconds / done if done else 0.0,
+                "running": self.running,
+                "queue_depth": self.waiting,
+                "max_queue_depth": self.max_waiting,
+            }
+
+
+class IngestPipeline:
+    """
+    parse_workers 为解析子进程数；0 表示在调用线程里解析 (同一进程内的解析串行，
+    process 模式的 worker 进程自己就是并行单位，用这种方式，不再嵌套子进程)。
+    """
+
+    def __init__(self, parse_workers=INGEST_PARSE_WORKERS, metadata_workers=INGEST_METADATA_WORKERS,
+                 embed_workers=INGEST_EMBED_WORKERS, upsert_workers=INGEST_UPSERT_WORKERS):
+        self.parse_workers = max(0, parse_workers)
+        workers = {"parse": self.parse_workers, "metadata": metadata_workers,
+                   "embed": embed_workers, "upsert": upsert_workers}
+        self.stages = {name: StageStats(name, workers[name]) for name in STAGES}
+        self._pool = None
+        self._pool_lock = threading.Lock()
+        self._started_at = time.time()
+
+    @property
+    def parses_in_subprocess(self):
+        return self.parse_workers > 0
+
+    def stage(self, name):
+        """with pipeline.stage("embed"): ... —— 在该阶段的处理位上执行"""
+        return self.stages[name].slot()
+
+    def parse(self, fn, *args):
+        """在解析进程池里执行 fn(*args) 并等待结果 (fn 和参数、返回值都要能 pickle)"""
+        with self.stage("parse"):
+            if not self.parses_in_subprocess:
+                return fn(*args)
+            pool = self._get_pool()
+            try:
+                return pool.submit(fn, *args).result()
+            except BrokenProcessPool:
+                # 子进程被杀 (如内存不足)：丢掉这个池，下一个文件重新建
+                self._discard_pool(pool)
+                raise
+
+    def warm_up(self):
+        """提前启动解析子进程并加载模型 (每个子进程启动时各自预热)"""
+        if not self.parses_in_subprocess:
+            from modules.ingestion import warm_up_parser
+            warm_up_parser()
+            return
+        pool = self._get_pool()
+        for future in [pool.submit(_noop) for _ in range(self.parse_workers)]:
+            future.result()
+
+    def _get_pool(self):
+        with self._pool_lock:
+            if self._pool is None:
+                # spawn 而不是 fork：当前进程里已经有线程和模型客户端，fork 容易死锁
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.parse_workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_parse_process,
+                )
+                print(f"🏭 解析进程池已启动: {self.parse_workers} 个进程")
+            return self._pool
+
+    def _discard_pool(self, pool):
+        with self._pool_lock:
+            if self._pool is pool:
+                self._pool = None
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def shutdown(self):
+        with self._pool_lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=True, cancel_futures=True)
+
+    def stats(self):
+        """扁平的数值字典 (导出为 gauge)：<阶段>_throughput / _queue_depth / _running / ..."""
+        elapsed = time.time() - self._started_at
+        flat = {}
+        for name, stage in self.stages.items():
+            for key, value in stage.snapshot(elapsed).items():
+                flat[f"{name}_{key}"] = value
+        return flat
+
+
+_pipeline = None
+_pipeline_lock = threading.Lock()
+
+
+def configure_pipeline(**kwargs):
+    """在第一次入库之前调用，替换默认配置 (如 process 模式的 worker 进程传 parse_workers=0)"""
+    global _pipeline
+    with _pipeline_lock:
+        if _pipeline is not None:
+            _pipeline.shutdown()
+        _pipeline = IngestPipeline(**kwargs)
+        _register(_pipeline)
+    return _pipeline
+
+
+def get_pipeline():
+    global _pipeline
+    if _pipeline is None:
+        with _pipeline_lock:
+            if _pipeline is None:
+                _pipeline = IngestPipeline()
+                _register(_pipeline)
+    return _pipeline
+
+
+def _register(pipeline):
+    from modules.telemetry import register_collector
+    register_collector("ingest_pipeline", pipeline.stats)
+
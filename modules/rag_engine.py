@@ -1,118 +1,238 @@
 import os
-import fitz  # PyMuPDF
-from llama_index.core import VectorStoreIndex, Settings
-from llama_index.vector_stores.qdrant import QdrantVectorStore
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from llama_index.core import Settings
 from llama_index.core.schema import ImageDocument
 
-# 🔴 修正导入路径：从 sbert_rerank 导入
-from llama_index.postprocessor.sbert_rerank import SentenceTransformerRerank
-
-from config import RERANK_MODEL_NAME
 from modules.ingestion import get_client, COLLECTION_NAME
-from config import RERANK_MODEL_NAME, DEVICE # 引入 DEVICE
-# 初始化 Reranker (单例模式)
+from modules.database import get_collection_generation, get_document_types
+from modules.rerank import CrossEncoderReranker
+from modules.page_cache import get_page_cache, MIME_TYPES
+from modules.answer_cache import get_answer_cache, make_scope
+from modules.sparse_index import get_sparse_index
+from modules.retrieval import HybridRetriever, rebuild_sparse_index
+from modules.telemetry import span, traced, record, trace, inc, register_collector
+from modules.context_packer import node_pages, rank_pages, pack_context
+from modules.vector_store import (
+    ensure_collection, search_params, build_qdrant_filter, normalize_filters, describe_filters,
+    filters_key, parse_query_filters,
+)
+from config import (
+    RERANK_MODEL_NAME, DEVICE, RERANK_BACKEND, RERANK_TOP_N, RERANK_BATCH_SIZE, RERANK_MAX_LENGTH,
+    RERANK_MAX_CANDIDATES, RERANK_SKIP_MARGIN, RERANK_CACHE_SIZE, ANSWER_CACHE_ENABLED,
+    HYBRID_ENABLED, DENSE_TOP_K, SPARSE_TOP_K, HYBRID_TOP_K, RRF_K, QUERY_FILTER_PARSING,
+    QUERY_WORKERS, QUERY_PREFETCH_PAGES, CONTEXT_MAX_IMAGES,
+)
+# 初始化 Reranker (单例模式)：加载失败也只尝试一次，之后按初筛顺序截断，不在每次问答时重试
 _reranker = None
+_reranker_failed = False
+_reranker_lock = threading.Lock()
 
 def get_reranker():
-    global _reranker
-    if _reranker is None:
-        try:
-            # 使用 config.py 中的 DEVICE 变量
-            _reranker = SentenceTransformerRerank(
-                model=RERANK_MODEL_NAME,
-                top_n=5,
-                device=DEVICE 
-            )
-            print(f"✅ Reranker 加载完成 (Device: {DEVICE})")
-        except Exception as e:
-            print(f"❌ Reranker 加载失败: {e}")
-            return None
+    if _reranker is None and not _reranker_failed:
+        with _reranker_lock:
+            if _reranker is None and not _reranker_failed:
+                _load_reranker()
     return _reranker
 
-def get_retriever_engine():
-    """获取查询引擎 (Vector + Rerank)"""
+def _load_reranker():
+    global _reranker, _reranker_failed
+    try:
+        # 使用 config.py 中的 DEVICE 变量；CPU 上默认 int8 量化 + 分桶批量打分
+        _reranker = CrossEncoderReranker(
+            model_name=RERANK_MODEL_NAME,
+            device=DEVICE,
+            top_n=RERANK_TOP_N,
+            batch_size=RERANK_BATCH_SIZE,
+            max_length=RERANK_MAX_LENGTH,
+            backend=RERANK_BACKEND,
+            max_candidates=RERANK_MAX_CANDIDATES,
+            skip_margin=RERANK_SKIP_MARGIN,
+            cache_size=RERANK_CACHE_SIZE,
+        )
+        print(f"✅ Reranker 加载完成 (Device: {DEVICE}, Backend: {_reranker.backend})")
+        register_collector("reranker", _reranker.stats)
+    except Exception as e:
+        print(f"❌ Reranker 加载失败: {e}")
+        _reranker_failed = True
+
+def warm_up_reranker():
+    """预热：加载 Cross-Encoder 并跑一次打分 (首次推理要初始化 torch 线程池 / 量化内核)"""
+    reranker = get_reranker()
+    if reranker is None:
+        raise RuntimeError("Reranker 加载失败，问答时按初筛顺序截断")
+    reranker.score("warm up", ["warm up"])
+
+def build_retriever_engine(filters=None):
+    """
+    构建检索器 (Vector + BM25)，集合不存在返回 None。每次调用都会重新创建，不带过滤条件时一般走 get_retriever_engine 的缓存。
+    filters: 过滤条件 dict (见 modules.vector_store)，转换成 Qdrant Filter 在向量检索内部完成
+    """
     client = get_client()
-    if not client.collection_exists(COLLECTION_NAME):
+    if not ensure_collection(client, COLLECTION_NAME):
         return None
 
+    from llama_index.core import VectorStoreIndex
+    from llama_index.vector_stores.qdrant import QdrantVectorStore
+
     vector_store = QdrantVectorStore(client=client, collection_name=COLLECTION_NAME)
+    # Settings.embedding 已套上持久化向量缓存，重复的问题不会再走网络
     index = VectorStoreIndex.from_vector_store(vector_store=vector_store, embed_model=Settings.embedding)
     
-    # 1. 初筛：先检索 20 条 (Vector Search)
-    base_retriever = index.as_retriever(similarity_top_k=20)
-    
-    return base_retriever
+    # 1. 初筛：向量检索 DENSE_TOP_K 条 (过滤条件下推到 Qdrant)
+    qdrant_filter = build_qdrant_filter(filters)
+    vector_store_kwargs = {}
+    if search_params() is not None:
+        vector_store_kwargs["search_params"] = search_params()
+    if qdrant_filter is not None:
+        vector_store_kwargs["qdrant_filters"] = qdrant_filter
+    dense_retriever = index.as_retriever(similarity_top_k=DENSE_TOP_K, vector_store_kwargs=vector_store_kwargs)
+    if not HYBRID_ENABLED:
+        return dense_retriever
+
+    # 2. 混合检索：BM25 补充精确标识符 (合同号、零件号、中文术语)，RRF 融合后减少候选数
+    sparse_index = get_sparse_index()
+    if sparse_index.count() == 0 and client.count(COLLECTION_NAME).count > 0:
+        rebuild_sparse_index(client, COLLECTION_NAME, sparse_index)
+    return HybridRetriever(
+        dense_retriever, sparse_index, client, COLLECTION_NAME,
+        sparse_top_k=SPARSE_TOP_K, top_k=HYBRID_TOP_K, rrf_k=RRF_K, qdrant_filter=qdrant_filter,
+        executor=get_query_pool(),
+    )
+
+# 查询链路共用的线程池 (页面截图、BM25 检索)，进程内所有会话共享
+_query_pool = None
+_query_pool_lock = threading.Lock()
+
+def get_query_pool():
+    global _query_pool
+    if _query_pool is None:
+        with _query_pool_lock:
+            if _query_pool is None:
+                _query_pool = ThreadPoolExecutor(max_workers=QUERY_WORKERS, thread_name_prefix="query")
+    return _query_pool
+
+# 检索器缓存：进程内所有 Streamlit 会话共享，按向量库世代号失效
+_engine_lock = threading.Lock()
+_engine_cache = {"generation": None, "retriever": None}
+
+def get_retriever_engine():
+    """获取查询引擎：只有入库/删除改变了向量库 (世代号变化) 才重建"""
+    generation = get_collection_generation()
+    if _engine_cache["generation"] == generation:
+        return _engine_cache["retriever"]
 
-def query_with_vision(query_text, pdf_path_map):
+    with _engine_lock:
+        # 双重检查：并发的会话只需要一个去重建
+        if _engine_cache["generation"] != generation:
+            retriever = build_retriever_engine()
+            _engine_cache["retriever"] = retriever
+            _engine_cache["generation"] = generation
+            print(f"🔁 检索器已重建 (世代号 {generation})")
+        return _engine_cache["retriever"]
+
+def retrieve_nodes(query_text, filters=None, on_candidates=None):
     """
-    Args:
-        query_text: 用户问题
-        pdf_path_map: dict, {filename: full_path} 用于查找图片
+    检索 + 重排序，返回 (nodes, 提示信息)；知识库为空或无结果时 nodes 为 None。
+    on_candidates(nodes)：初筛结果出来、重排序开始之前调用 (用来提前预取候选页截图)
     """
-    retriever = get_retriever_engine()
+    # 带过滤条件的检索器按次构建 (只是几个轻量对象，索引和集合都是共享的)
+    retriever = build_retriever_engine(filters) if filters else get_retriever_engine()
     if not retriever:
-        return "⚠️ 知识库为空，请先上传文档。"
+        return None, "⚠️ 知识库为空，请先上传文档。"
 
     # 1. 初步检索 (Vector Search)
-    nodes = retriever.retrieve(query_text)
+    if filters:
+        print(f"🔎 过滤检索: {describe_filters(filters)}")
+    with span("query.retrieve"):
+        nodes = retriever.retrieve(query_text)
     if not nodes:
-        return "⚠️ 未找到相关文档内容。"
+        return None, "⚠️ 筛选条件下未找到相关文档内容。" if filters else "⚠️ 未找到相关文档内容。"
+    if on_candidates is not None:
+        on_candidates(nodes)
 
     # 2. 重排序 (Rerank) - 核心升级点
     reranker = get_reranker()
     if reranker:
         print("⚖️ 正在进行重排序 (Reranking)...")
         # Rerank 可能会剔除不相关的节点，只保留 top_n
-        nodes = reranker.postprocess_nodes(nodes, query_str=query_text)
-    
-    # 3. 整理上下文 & 准备截图
-    context_str = ""
-    related_files_pages = [] # 格式: (file_name, page_idx)
-    
+        with span("query.rerank"):
+            nodes = reranker.postprocess_nodes(
+                nodes, query_str=query_text, allow_skip=not isinstance(retriever, HybridRetriever)
+            )
+    return nodes, None
+
+@traced("query.context")
+def build_context(nodes, image_docs=(), pages=()):
+    """
+    在 token 预算内组装上下文 (去重、去掉已附图页的文本、按分数截断，见 modules/context_packer.py)。
+    返回 (context_str, image_docs, pages, used_nodes, stats)，附图可能因超预算被去掉一部分。
+    """
     print(f"🎯 最终选定的 {len(nodes)} 个片段来源:")
     for n in nodes:
-        # 获取文件名 (Docling 通常会保留文件名在 metadata)
-        # 兼容性处理：如果 metadata 里没有 file_name，尝试从 node id 或其他字段推断，或者由 app 传入上下文
-        f_name = n.metadata.get('file_name', 'unknown')
-        page_label = n.metadata.get('page_label', '1')
-        
-        print(f"   - {f_name} (Page {page_label}): {n.score if n.score else 'N/A'}")
-        
-        context_str += f"--- 文档: {f_name} [第 {page_label} 页] ---\n{n.text}\n\n"
-        
-        try:
-            p_idx = int(page_label) - 1
-            related_files_pages.append((f_name, p_idx))
-        except:
-            pass
-
-    # 4. 动态截图 (VisRAG)
+        print(f"   - {n.metadata.get('file_name', 'unknown')} (Page {node_pages(n.metadata)[0]}): {n.score if n.score else 'N/A'}")
+    return pack_context(nodes, list(image_docs), list(pages))
+
+def _load_page(f_name, p_idx, pdf_path_map):
+    """在线程池里取一页截图 (走页面缓存：同一页只渲染一次，之后直接取内存/磁盘里的图片)"""
+    full_path = pdf_path_map.get(f_name)
+    # 如果找不到文件名映射，尝试去 data 目录下模糊匹配一下
+    if not full_path and os.path.exists("data"):
+        possible_path = os.path.join("data", f_name)
+        if os.path.exists(possible_path):
+            full_path = possible_path
+    if not full_path or not os.path.exists(full_path):
+        return None
+    try:
+        return get_page_cache().get_page_image(full_path, p_idx)
+    except Exception as e:
+        print(f"截图失败: {e}")
+        return None
+
+def prefetch_pages(nodes, pdf_path_map, limit=QUERY_PREFETCH_PAGES):
+    """
+    投机预取：按初筛顺序把前 limit 个候选页提交到线程池渲染，与重排序同时进行。
+    返回 {(file_name, page_idx): Future}，render_pages 直接复用；没被选中的页也留在缓存里。
+    """
+    if limit <= 0:
+        return {}
+    pages = []
+    for n in nodes:
+        pages.extend((n.metadata.get("file_name", "unknown"), p_idx) for p_idx in node_pages(n.metadata)[1])
+    pool = get_query_pool()
+    return {page: pool.submit(_load_page, page[0], page[1], pdf_path_map) for page in list(dict.fromkeys(pages))[:limit]}
+
+@traced("query.render")
+def render_pages(related_files_pages, pdf_path_map, max_images=CONTEXT_MAX_IMAGES, prefetched=None):
+    """
+    动态截图 (VisRAG)，多页并行渲染；related_files_pages 一般来自 rank_pages (按分数排好序)，
+    prefetched 为 prefetch_pages 的结果。返回 (image_docs, 实际截图的页面列表)
+    """
     image_docs = []
-    # 去重并只取前 2 张图，防止 Token 爆炸
-    unique_pages = list(set(related_files_pages))[:2] 
-    
-    for f_name, p_idx in unique_pages:
-        full_path = pdf_path_map.get(f_name)
-        # 如果找不到文件名映射，尝试去 data 目录下模糊匹配一下
-        if not full_path and os.path.exists("data"):
-            possible_path = os.path.join("data", f_name)
-            if os.path.exists(possible_path):
-                full_path = possible_path
-
-        if full_path and os.path.exists(full_path):
-            try:
-                doc = fitz.open(full_path)
-                if 0 <= p_idx < len(doc):
-                    print(f"🖼️ 正在截取: {f_name} 第 {p_idx+1} 页")
-                    pix = doc[p_idx].get_pixmap(dpi=150)
-                    img_bytes = pix.tobytes("png")
-                    image_docs.append(ImageDocument(image=img_bytes))
-                doc.close()
-            except Exception as e:
-                print(f"截图失败: {e}")
-
-    # 5. 发送给 Gemini
-    prompt = f"""
+    rendered = []
+    page_cache = get_page_cache()
+    prefetched = prefetched or {}
+    # 去重 (保持给定顺序) 并只取前 max_images 张图
+    unique_pages = list(dict.fromkeys(related_files_pages))[:max_images]
+
+    pool = get_query_pool()
+    futures = [prefetched.get(page) or pool.submit(_load_page, page[0], page[1], pdf_path_map) for page in unique_pages]
+    used = sum(page in prefetched for page in unique_pages)
+    if prefetched:
+        inc("rag_page_prefetch_total", used, "预取的候选页 (used: 被最终选中 / wasted: 未选中)", result="used")
+        inc("rag_page_prefetch_total", len(prefetched) - used, result="wasted")
+
+    for (f_name, p_idx), future in zip(unique_pages, futures):
+        img_bytes = future.result()
+        if img_bytes is not None:
+            print(f"🖼️ 正在截取: {f_name} 第 {p_idx+1} 页")
+            image_docs.append(ImageDocument(image=img_bytes, image_mimetype=MIME_TYPES[page_cache.fmt]))
+            rendered.append((f_name, p_idx))
+    return image_docs, rendered
+
+def build_prompt(query_text, context_str):
+    return f"""
     请根据【上下文文本】和【附图】(文档原始页面)回答用户问题。
     如果图片中有表格或图表，请优先参考图片内容。
     
@@ -121,8 +241,136 @@ def query_with_vision(query_text, pdf_path_map):
     上下文文本:
     {context_str}
     """
-    
+
+def resolve_filters(query_text, filters, doc_names):
+    """前端选择的过滤条件优先；没有时尝试从问题里识别。返回 (filters, 是否为自动识别)"""
+    filters = normalize_filters(filters)
+    if filters or not QUERY_FILTER_PARSING:
+        return filters, False
+    parsed = parse_query_filters(query_text, get_document_types(), doc_names)
+    return parsed, parsed is not None
+
+def stream_query_with_vision(query_text, pdf_path_map, filters=None):
+    """
+    filters: 检索过滤条件 dict (前端选择)，如 {"doc_types": ["合同"], "date_from": "2024-01-01"}；
+             为空时从问题里识别文件名 / 文档类型 / 年月
+    流式问答生成器，依次产出事件 (dict)：
+      {"type": "sources", "sources": [...], "pages": [...]}  检索完成，先把来源给前端
+      {"type": "token", "text": "..."}                        答案增量
+      {"type": "done", "answer": "...", "ttft": 秒, "total": 秒}
+    各阶段耗时记入运行指标，整次问答记为一条链路。
+    """
+    with trace("query", query_text[:100]) as t:
+        for event in _stream_query(query_text, pdf_path_map, filters):
+            if event["type"] == "done":
+                cached = "yes" if event.get("cached") else "no"
+                t.attrs.update(cached=cached, ttft_ms=event["ttft"] * 1000)
+                inc("rag_queries_total", 1, "问答次数 (按是否命中答案缓存)", cached=cached)
+            yield event
+
+def _stream_query(query_text, pdf_path_map, filters):
+    t0 = time.time()
+    filters, parsed = resolve_filters(query_text, filters, pdf_path_map.keys())
+
+    # 0. 先查答案缓存：精确命中不调用任何模型；语义命中只多一次 (通常已缓存的) 问题向量计算
+    cache = get_answer_cache() if ANSWER_CACHE_ENABLED else None
+    scope = query_embedding = generation = None
+    if cache:
+        with span("query.cache_lookup"):
+            generation = get_collection_generation()
+            scope = make_scope(generation, pdf_path_map.keys(), filters_key(filters),
+                               filenames=(filters or {}).get("filenames"))
+            entry = cache.lookup_exact(query_text, scope)
+            if entry is None:
+                query_embedding = Settings.embedding.get_query_embedding(query_text)
+                entry, similarity = cache.lookup_semantic(query_embedding, scope)
+                if entry is not None:
+                    print(f"💾 答案缓存语义命中 (相似度 {similarity:.3f}): {entry['query']}")
+            else:
+                print("💾 答案缓存精确命中")
+        if entry is not None:
+            yield from _replay_cached(entry, t0)
+            return
+
+    # 初筛结果一出来就开始预取候选页截图，和重排序并行
+    prefetched = {}
+
+    def start_prefetch(candidates):
+        prefetched.update(prefetch_pages(candidates, pdf_path_map))
+
+    nodes, notice = retrieve_nodes(query_text, filters, on_candidates=start_prefetch)
+    if nodes is None and parsed:
+        # 自动识别的条件可能识别错了，放开过滤再检索一次
+        print("🔎 自动识别的过滤条件下无结果，改为不过滤检索")
+        nodes, notice = retrieve_nodes(query_text, on_candidates=start_prefetch)
+        if cache:
+            # 答案来自不过滤的检索结果，按不过滤的范围缓存，不能记在自动识别的条件下
+            scope = make_scope(generation, pdf_path_map.keys(), filters_key(None))
+    if nodes is None:
+        yield {"type": "token", "text": notice}
+        yield {"type": "done", "answer": notice, "ttft": time.time() - t0, "total": time.time() - t0}
+        return
+
+    image_docs, pages = render_pages(rank_pages(nodes), pdf_path_map, prefetched=prefetched)
+    context_str, image_docs, pages, used_nodes, _ = build_context(nodes, image_docs, pages)
+    sources = [
+        {
+            "filename": n.metadata.get("file_name", "unknown"),
+            "page": node_pages(n.metadata)[0],
+            "score": n.score,
+        }
+        for n in used_nodes
+    ]
+    pages = [(f_name, p_idx + 1) for f_name, p_idx in pages]
+    yield {"type": "sources", "sources": sources, "pages": pages}
+
+    # 5. 发送给 Gemini (流式)
     print("🤖 正在请求 Gemini...")
-    response = Settings.llm.complete(prompt, image_documents=image_docs)
-    
-    return response.text
\ No newline at end of file
+    prompt = build_prompt(query_text, context_str)
+    answer = ""
+    ttft = None
+    llm_t0 = time.time()
+    for chunk in Settings.llm.stream_complete(prompt, image_documents=image_docs):
+        delta = chunk.delta or ""
+        if not delta:
+            continue
+        if ttft is None:
+            ttft = time.time() - t0
+            # 模型本身的首字延迟 (不含检索)，流式输出不方便用 span 包
+            record("query.llm_first_token", time.time() - llm_t0)
+            print(f"⏱️ 首字延迟 (TTFT): {ttft:.2f}s")
+        answer += delta
+        yield {"type": "token", "text": delta}
+    record("query.llm", time.time() - llm_t0)
+
+    total = time.time() - t0
+    print(f"⏱️ 问答完成: TTFT {ttft if ttft is not None else total:.2f}s，总耗时 {total:.2f}s，{len(answer)} 字")
+
+    if cache and answer:
+        if query_embedding is None:
+            query_embedding = Settings.embedding.get_query_embedding(query_text)
+        cache.put(query_text, query_embedding, scope, answer, sources=sources, pages=pages)
+    yield {"type": "done", "answer": answer, "ttft": ttft if ttft is not None else total, "total": total}
+
+def _replay_cached(entry, t0):
+    """把缓存的答案按流式事件格式一次性回放"""
+    yield {"type": "sources", "sources": entry["sources"], "pages": entry["pages"], "cached": True}
+    elapsed = time.time() - t0
+    yield {"type": "token", "text": entry["answer"]}
+    print(f"⏱️ 缓存命中，耗时 {elapsed * 1000:.1f} ms | {get_answer_cache().stats()}")
+    yield {"type": "done", "answer": entry["answer"], "ttft": elapsed, "total": elapsed, "cached": True}
+
+def query_with_vision(query_text, pdf_path_map, filters=None):
+    """
+    Args:
+        query_text: 用户问题
+        pdf_path_map: dict, {filename: full_path} 用于查找图片
+        filters: 检索过滤条件 dict，可选
+    Returns:
+        完整答案文本 (非流式调用方使用；内部同样走流式接口)
+    """
+    answer = ""
+    for event in stream_query_with_vision(query_text, pdf_path_map, filters):
+        if event["type"] == "done":
+            answer = event["answer"]
+    return answer
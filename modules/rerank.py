@@ -0,0 +1,182 @@
+# --- START OF FILE rerank.py ---
+
+import time
+import threading
+from collections import OrderedDict, deque
+
+from llama_index.core.schema import NodeWithScore, MetadataMode
+
+
+def _percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * pct / 100.0
+    lo = int(k)
+    hi = min(lo + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+
+class CrossEncoderReranker:
+    """
+    面向 CPU 优化的 Cross-Encoder 重排序：
+    1. int8 动态量化 (或 ONNX Runtime 后端)
+    2. 候选按 token 长度分桶后成批打分，减少 padding；超长文本截断
+    3. 自适应预算：只重排向量分最高的若干条；向量分已经拉开明显差距时直接跳过
+    4. (问题, 节点ID) -> 分数 的 LRU 缓存
+    接口与 LlamaIndex 的 postprocess_nodes 保持一致，rag_engine 无需改调用方式。
+    """
+
+    def __init__(self, model_name, device="cpu", top_n=5, batch_size=16, max_length=512,
+                 backend="int8", max_candidates=20, skip_margin=0.0, cache_size=5000):
+        self.model_name = model_name
+        self.device = device
+        self.top_n = top_n
+        self.batch_size = batch_size
+        self.max_length = max_length
+        self.max_candidates = max_candidates
+        self.skip_margin = skip_margin
+        self.cache_size = cache_size
+
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=1000)
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.skipped = 0
+
+        self.backend = backend
+        self.model = self._load_model(backend)
+
+    def _load_model(self, backend):
+        from sentence_transformers import CrossEncoder
+
+        if backend == "onnx":
+            try:
+                # 需要 sentence-transformers>=4.1 以及 optimum[onnxruntime]
+                model = CrossEncoder(self.model_name, device=self.device, max_length=self.max_length, backend="onnx")
+                print("⚡ Reranker 使用 ONNX Runtime 后端")
+                return model
+            except Exception as e:
+                print(f"⚠️ ONNX 后端不可用，改用 int8 量化: {e}")
+                backend = "int8"
+
+        model = CrossEncoder(self.model_name, device=self.device, max_length=self.max_length)
+        if backend == "int8" and self.device == "cpu":
+            import torch
+            model.model = torch.quantization.quantize_dynamic(model.model, {torch.nn.Linear}, dtype=torch.qint8)
+            print("⚡ Reranker 已做 int8 动态量化")
+        self.backend = backend
+        return model
+
+    # --- 缓存 ---
+
+    def _cache_get(self, key):
+        with self._lock:
+            score = self._cache.get(key)
+            if score is not None:
+                self._cache.move_to_end(key)
+                self.cache_hits += 1
+            else:
+                self.cache_misses += 1
+            return score
+
+    def _cache_put(self, key, score):
+        with self._lock:
+            self._cache[key] = score
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    # --- 打分 ---
+
+    def _token_lengths(self, texts):
+        tokenizer = getattr(self.model, "tokenizer", None)
+        if tokenizer is None:
+            return [len(t) for t in texts]
+        encoded = tokenizer(texts, add_special_tokens=False, truncation=True, max_length=self.max_length)
+        return [len(ids) for ids in encoded["input_ids"]]
+
+    def score(self, query, texts):
+        """按 token 长度分桶成批打分，返回与 texts 同序的分数"""
+        # 先按字符粗截断，避免对超长文本做无意义的完整分词
+        texts = [t[: self.max_length * 4] for t in texts]
+        lengths = self._token_lengths(texts)
+        order = sorted(range(len(texts)), key=lambda i: lengths[i])
+
+        scores = [0.0] * len(texts)
+        for start in range(0, len(order), self.batch_size):
+            bucket = order[start:start + self.batch_size]
+            pairs = [(query, texts[i]) for i in bucket]
+            batch_scores = self.model.predict(pairs, batch_size=len(pairs), show_progress_bar=False)
+            for i, s in zip(bucket, batch_scores):
+                scores[i] = float(s)
+        return scores
+
+    def _has_clear_margin(self, nodes):
+        """向量分在第 top_n 名处已经拉开差距，重排大概率不会改变入选集合"""
+        if self.skip_margin <= 0 or len(nodes) <= self.top_n:
+            return False
+        head, tail = nodes[self.top_n - 1].score, nodes[self.top_n].score
+        if head is None or tail is None:
+            return False
+        return head - tail >= self.skip_margin
+
+    def postprocess_nodes(self, nodes, query_str, allow_skip=True):
+        """
+        allow_skip=False 时总是重排：混合检索给出的是 RRF 融合分 (两路都命中约 0.76 以上，
+        只命中一路不超过 0.5)，分差反映的是命中了几路而不是相关度，不能用来判断是否跳过。
+        """
+        t0 = time.time()
+        nodes = sorted(nodes, key=lambda n: n.score or 0.0, reverse=True)
+
+        if allow_skip and self._has_clear_margin(nodes):
+            self.skipped += 1
+            result = nodes[: self.top_n]
+            self._record(t0, len(nodes), 0, skipped=True)
+            return result
+
+        candidates = nodes[: self.max_candidates]
+        scores = {}
+        todo = []
+        for n in candidates:
+            cached = self._cache_get((query_str, n.node.node_id))
+            if cached is None:
+                todo.append(n)
+            else:
+                scores[n.node.node_id] = cached
+
+        if todo:
+            texts = [n.node.get_content(metadata_mode=MetadataMode.EMBED) for n in todo]
+            for n, s in zip(todo, self.score(query_str, texts)):
+                scores[n.node.node_id] = s
+                self._cache_put((query_str, n.node.node_id), s)
+
+        reranked = [NodeWithScore(node=n.node, score=scores[n.node.node_id]) for n in candidates]
+        reranked.sort(key=lambda n: n.score, reverse=True)
+        self._record(t0, len(candidates), len(todo))
+        return reranked[: self.top_n]
+
+    # --- 统计 ---
+
+    def _record(self, t0, candidates, scored, skipped=False):
+        elapsed = time.time() - t0
+        with self._lock:
+            self._latencies.append(elapsed)
+        s = self.stats()
+        note = "跳过 (向量分差距明显)" if skipped else f"候选 {candidates} / 实际打分 {scored}"
+        print(f"⚖️ 重排序 {elapsed * 1000:.0f} ms，{note} | 累计 p50 {s['p50_ms']:.0f} ms / p95 {s['p95_ms']:.0f} ms")
+
+    def stats(self):
+        with self._lock:
+            latencies = [x * 1000 for x in self._latencies]
+            lookups = self.cache_hits + self.cache_misses
+            return {
+                "backend": self.backend,
+                "queries": len(latencies),
+                "skipped": self.skipped,
+                "p50_ms": _percentile(latencies, 50),
+                "p95_ms": _percentile(latencies, 95),
+                "cache_hit_rate": self.cache_hits / lookups if lookups else 0.0,
+                "cache_entries": len(self._cache),
+            }
@@ -0,0 +1,125 @@
+# --- START OF FILE retrieval.py ---
+
+from llama_index.core.retrievers import BaseRetriever
+from llama_index.core.schema import NodeWithScore, MetadataMode
+from llama_index.core.vector_stores.utils import metadata_dict_to_node
+from qdrant_client.http import models
+
+
+def rrf_fuse(ranked_lists, k=60, top_k=None):
+    """
+    倒数排名融合 (Reciprocal Rank Fusion)：score = Σ 1 / (k + rank)。
+    ranked_lists: [[id, ...], ...]，返回 [(id, score), ...]，分数归一化到 [0, 1]
+    (在所有列表里都排第一 = 1.0)。
+    """
+    scores = {}
+    for ranked in ranked_lists:
+        for rank, item_id in enumerate(ranked, start=1):
+            scores[item_id] = scores.get(item_id, 0.0) + 1.0 / (k + rank)
+    best_possible = len(ranked_lists) / (k + 1)
+    fused = sorted(((i, s / best_possible) for i, s in scores.items()), key=lambda x: x[1], reverse=True)
+    return fused[:top_k] if top_k else fused
+
+
+class HybridRetriever(BaseRetriever):
+    """
+    向量检索 + BM25 稀疏检索，RRF 融合。只在稀疏侧命中的点从 Qdrant 按 ID 取回。
+    带过滤条件时 (qdrant_filter)，向量侧已在 Qdrant 内过滤；稀疏侧多取一些候选，
+    取回时带上同样的过滤条件，不满足条件的候选丢弃。
+    传入 executor 时 BM25 在线程池里和向量检索 (含问题向量化) 同时进行。
+    """
+
+    def __init__(self, dense_retriever, sparse_index, client, collection_name,
+                 sparse_top_k=20, top_k=12, rrf_k=60, qdrant_filter=None, executor=None):
+        super().__init__()
+        self._dense = dense_retriever
+        self._sparse = sparse_index
+        self._client = client
+        self._collection_name = collection_name
+        self._sparse_top_k = sparse_top_k
+        self._top_k = top_k
+        self._rrf_k = rrf_k
+        self._filter = qdrant_filter
+        self._executor = executor
+
+    def _retrieve(self, query_bundle):
+        sparse_top_k = self._sparse_top_k * 5 if self._filter else self._sparse_top_k
+        if self._executor is not None:
+            sparse_future = self._executor.submit(self._sparse.search, query_bundle.query_str, top_k=sparse_top_k)
+            dense_nodes = self._dense.retrieve(query_bundle)
+            sparse_hits = sparse_future.result()
+        else:
+            dense_nodes = self._dense.retrieve(query_bundle)
+            sparse_hits = self._sparse.search(query_bundle.query_str, top_k=sparse_top_k)
+
+        by_id = {n.node.node_id: n.node for n in dense_nodes}
+        missing = [pid for pid, _ in sparse_hits if pid not in by_id]
+        by_id.update(self._fetch_nodes(missing))
+        if self._filter:
+            sparse_hits = [(pid, score) for pid, score in sparse_hits if pid in by_id][:self._sparse_top_k]
+
+        fused = rrf_fuse(
+            [[n.node.node_id for n in dense_nodes], [pid for pid, _ in sparse_hits if pid in by_id]],
+            k=self._rrf_k,
+            top_k=self._top_k,
+        )
+        print(f"🔀 混合检索: 向量 {len(dense_nodes)} 条 + BM25 {len(sparse_hits)} 条 -> 融合 {len(fused)} 条")
+        return [NodeWithScore(node=by_id[pid], score=score) for pid, score in fused]
+
+    def _fetch_nodes(self, point_ids):
+        if not point_ids:
+            return {}
+        if self._filter:
+            # 按 ID 取回的同时在 Qdrant 里套用过滤条件
+            records, _ = self._client.scroll(
+                collection_name=self._collection_name,
+                scroll_filter=models.Filter(
+                    must=[models.HasIdCondition(has_id=point_ids)] + list(self._filter.must or []),
+                ),
+                limit=len(point_ids),
+                with_payload=True,
+                with_vectors=False,
+            )
+        else:
+            records = self._client.retrieve(
+                collection_name=self._collection_name,
+                ids=point_ids,
+                with_payload=True,
+                with_vectors=False,
+            )
+        nodes = {}
+        for r in records:
+            try:
+                node = metadata_dict_to_node(r.payload)
+                node.id_ = str(r.id)
+                nodes[str(r.id)] = node
+            except Exception as e:
+                print(f"⚠️ 无法还原节点 {r.id}: {e}")
+        return nodes
+
+
+def rebuild_sparse_index(client, collection_name, sparse_index, batch_size=256):
+    """从 Qdrant 全量扫描重建倒排索引 (旧数据迁移 / 索引文件丢失时使用)"""
+    offset = None
+    total = 0
+    while True:
+        records, offset = client.scroll(
+            collection_name=collection_name,
+            limit=batch_size,
+            offset=offset,
+            with_payload=True,
+            with_vectors=False,
+        )
+        entries = []
+        for r in records:
+            try:
+                node = metadata_dict_to_node(r.payload)
+            except Exception:
+                continue
+            entries.append((str(r.id), node.metadata.get("filename"), node.get_content(metadata_mode=MetadataMode.NONE)))
+        sparse_index.add(entries)
+        total += len(entries)
+        if offset is None:
+            break
+    print(f"🔧 倒排索引重建完成：{total} 个块")
+    return total
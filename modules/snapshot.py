@@ -0,0 +1,317 @@
+# --- START OF FILE snapshot.py ---
+# 知识库快照：把向量库里的点 (ID / 向量 / payload) 和 corpus.db 里的文档表、块表导出成一个目录，
+# 换机器 / 重建时不调用任何模型 (不解析、不抽元数据、不做 Embedding)，直接批量导回一个新集合。
+#
+# 目录格式 (version 1)：
+#   manifest.json       格式版本、集合名、向量维度、点数、Embedding 模型、各文件的 sha256 / 字节数
+#   vectors.f32         float32 小端、行优先的 [点数, 维度] 矩阵，可以直接 np.memmap
+#   points.jsonl        每行 {"id", "payload"}，顺序与 vectors.f32 的行一一对应 (payload 里含块文本)
+#   documents.jsonl / chunks.jsonl / metadata_cache.jsonl    对应数据表的行
+#   files/              (可选，--include-pdfs) 原始 PDF，导入时放回 documents.file_path
+# manifest.json 最后写入，没有它的目录视为未完成的导出。
+#
+# 嵌入模式下本地向量库有文件锁，导出 / 导入前需先停掉前端和入库 worker。
+#
+# 用法: python -m modules.snapshot export <目录> [--include-pdfs]
+#       python -m modules.snapshot verify <目录>
+#       python -m modules.snapshot import <目录> [--replace]
+
+import os
+import json
+import time
+import shutil
+import hashlib
+import argparse
+
+import numpy as np
+from qdrant_client.http import models
+
+from config import EMBED_MODEL_NAME, QDRANT_MODE
+from modules.vector_store import create_collection, collection_layout, ensure_payload_indexes, forget_collection, _plain_vector
+from modules.database import (
+    SNAPSHOT_TABLES, count_rows, iter_table_rows, restore_table_rows, bump_collection_generation
+)
+
+FORMAT = "rag-kb-snapshot"
+VERSION = 1
+MANIFEST = "manifest.json"
+VECTORS_FILE = "vectors.f32"
+POINTS_FILE = "points.jsonl"
+PDF_DIR = "files"
+VECTOR_DTYPE = "<f4"
+
+
+class _HashingWriter:
+    """边写边算 sha256，导出完不用再把文件读一遍"""
+
+    def __init__(self, path):
+        self._f = open(path, "wb")
+        self._h = hashlib.sha256()
+        self.bytes = 0
+
+    def write(self, data):
+        self._f.write(data)
+        self._h.update(data)
+        self.bytes += len(data)
+
+    def write_json(self, obj):
+        self.write((json.dumps(obj, ensure_ascii=False, default=str) + "\n").encode("utf-8"))
+
+    def close(self):
+        self._f.close()
+        return {"sha256": self._h.hexdigest(), "bytes": self.bytes}
+
+
+def _sha256(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _iter_jsonl(path):
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+# --- 导出 ---
+
+def export_snapshot(out_dir, client=None, collection_name=None, include_pdfs=False, batch_size=512):
+    """把当前知识库导出到 out_dir (目录不能已有快照)，返回 manifest"""
+    from modules.ingestion import get_client, COLLECTION_NAME
+
+    client = client or get_client()
+    collection_name = collection_name or COLLECTION_NAME
+    if os.path.exists(os.path.join(out_dir, MANIFEST)):
+        raise RuntimeError(f"{out_dir} 里已经有快照，请换一个目录")
+    os.makedirs(out_dir, exist_ok=True)
+    t0 = time.time()
+
+    dim = collection_layout(client, collection_name)["dim"]
+    vectors_out = _HashingWriter(os.path.join(out_dir, VECTORS_FILE))
+    points_out = _HashingWriter(os.path.join(out_dir, POINTS_FILE))
+    total = 0
+    offset = None
+    try:
+        while True:
+            records, offset = client.scroll(
+                collection_name=collection_name,
+                limit=batch_size,
+                offset=offset,
+                with_payload=True,
+                with_vectors=True,
+            )
+            for r in records:
+                vector = _plain_vector(r.vector)
+                if vector is None or len(vector) != dim:
+                    raise RuntimeError(f"点 {r.id} 的向量缺失或维度不是 {dim}")
+                vectors_out.write(np.asarray(vector, dtype=VECTOR_DTYPE).tobytes())
+                points_out.write_json({"id": r.id, "payload": r.payload})
+            total += len(records)
+            if records:
+                print(f"   ... 已导出 {total} 个点")
+            if offset is None:
+                break
+    finally:
+        files = {VECTORS_FILE: vectors_out.close(), POINTS_FILE: points_out.close()}
+
+    tables = {}
+    for table in SNAPSHOT_TABLES:
+        out = _HashingWriter(os.path.join(out_dir, f"{table}.jsonl"))
+        try:
+            for row in iter_table_rows(table):
+                out.write_json(row)
+        finally:
+            files[f"{table}.jsonl"] = out.close()
+        tables[table] = count_rows(table)
+
+    if include_pdfs:
+        os.makedirs(os.path.join(out_dir, PDF_DIR), exist_ok=True)
+        for doc in iter_table_rows("documents"):
+            src = doc.get("file_path")
+            if not src or not os.path.exists(src):
+                print(f"⚠️ 原始文件不存在，跳过: {doc['filename']}")
+                continue
+            rel = f"{PDF_DIR}/{doc['filename']}"
+            shutil.copyfile(src, os.path.join(out_dir, rel))
+            files[rel] = {"sha256": _sha256(src), "bytes": os.path.getsize(src)}
+
+    manifest = {
+        "format": FORMAT,
+        "version": VERSION,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "collection": collection_name,
+        "dim": dim,
+        "points": total,
+        "vector_dtype": "float32-le",
+        "embed_model": EMBED_MODEL_NAME,
+        "tables": tables,
+        "files": files,
+    }
+    tmp = os.path.join(out_dir, MANIFEST + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, os.path.join(out_dir, MANIFEST))
+    size = sum(info["bytes"] for info in files.values())
+    print(f"✅ 快照已导出到 {out_dir}: {total} 个点，{tables['documents']} 个文档，"
+          f"{size / 1024 / 1024:.1f} MB，耗时 {time.time() - t0:.1f}s")
+    return manifest
+
+
+# --- 校验 ---
+
+def load_manifest(snap_dir):
+    path = os.path.join(snap_dir, MANIFEST)
+    if not os.path.exists(path):
+        raise RuntimeError(f"{snap_dir} 不是完整的快照 (缺少 {MANIFEST})")
+    with open(path, encoding="utf-8") as f:
+        manifest = json.load(f)
+    if manifest.get("format") != FORMAT:
+        raise RuntimeError(f"未知的快照格式: {manifest.get('format')}")
+    if manifest.get("version", 0) > VERSION:
+        raise RuntimeError(f"快照版本 {manifest['version']} 比当前程序支持的 {VERSION} 新，请先升级")
+    return manifest
+
+
+def verify_snapshot(snap_dir):
+    """逐个文件核对字节数和 sha256，再核对向量文件大小与点数 / 维度，全部通过返回 manifest"""
+    manifest = load_manifest(snap_dir)
+    problems = []
+    for rel, info in manifest["files"].items():
+        path = os.path.join(snap_dir, rel)
+        if not os.path.exists(path):
+            problems.append(f"{rel}: 文件缺失")
+        elif os.path.getsize(path) != info["bytes"]:
+            problems.append(f"{rel}: 大小 {os.path.getsize(path)} != {info['bytes']}")
+        elif _sha256(path) != info["sha256"]:
+            problems.append(f"{rel}: sha256 不一致")
+    expected = manifest["points"] * manifest["dim"] * 4
+    if manifest["files"].get(VECTORS_FILE, {}).get("bytes") != expected:
+        problems.append(f"{VECTORS_FILE}: 应为 {expected} 字节 ({manifest['points']} x {manifest['dim']} x float32)")
+    if problems:
+        raise RuntimeError("快照校验失败:\n  " + "\n  ".join(problems))
+    print(f"✅ 快照校验通过: {len(manifest['files'])} 个文件，{manifest['points']} 个点")
+    return manifest
+
+
+# --- 导入 ---
+
+def _sparse_entries(ids, payloads):
+    from llama_index.core.schema import MetadataMode
+    from llama_index.core.vector_stores.utils import metadata_dict_to_node
+
+    entries = []
+    for point_id, payload in zip(ids, payloads):
+        try:
+            node = metadata_dict_to_node(payload)
+        except Exception:
+            continue
+        entries.append((str(point_id), node.metadata.get("filename"), node.get_content(metadata_mode=MetadataMode.NONE)))
+    return entries
+
+
+def import_snapshot(snap_dir, client=None, collection_name=None, replace=False, verify=True, batch_size=512):
+    """
+    把快照导入一个新建的集合：校验 -> 建集合 -> 按批 upsert (向量直接从 memmap 切片) -> 同步重建 BM25 索引
+    -> 恢复数据表 -> 放回原始 PDF -> 核对点数。不调用任何模型。
+    目标知识库非空时需要 replace=True (先删掉原集合和表)。
+    """
+    from modules.ingestion import get_client, COLLECTION_NAME
+    from modules.sparse_index import get_sparse_index
+
+    manifest = verify_snapshot(snap_dir) if verify else load_manifest(snap_dir)
+    if manifest["embed_model"] != EMBED_MODEL_NAME:
+        raise RuntimeError(f"快照的向量由 {manifest['embed_model']} 生成，当前配置是 {EMBED_MODEL_NAME}，"
+                           f"检索时问题向量对不上；请把 EMBED_MODEL_NAME 设为与快照一致")
+    client = client or get_client()
+    collection_name = collection_name or COLLECTION_NAME
+    n, dim = manifest["points"], manifest["dim"]
+    t0 = time.time()
+
+    existing = client.count(collection_name, exact=True).count if client.collection_exists(collection_name) else 0
+    if (existing or count_rows("documents")) and not replace:
+        raise RuntimeError(f"目标知识库非空 ({existing} 个点)，确认覆盖请加 --replace")
+    if client.collection_exists(collection_name):
+        client.delete_collection(collection_name)
+    forget_collection(collection_name)
+    create_collection(client, collection_name, dim)
+
+    sparse_index = get_sparse_index()
+    sparse_index.clear()
+    vectors = np.memmap(os.path.join(snap_dir, VECTORS_FILE), dtype=VECTOR_DTYPE, mode="r", shape=(n, dim)) if n else None
+    lines = _iter_jsonl(os.path.join(snap_dir, POINTS_FILE))
+    done = 0
+    while done < n:
+        ids, payloads = [], []
+        for point in lines:
+            ids.append(point["id"])
+            payloads.append(point["payload"])
+            if len(ids) >= batch_size:
+                break
+        if not ids:
+            break
+        end = done + len(ids)
+        # 服务模式下中间批次不等落盘，最后一批 wait=True (同一集合的更新按顺序生效)
+        client.upsert(
+            collection_name=collection_name,
+            points=models.Batch(ids=ids, vectors=vectors[done:end].tolist(), payloads=payloads),
+            wait=end >= n,
+        )
+        sparse_index.add(_sparse_entries(ids, payloads))
+        done = end
+        print(f"   ... 已导入 {done}/{n} 个点")
+
+    if QDRANT_MODE == "server":
+        ensure_payload_indexes(client, collection_name)
+    for table in SNAPSHOT_TABLES:
+        restored = restore_table_rows(table, _iter_jsonl(os.path.join(snap_dir, f"{table}.jsonl")), replace=True)
+        print(f"   ... {table}: {restored} 行")
+
+    paths = {d["filename"]: d.get("file_path") for d in iter_table_rows("documents")}
+    for rel, info in manifest["files"].items():
+        if not rel.startswith(PDF_DIR + "/"):
+            continue
+        filename = rel[len(PDF_DIR) + 1:]
+        target = paths.get(filename) or os.path.join("data", filename)
+        if os.path.exists(target) and _sha256(target) == info["sha256"]:
+            continue
+        os.makedirs(os.path.dirname(target) or ".", exist_ok=True)
+        shutil.copyfile(os.path.join(snap_dir, rel), target)
+
+    actual = client.count(collection_name, exact=True).count
+    if actual != n:
+        raise RuntimeError(f"导入后点数不一致 ({actual} != {n})")
+    # 让各进程的检索器 / 答案缓存失效
+    bump_collection_generation()
+    print(f"✅ 快照导入完成: {n} 个点，{manifest['tables'].get('documents', 0)} 个文档，耗时 {time.time() - t0:.1f}s")
+    return manifest
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="知识库快照导出 / 导入")
+    sub = parser.add_subparsers(dest="command", required=True)
+    export = sub.add_parser("export", help="导出当前知识库")
+    export.add_argument("directory")
+    export.add_argument("--include-pdfs", action="store_true", help="把原始 PDF 一起打进快照 (页面截图需要)")
+    export.add_argument("--batch-size", type=int, default=512)
+    verify = sub.add_parser("verify", help="按 manifest 校验快照文件的完整性")
+    verify.add_argument("directory")
+    restore = sub.add_parser("import", help="把快照导入新集合 (不调用模型)")
+    restore.add_argument("directory")
+    restore.add_argument("--replace", action="store_true", help="目标知识库非空时先清空")
+    restore.add_argument("--no-verify", action="store_true", help="跳过 sha256 校验")
+    restore.add_argument("--batch-size", type=int, default=512)
+    args = parser.parse_args()
+
+    from modules.database import init_db
+    init_db()
+
+    if args.command == "export":
+        export_snapshot(args.directory, include_pdfs=args.include_pdfs, batch_size=args.batch_size)
+    elif args.command == "verify":
+        verify_snapshot(args.directory)
+    else:
+        import_snapshot(args.directory, replace=args.replace, verify=not args.no_verify, batch_size=args.batch_size)
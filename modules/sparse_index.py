@@ -0,0 +1,182 @@
+# --- START OF FILE sparse_index.py ---
+
+import os
+import re
+import math
+import sqlite3
+import threading
+import unicodedata
+from collections import Counter
+
+from config import SPARSE_INDEX_PATH
+
+# 英文/数字标识符 (合同号、零件号等，允许中间带 - _ . /) 与中文字符串分开处理
+_TOKEN_RE = re.compile(r"[a-z0-9]+(?:[\-_./][a-z0-9]+)*|[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]+")
+_CJK_RE = re.compile(r"[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]")
+_ID_SPLIT_RE = re.compile(r"[\-_./]")
+
+
+def tokenize(text):
+    """
+    CJK 感知分词：
+    - 中文：单字 + 相邻双字 (bigram)，不依赖词典也能匹配专有名词
+    - 标识符：整体作为一个词，同时拆出各段，"HT-2024-001" 既能整体命中也能按 "2024" 命中
+    """
+    text = unicodedata.normalize("NFKC", text).lower()
+    tokens = []
+    for m in _TOKEN_RE.finditer(text):
+        tok = m.group(0)
+        if _CJK_RE.match(tok):
+            tokens.extend(tok)
+            tokens.extend(tok[i:i + 2] for i in range(len(tok) - 1))
+        else:
+            tokens.append(tok)
+            parts = _ID_SPLIT_RE.split(tok)
+            if len(parts) > 1:
+                tokens.extend(p for p in parts if p)
+    return tokens
+
+
+class SparseIndex:
+    """
+    本地磁盘倒排索引 (SQLite) + BM25 打分。
+    以向量库点 ID 为文档 ID，入库/删除时增量维护倒排表。
+    """
+
+    def __init__(self, path, k1=1.5, b=0.75):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.Lock()
+        self._readers = threading.local()
+        self._read_path = os.path.abspath(path)
+        # 服务模式下多个进程 (前端 / 入库 worker) 同时写同一个索引文件，等锁而不是立即报错
+        self._conn = sqlite3.connect(path, timeout=10, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS postings (
+                term TEXT,
+                point_id TEXT,
+                tf INTEGER,
+                PRIMARY KEY (term, point_id)
+            ) WITHOUT ROWID
+        ''')
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_postings_point ON postings(point_id)")
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS sparse_docs (
+                point_id TEXT PRIMARY KEY,
+                filename TEXT,
+                length INTEGER
+            )
+        ''')
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_sparse_docs_filename ON sparse_docs(filename)")
+        self._conn.commit()
+
+    # --- 写入 ---
+
+    def add(self, entries):
+        """entries: [(point_id, filename, text), ...]，同 ID 重复写入会覆盖"""
+        if not entries:
+            return
+        doc_rows, posting_rows = [], []
+        for point_id, filename, text in entries:
+            counts = Counter(tokenize(text))
+            doc_rows.append((point_id, filename, sum(counts.values())))
+            posting_rows.extend((term, point_id, tf) for term, tf in counts.items())
+        with self._lock:
+            self._delete_ids([e[0] for e in entries])
+            self._conn.executemany("INSERT INTO sparse_docs (point_id, filename, length) VALUES (?, ?, ?)", doc_rows)
+            self._conn.executemany("INSERT INTO postings (term, point_id, tf) VALUES (?, ?, ?)", posting_rows)
+            self._conn.commit()
+
+    def delete_points(self, point_ids):
+        if not point_ids:
+            return
+        with self._lock:
+            self._delete_ids(list(point_ids))
+            self._conn.commit()
+
+    def delete_file(self, filename):
+        with self._lock:
+            ids = [r[0] for r in self._conn.execute("SELECT point_id FROM sparse_docs WHERE filename = ?", (filename,))]
+            self._delete_ids(ids)
+            self._conn.commit()
+
+    def clear(self):
+        """清空整个索引 (快照导入前使用)"""
+        with self._lock:
+            self._conn.execute("DELETE FROM postings")
+            self._conn.execute("DELETE FROM sparse_docs")
+            self._conn.commit()
+
+    def _delete_ids(self, ids):
+        for i in range(0, len(ids), 500):
+            batch = ids[i:i + 500]
+            placeholders = ",".join("?" * len(batch))
+            self._conn.execute(f"DELETE FROM postings WHERE point_id IN ({placeholders})", batch)
+            self._conn.execute(f"DELETE FROM sparse_docs WHERE point_id IN ({placeholders})", batch)
+
+    # --- 查询 ---
+
+    def count(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM sparse_docs").fetchone()[0]
+
+    def _read_conn(self):
+        """检索用的只读连接：每个线程一条，WAL 模式下多个会话可以同时检索，不和写入抢同一把锁"""
+        conn = getattr(self._readers, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self._read_path, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA query_only=ON")
+            self._readers.conn = conn
+        return conn
+
+    def search(self, query, top_k=20, max_df_ratio=0.3):
+        """BM25 检索，返回 [(point_id, score), ...]；出现在超过 max_df_ratio 文档里的高频词不参与打分"""
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms:
+            return []
+        conn = self._read_conn()
+        # 几条查询放在同一个读事务里，看到的是同一个快照
+        conn.execute("BEGIN")
+        try:
+            n_docs, avgdl = conn.execute("SELECT COUNT(*), AVG(length) FROM sparse_docs").fetchone()
+            if not n_docs:
+                return []
+            placeholders = ",".join("?" * len(terms))
+            df = dict(conn.execute(
+                f"SELECT term, COUNT(*) FROM postings WHERE term IN ({placeholders}) GROUP BY term", terms
+            ).fetchall())
+            # 全是高频词时仍保留，避免查询被整个丢掉
+            selective = [t for t in df if df[t] <= n_docs * max_df_ratio] or list(df)
+            if not selective:
+                return []
+            placeholders = ",".join("?" * len(selective))
+            rows = conn.execute(f'''
+                SELECT p.term, p.point_id, p.tf, d.length
+                FROM postings p JOIN sparse_docs d ON p.point_id = d.point_id
+                WHERE p.term IN ({placeholders})
+            ''', selective).fetchall()
+        finally:
+            conn.rollback()
+
+        scores = {}
+        for term, point_id, tf, length in rows:
+            idf = math.log(1 + (n_docs - df[term] + 0.5) / (df[term] + 0.5))
+            denom = tf + self.k1 * (1 - self.b + self.b * length / (avgdl or 1))
+            scores[point_id] = scores.get(point_id, 0.0) + idf * tf * (self.k1 + 1) / denom
+        return sorted(scores.items(), key=lambda x: x[1], reverse=True)[:top_k]
+
+
+_sparse_index = None
+_sparse_index_lock = threading.Lock()
+
+def get_sparse_index():
+    """进程内单例"""
+    global _sparse_index
+    if _sparse_index is None:
+        with _sparse_index_lock:
+            if _sparse_index is None:
+                _sparse_index = SparseIndex(SPARSE_INDEX_PATH)
+    return _sparse_index
@@ -0,0 +1,338 @@
+# --- START OF FILE telemetry.py ---
+
+import os
+import re
+import time
+import threading
+from collections import deque
+from functools import wraps
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from config import METRICS_PORT, METRICS_FILE, METRICS_FILE_INTERVAL, METRICS_TRACE_HISTORY
+
+# 直方图桶 (秒)：覆盖毫秒级的缓存命中到分钟级的大文件解析
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+def _percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * pct / 100.0
+    lo = int(k)
+    hi = min(lo + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+
+def _labels_text(labels):
+    if not labels:
+        return ""
+    inner = ",".join('{}="{}"'.format(k, str(v).replace("\\", "\\\\").replace('"', '\\"')) for k, v in labels)
+    return "{" + inner + "}"
+
+
+class _Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.total = 0
+        self.sum = 0.0
+        # 最近的原始值，前端算分位数用
+        self.recent = deque(maxlen=1000)
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.total += 1
+        self.sum += value
+        self.recent.append(value)
+
+
+class Trace:
+    """一次问答 / 一个文件入库的完整链路：各阶段耗时累加到 stages (毫秒)"""
+
+    def __init__(self, kind, name):
+        self.kind = kind
+        self.name = name
+        self.started = time.time()
+        self.stages = {}
+        self.attrs = {}
+        self.total_ms = None
+
+    def add(self, stage, seconds):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds * 1000
+
+    def to_dict(self):
+        return {
+            "kind": self.kind,
+            "name": self.name,
+            "time": time.strftime("%H:%M:%S", time.localtime(self.started)),
+            "total_ms": self.total_ms,
+            "stages": dict(self.stages),
+            **self.attrs,
+        }
+
+
+class Registry:
+    """
+    进程内指标：计数器、直方图、最近的链路记录，以及按需拉取的外部统计 (各缓存的 stats())。
+    导出为 Prometheus 文本格式。
+    """
+
+    def __init__(self, trace_history=200):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        self._help = {}
+        self._collectors = {}
+        self._traces = deque(maxlen=trace_history)
+
+    def inc(self, name, value=1, help_text=None, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            if help_text:
+                self._help.setdefault(name, help_text)
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name, value, help_text=None, buckets=DEFAULT_BUCKETS, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            if help_text:
+                self._help.setdefault(name, help_text)
+            series = self._histograms.setdefault(name, {})
+            hist = series.get(key)
+            if hist is None:
+                hist = series[key] = _Histogram(buckets)
+            hist.observe(value)
+
+    def register_collector(self, name, fn):
+        """fn() 返回 dict，其中的数值在导出时作为 gauge: rag_<name>_<key>"""
+        with self._lock:
+            self._collectors[name] = fn
+
+    def add_trace(self, trace):
+        with self._lock:
+            self._traces.append(trace)
+
+    def recent_traces(self, kind=None, limit=50):
+        with self._lock:
+            traces = [t for t in self._traces if kind is None or t.kind == kind]
+        return [t.to_dict() for t in reversed(traces[-limit:])]
+
+    def stage_summary(self, name="rag_stage_seconds"):
+        """各阶段的次数 / 平均 / p50 / p95 (毫秒)，前端表格用"""
+        with self._lock:
+            series = [(dict(key), hist.total, hist.sum, list(hist.recent)) for key, hist in self._histograms.get(name, {}).items()]
+        rows = []
+        for labels, total, total_sum, recent in sorted(series, key=lambda s: s[0].get("stage", "")):
+            ms = [v * 1000 for v in recent]
+            rows.append({
+                **labels,
+                "count": total,
+                "mean_ms": total_sum * 1000 / total if total else 0.0,
+                "p50_ms": _percentile(ms, 50),
+                "p95_ms": _percentile(ms, 95),
+            })
+        return rows
+
+    def collector_stats(self):
+        with self._lock:
+            collectors = list(self._collectors.items())
+        stats = {}
+        for name, fn in collectors:
+            try:
+                stats[name] = fn()
+            except Exception as e:
+                stats[name] = {"error": str(e)}
+        return stats
+
+    def render(self):
+        """Prometheus 文本格式"""
+        lines = []
+        with self._lock:
+            counters = {n: dict(s) for n, s in self._counters.items()}
+            histograms = {n: {k: (h.buckets, list(h.counts), h.total, h.sum) for k, h in s.items()}
+                          for n, s in self._histograms.items()}
+            help_texts = dict(self._help)
+
+        for name, series in sorted(counters.items()):
+            if name in help_texts:
+                lines.append(f"# HELP {name} {help_texts[name]}")
+            lines.append(f"# TYPE {name} counter")
+            for key, value in series.items():
+                lines.append(f"{name}{_labels_text(key)} {value}")
+
+        for name, series in sorted(histograms.items()):
+            if name in help_texts:
+                lines.append(f"# HELP {name} {help_texts[name]}")
+            lines.append(f"# TYPE {name} histogram")
+            for key, (buckets, counts, total, total_sum) in series.items():
+                for bound, count in zip(buckets, counts):
+                    lines.append(f"{name}_bucket{_labels_text(key + (('le', bound),))} {count}")
+                lines.append(f"{name}_bucket{_labels_text(key + (('le', '+Inf'),))} {total}")
+                lines.append(f"{name}_sum{_labels_text(key)} {total_sum}")
+                lines.append(f"{name}_count{_labels_text(key)} {total}")
+
+        for source, stats in sorted(self.collector_stats().items()):
+            for key, value in sorted(stats.items()):
+                if isinstance(value, (int, float)):
+                    metric = re.sub(r"[^a-zA-Z0-9_]", "_", f"rag_{source}_{key}")
+                    lines.append(f"# TYPE {metric} gauge")
+                    lines.append(f"{metric} {float(value)}")
+        return "\n".join(lines) + "\n"
+
+
+_registry = Registry(METRICS_TRACE_HISTORY)
+_local = threading.local()
+
+
+def get_registry():
+    return _registry
+
+
+def inc(name, value=1, help_text=None, **labels):
+    _registry.inc(name, value, help_text, **labels)
+
+
+def observe(name, value, help_text=None, buckets=DEFAULT_BUCKETS, **labels):
+    _registry.observe(name, value, help_text, buckets, **labels)
+
+
+def register_collector(name, fn):
+    _registry.register_collector(name, fn)
+
+
+def current_trace():
+    return getattr(_local, "trace", None)
+
+
+def record(stage, seconds, **labels):
+    """记录一个阶段的耗时 (不方便用 with 包起来的地方，如流式输出)"""
+    _registry.observe("rag_stage_seconds", seconds, "各阶段耗时 (秒)", stage=stage, **labels)
+    trace = current_trace()
+    if trace is not None:
+        trace.add(stage, seconds)
+
+
+@contextmanager
+def span(stage, **labels):
+    """计时一个阶段：写入直方图 rag_stage_seconds{stage=...}，并记到当前线程正在进行的链路上"""
+    t0 = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        inc("rag_stage_errors_total", 1, "各阶段异常次数", stage=stage)
+        raise
+    finally:
+        record(stage, time.perf_counter() - t0, **labels)
+
+
+def traced(stage):
+    """函数装饰器版的 span"""
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def trace(kind, name):
+    """
+    开始一条链路 (一次问答 / 一个文件入库)：期间本线程的 span 都记到这条链路上，结束后进入最近记录。
+    可以在 with 块里往 trace.attrs 写附加信息 (是否命中缓存、结果等)。
+    """
+    t = Trace(kind, name)
+    previous = current_trace()
+    _local.trace = t
+    t0 = time.perf_counter()
+    try:
+        yield t
+    finally:
+        t.total_ms = (time.perf_counter() - t0) * 1000
+        _registry.observe(f"rag_{kind}_seconds", t.total_ms / 1000, f"{kind} 全链路耗时 (秒)")
+        _registry.add_trace(t)
+        # 流式生成器可能在别的时机被回收，只在仍是当前链路时才恢复
+        if current_trace() is t:
+            _local.trace = previous
+
+
+def recent_traces(kind=None, limit=50):
+    return _registry.recent_traces(kind, limit)
+
+
+def stage_summary():
+    return _registry.stage_summary()
+
+
+def collector_stats():
+    return _registry.collector_stats()
+
+
+def render_prometheus():
+    return _registry.render()
+
+
+# --- 导出 ---
+
+_exporter_lock = threading.Lock()
+_exporter_started = False
+
+
+def start_exporter(port=METRICS_PORT, path=METRICS_FILE, interval=METRICS_FILE_INTERVAL):
+    """
+    每个进程启动一次：
+    - port > 0：在该端口提供 GET /metrics (Prometheus 抓取)
+    - path 非空：每 interval 秒把指标写入文件 (可含 {pid}，多个 worker 进程各写一份)，
+      配合 node_exporter 的 textfile collector 使用
+    """
+    global _exporter_started
+    with _exporter_lock:
+        if _exporter_started:
+            return
+        _exporter_started = True
+
+    if port:
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                data = render_prometheus().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        try:
+            server = ThreadingHTTPServer(("0.0.0.0", port), Handler)
+            threading.Thread(target=server.serve_forever, daemon=True, name="metrics-http").start()
+            print(f"📈 指标端点: http://0.0.0.0:{port}/metrics")
+        except OSError as e:
+            print(f"⚠️ 指标端口 {port} 启动失败: {e}")
+
+    if path:
+        path = path.replace("{pid}", str(os.getpid()))
+
+        def write_loop():
+            while True:
+                try:
+                    tmp = path + ".tmp"
+                    with open(tmp, "w", encoding="utf-8") as f:
+                        f.write(render_prometheus())
+                    os.replace(tmp, path)
+                except OSError as e:
+                    print(f"⚠️ 指标文件写入失败: {e}")
+                time.sleep(interval)
+
+        threading.Thread(target=write_loop, daemon=True, name="metrics-file").start()
+        print(f"📈 指标文件: {path} (每 {interval:.0f}s 更新)")
@@ -0,0 +1,558 @@
+# --- START OF FILE vector_store.py ---
+
+import os
+import re
+import json
+import time
+import atexit
+import argparse
+import calendar
+import threading
+import subprocess
+import urllib.request
+from qdrant_client.http import models
+
+from config import (
+    QDRANT_URL, QDRANT_HNSW_M, QDRANT_HNSW_EF_CONSTRUCT, QDRANT_HNSW_EF, QDRANT_FULL_SCAN_THRESHOLD,
+    QDRANT_QUANTIZATION, QDRANT_VECTORS_ON_DISK, QDRANT_OVERSAMPLING, QDRANT_RESCORE,
+    QDRANT_MODE, QDRANT_PATH, QDRANT_API_KEY, QDRANT_TIMEOUT, QDRANT_PREFER_GRPC, QDRANT_GRPC_PORT,
+    QDRANT_POOL_SIZE, QDRANT_SHARDS, QDRANT_REPLICATION_FACTOR, QDRANT_BINARY, QDRANT_SERVER_STORAGE,
+    QUERY_FILENAME_MIN_STEM,
+)
+
+# 需要建 payload 索引的字段：删除按 filename 过滤，检索按类型 / 日期 / 标签过滤
+# (标签就是元数据里的 keywords 列表，documents.tags 存的是它拼成的字符串)
+PAYLOAD_INDEXES = {
+    "filename": models.PayloadSchemaType.KEYWORD,
+    "doc_type": models.PayloadSchemaType.KEYWORD,
+    "doc_date": models.PayloadSchemaType.DATETIME,
+    "keywords": models.PayloadSchemaType.KEYWORD,
+}
+
+QUANTIZATION_KINDS = ("scalar", "binary", "none")
+
+# 已检查过的集合 (每个进程只检查一次)
+_checked = set()
+_lock = threading.Lock()
+
+def hnsw_config():
+    return models.HnswConfigDiff(
+        m=QDRANT_HNSW_M,
+        ef_construct=QDRANT_HNSW_EF_CONSTRUCT,
+        full_scan_threshold=QDRANT_FULL_SCAN_THRESHOLD,
+    )
+
+def quantization_config(kind=QDRANT_QUANTIZATION):
+    """量化向量常驻内存 (always_ram)，原始向量可以放磁盘，只在 rescore 时读取"""
+    if kind == "scalar":
+        return models.ScalarQuantization(
+            scalar=models.ScalarQuantizationConfig(type=models.ScalarType.INT8, quantile=0.99, always_ram=True),
+        )
+    if kind == "binary":
+        return models.BinaryQuantization(binary=models.BinaryQuantizationConfig(always_ram=True))
+    if kind == "none":
+        return None
+    raise ValueError(f"未知的量化方式: {kind} (可选 {', '.join(QUANTIZATION_KINDS)})")
+
+def search_params(quantization=QDRANT_QUANTIZATION, oversampling=QDRANT_OVERSAMPLING, rescore=QDRANT_RESCORE):
+    """查询时的 HNSW / 量化参数 (传给 QdrantVectorStore.query)；本地嵌入模式是暴力检索，不需要"""
+    if QDRANT_MODE != "server":
+        return None
+    quant = None
+    if quantization != "none":
+        quant = models.QuantizationSearchParams(rescore=rescore, oversampling=oversampling)
+    return models.SearchParams(hnsw_ef=QDRANT_HNSW_EF, quantization=quant)
+
+def create_collection(client, collection_name, dim, quantization=QDRANT_QUANTIZATION, on_disk=QDRANT_VECTORS_ON_DISK):
+    """按配置的布局建集合 (单个无名向量，与 QdrantVectorStore 自动建的集合兼容)；服务模式下按配置分片"""
+    sharding = {}
+    if QDRANT_MODE == "server":
+        sharding = {"shard_number": QDRANT_SHARDS, "replication_factor": QDRANT_REPLICATION_FACTOR}
+    client.create_collection(
+        collection_name=collection_name,
+        vectors_config=models.VectorParams(size=dim, distance=models.Distance.COSINE, on_disk=on_disk),
+        hnsw_config=hnsw_config(),
+        quantization_config=quantization_config(quantization),
+        **sharding,
+    )
+    print(f"🧱 已创建集合 {collection_name} (dim={dim}, 量化={quantization}, 原始向量{'在磁盘' if on_disk else '在内存'})")
+
+def collection_layout(client, collection_name):
+    """当前集合的布局: {"dim", "on_disk", "quantization", "points"}"""
+    info = client.get_collection(collection_name)
+    vectors = info.config.params.vectors
+    if isinstance(vectors, dict):
+        # 旧版 LlamaIndex 建的命名向量，取第一个
+        vectors = next(iter(vectors.values()))
+    quant = info.config.quantization_config
+    if isinstance(quant, models.ScalarQuantization):
+        kind = "scalar"
+    elif isinstance(quant, models.BinaryQuantization):
+        kind = "binary"
+    else:
+        kind = "none" if quant is None else type(quant).__name__
+    return {
+        "dim": vectors.size,
+        "on_disk": bool(vectors.on_disk),
+        "quantization": kind,
+        "points": client.count(collection_name, exact=True).count,
+    }
+
+def ensure_collection(client, collection_name, dim=None):
+    """
+    集合不存在时按配置显式创建 (需要知道向量维度)，已存在的集合补建缺失的 payload 索引、同步 HNSW 参数。
+    返回集合是否存在。
+    """
+    if collection_name in _checked:
+        return True
+    with _lock:
+        if collection_name in _checked:
+            return True
+        if not client.collection_exists(collection_name):
+            if dim is None:
+                return False
+            create_collection(client, collection_name, dim)
+        elif QDRANT_MODE == "server":
+            _check_layout(client, collection_name)
+            _sync_hnsw(client, collection_name)
+        # 嵌入 / 内存模式没有 HNSW / 量化 / payload 索引 (暴力检索 + 全量过滤)，只有服务模式需要维护
+        if QDRANT_MODE == "server":
+            ensure_payload_indexes(client, collection_name)
+        _checked.add(collection_name)
+        return True
+
+def forget_collection(collection_name):
+    """集合被删除 / 重建后调用，下次访问重新检查"""
+    with _lock:
+        _checked.discard(collection_name)
+
+def _check_layout(client, collection_name):
+    """量化方式 / 原始向量位置与配置不一致时提示离线迁移 (改布局需要重建集合)"""
+    try:
+        layout = collection_layout(client, collection_name)
+    except Exception as e:
+        print(f"⚠️ 读取集合配置失败: {e}")
+        return
+    if layout["quantization"] != QDRANT_QUANTIZATION or layout["on_disk"] != QDRANT_VECTORS_ON_DISK:
+        print(f"⚠️ 集合 {collection_name} 的布局 (量化={layout['quantization']}, on_disk={layout['on_disk']}) "
+              f"与配置 (量化={QDRANT_QUANTIZATION}, on_disk={QDRANT_VECTORS_ON_DISK}) 不一致，"
+              f"可停机后运行 python -m modules.vector_store migrate 迁移")
+
+def _sync_hnsw(client, collection_name):
+    try:
+        current = client.get_collection(collection_name).config.hnsw_config
+    except Exception as e:
+        print(f"⚠️ 读取集合配置失败: {e}")
+        return
+    if current.m != QDRANT_HNSW_M or current.ef_construct != QDRANT_HNSW_EF_CONSTRUCT:
+        # 服务端会在后台按新参数重建索引
+        client.update_collection(collection_name=collection_name, hnsw_config=hnsw_config())
+        print(f"🧱 集合 {collection_name} HNSW 参数更新为 m={QDRANT_HNSW_M}, ef_construct={QDRANT_HNSW_EF_CONSTRUCT}")
+
+def ensure_payload_indexes(client, collection_name):
+    """补建缺失的 payload 索引"""
+    try:
+        existing = client.get_collection(collection_name).payload_schema or {}
+    except Exception:
+        existing = {}
+    for field, schema in PAYLOAD_INDEXES.items():
+        if field in existing:
+            continue
+        client.create_payload_index(
+            collection_name=collection_name,
+            field_name=field,
+            field_schema=schema,
+            wait=True,
+        )
+        print(f"🧱 已创建 payload 索引: {field} ({schema.value})")
+
+# --- 嵌入模式的并发访问 ---
+# 嵌入模式 (QdrantLocal) 本身没有加锁：检索只读 numpy 数组，多个会话可以同时检索 (矩阵运算会释放 GIL)；
+# 写入 / 删除会改数组和 payload，必须和检索互斥。服务模式由服务端处理并发，不需要包装。
+
+_WRITE_METHODS = frozenset({
+    "upsert", "upload_points", "upload_collection", "delete", "delete_vectors", "update_vectors",
+    "set_payload", "overwrite_payload", "delete_payload", "clear_payload", "batch_update_points",
+    "create_collection", "recreate_collection", "delete_collection", "update_collection",
+    "create_payload_index", "delete_payload_index", "close",
+})
+
+
+class ReadWriteLock:
+    """读写锁：读者可以并发，写者独占；有写者等待时新读者排队，写入不会被持续的检索饿死"""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._readers = 0
+        self._writer = False
+        self._writers_waiting = 0
+
+    def acquire_read(self):
+        with self._cond:
+            while self._writer or self._writers_waiting:
+                self._cond.wait()
+            self._readers += 1
+
+    def release_read(self):
+        with self._cond:
+            self._readers -= 1
+            if self._readers == 0:
+                self._cond.notify_all()
+
+    def acquire_write(self):
+        with self._cond:
+            self._writers_waiting += 1
+            while self._writer or self._readers:
+                self._cond.wait()
+            self._writers_waiting -= 1
+            self._writer = True
+
+    def release_write(self):
+        with self._cond:
+            self._writer = False
+            self._cond.notify_all()
+
+
+class GuardedClient:
+    """包装嵌入模式的 QdrantClient：读方法共享锁，写方法独占锁；其余属性原样转发"""
+
+    def __init__(self, client):
+        self._inner = client
+        self._rw = ReadWriteLock()
+        self._local = threading.local()
+
+    def __getattr__(self, name):
+        attr = getattr(self._inner, name)
+        if not callable(attr) or name.startswith("_"):
+            return attr
+        write = name in _WRITE_METHODS
+
+        def call(*args, **kwargs):
+            # 同一线程里嵌套调用 (如写方法内部再读) 不重复加锁
+            if getattr(self._local, "held", False):
+                return attr(*args, **kwargs)
+            acquire, release = (self._rw.acquire_write, self._rw.release_write) if write else \
+                (self._rw.acquire_read, self._rw.release_read)
+            acquire()
+            self._local.held = True
+            try:
+                return attr(*args, **kwargs)
+            finally:
+                self._local.held = False
+                release()
+
+        return call
+
+
+# --- 连接 ---
+# 每个进程一个客户端 (按进程号区分：spawn / fork 出来的子进程会新建自己的连接，不复用父进程的 gRPC 通道)。
+# 服务模式的客户端自带连接池 (pool_size)，所有线程共享；嵌入 / 内存模式包一层读写锁。
+
+QDRANT_MODES = ("embedded", "server", "memory")
+
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+
+def connect(mode=QDRANT_MODE):
+    """按模式新建一个客户端 (一般用 get_shared_client)"""
+    import qdrant_client
+
+    if mode == "server":
+        if not QDRANT_URL:
+            raise RuntimeError("QDRANT_MODE=server 需要配置 QDRANT_URL (如 http://localhost:6333)")
+        return qdrant_client.QdrantClient(
+            url=QDRANT_URL,
+            api_key=QDRANT_API_KEY or None,
+            prefer_grpc=QDRANT_PREFER_GRPC,
+            grpc_port=QDRANT_GRPC_PORT,
+            timeout=QDRANT_TIMEOUT,
+            pool_size=QDRANT_POOL_SIZE,
+        )
+    if mode == "memory":
+        return GuardedClient(qdrant_client.QdrantClient(location=":memory:"))
+    if mode != "embedded":
+        raise ValueError(f"未知的 QDRANT_MODE: {mode} (可选 {', '.join(QDRANT_MODES)})")
+    os.makedirs(QDRANT_PATH, exist_ok=True)
+    try:
+        return GuardedClient(qdrant_client.QdrantClient(path=QDRANT_PATH))
+    except RuntimeError as e:
+        if "already accessed" not in str(e):
+            raise
+        raise RuntimeError(
+            f"本地向量库 {QDRANT_PATH} 已被另一个进程打开 (嵌入模式只能单进程访问)。"
+            f"请先停掉占用的进程，或改用服务模式：python -m modules.vector_store serve 启动本机 Qdrant 后设置 QDRANT_URL (QDRANT_MODE=server)"
+        ) from e
+
+def get_shared_client():
+    """进程内单例"""
+    global _client, _client_pid
+    pid = os.getpid()
+    if _client is None or _client_pid != pid:
+        with _client_lock:
+            if _client is None or _client_pid != pid:
+                _client = connect()
+                _client_pid = pid
+                if QDRANT_MODE != "server":
+                    # 本地库在解释器退出前显式关闭 (落盘、释放目录锁)，不留给析构函数
+                    atexit.register(_client.close)
+                print(f"🔌 向量库连接: {describe_connection()}")
+    return _client
+
+def describe_connection():
+    if QDRANT_MODE == "server":
+        return f"服务 {QDRANT_URL} ({'gRPC' if QDRANT_PREFER_GRPC else 'REST'}，连接池 {QDRANT_POOL_SIZE})"
+    if QDRANT_MODE == "memory":
+        return "进程内内存库 (不落盘)"
+    return f"本地目录 {QDRANT_PATH} (单进程)"
+
+def serve_local(binary=QDRANT_BINARY, storage=QDRANT_SERVER_STORAGE, http_port=6333, grpc_port=QDRANT_GRPC_PORT,
+                ready_timeout=60):
+    """
+    在本机直接运行 Qdrant 可执行文件 (不需要 Docker)，就绪后一直运行到 Ctrl+C。
+    服务端存储格式和嵌入模式的 storage_db 不同，已有数据用 python -m modules.snapshot 导出再导入。
+    """
+    env = dict(
+        os.environ,
+        QDRANT__STORAGE__STORAGE_PATH=os.path.abspath(storage),
+        QDRANT__SERVICE__HTTP_PORT=str(http_port),
+        QDRANT__SERVICE__GRPC_PORT=str(grpc_port),
+    )
+    if QDRANT_API_KEY:
+        env["QDRANT__SERVICE__API_KEY"] = QDRANT_API_KEY
+    try:
+        proc = subprocess.Popen([binary], env=env)
+    except FileNotFoundError:
+        raise RuntimeError(f"找不到 Qdrant 可执行文件 {binary}：从 https://github.com/qdrant/qdrant/releases 下载后放到 PATH，"
+                           f"或用 QDRANT_BINARY 指定路径") from None
+    url = f"http://127.0.0.1:{http_port}"
+    deadline = time.time() + ready_timeout
+    try:
+        while True:
+            if proc.poll() is not None:
+                raise RuntimeError(f"Qdrant 启动失败 (exit={proc.returncode})")
+            try:
+                with urllib.request.urlopen(f"{url}/readyz", timeout=2) as resp:
+                    if resp.status == 200:
+                        break
+            except OSError:
+                pass
+            if time.time() > deadline:
+                raise RuntimeError(f"Qdrant {ready_timeout}s 内未就绪")
+            time.sleep(0.5)
+        print(f"✅ Qdrant 已就绪: {url} (gRPC 端口 {grpc_port}，数据目录 {storage})")
+        print(f"   各进程设置 QDRANT_URL={url} 即可同时访问 (前端可以开多个，入库用 python -m modules.worker)")
+        proc.wait()
+    except KeyboardInterrupt:
+        print("🛑 停止 Qdrant ...")
+    finally:
+        if proc.poll() is None:
+            proc.terminate()
+            proc.wait()
+
+
+# --- 离线迁移 ---
+
+def _plain_vector(vector):
+    if isinstance(vector, dict):
+        return next((v for v in vector.values() if isinstance(v, list)), None)
+    return vector
+
+def copy_points(client, source, target, batch_size=256):
+    """逐批把点 (ID / 原始向量 / payload) 从 source 复制到 target，返回复制的点数"""
+    offset = None
+    total = 0
+    while True:
+        records, offset = client.scroll(
+            collection_name=source,
+            limit=batch_size,
+            offset=offset,
+            with_payload=True,
+            with_vectors=True,
+        )
+        points = [
+            models.PointStruct(id=r.id, vector=_plain_vector(r.vector), payload=r.payload)
+            for r in records
+        ]
+        if points:
+            client.upsert(collection_name=target, points=points, wait=True)
+            total += len(points)
+            print(f"   ... {source} -> {target}: {total}")
+        if offset is None:
+            return total
+
+def migrate_collection(client, collection_name, quantization=QDRANT_QUANTIZATION, on_disk=QDRANT_VECTORS_ON_DISK,
+                       batch_size=256, keep_backup=False):
+    """
+    离线把集合重建成新布局 (量化方式 / 原始向量位置)。点 ID 和 payload 不变，块表、BM25 索引都不用动。
+    步骤：复制到备份集合 -> 删除原集合 -> 按新布局重建 -> 从备份复制回来 -> 校验点数 -> 删除备份。
+    中途失败时备份集合保留，再次运行会从备份继续。
+    """
+    quantization_config(quantization)  # 先校验参数
+    if QDRANT_MODE != "server":
+        print("ℹ️ 本地嵌入模式是暴力检索，量化不生效；新布局在改用 Qdrant 服务 (QDRANT_MODE=server) 后才有意义")
+    backup = f"{collection_name}__backup"
+    t0 = time.time()
+
+    if client.collection_exists(backup):
+        backup_points = client.count(backup, exact=True).count
+        source_points = client.count(collection_name, exact=True).count if client.collection_exists(collection_name) else 0
+        if source_points > backup_points:
+            # 上次在复制到备份的阶段中断，原集合仍然完整
+            print(f"♻️ 备份集合不完整 ({backup_points}/{source_points})，重新备份")
+            client.delete_collection(backup)
+        else:
+            print(f"♻️ 发现上次未完成的迁移，从备份集合 {backup} ({backup_points} 个点) 继续")
+
+    if not client.collection_exists(backup):
+        if not client.collection_exists(collection_name):
+            raise RuntimeError(f"集合 {collection_name} 不存在")
+        layout = collection_layout(client, collection_name)
+        print(f"📦 当前布局: {layout}")
+        create_collection(client, backup, layout["dim"], quantization="none", on_disk=True)
+        copied = copy_points(client, collection_name, backup, batch_size)
+        if copied != layout["points"]:
+            raise RuntimeError(f"备份点数不一致 ({copied} != {layout['points']})，原集合未改动")
+
+    expected = client.count(backup, exact=True).count
+    dim = collection_layout(client, backup)["dim"]
+    if client.collection_exists(collection_name):
+        client.delete_collection(collection_name)
+    forget_collection(collection_name)
+    create_collection(client, collection_name, dim, quantization=quantization, on_disk=on_disk)
+    copied = copy_points(client, backup, collection_name, batch_size)
+    actual = client.count(collection_name, exact=True).count
+    if copied != expected or actual != expected:
+        raise RuntimeError(f"迁移后点数不一致 ({actual} != {expected})，备份集合 {backup} 已保留")
+
+    if QDRANT_MODE == "server":
+        ensure_payload_indexes(client, collection_name)
+    if not keep_backup:
+        client.delete_collection(backup)
+
+    # 让各进程的检索器重建
+    from modules.database import init_db, bump_collection_generation
+    init_db()
+    bump_collection_generation()
+    print(f"✅ 迁移完成: {collection_name} {actual} 个点，量化={quantization}，on_disk={on_disk}，耗时 {time.time() - t0:.1f}s")
+    return collection_layout(client, collection_name)
+
+# --- 检索过滤条件 ---
+# 过滤条件统一用 dict 表示 (前端选择 / 从问题里解析出来的都一样)：
+#   {"doc_types": [...], "filenames": [...], "keywords": [...], "date_from": "YYYY-MM-DD", "date_to": "YYYY-MM-DD"}
+
+_LIST_KEYS = ("doc_types", "filenames", "keywords")
+_FIELDS = {"doc_types": "doc_type", "filenames": "filename", "keywords": "keywords"}
+
+def normalize_filters(filters):
+    """去掉空条件，没有任何条件时返回 None"""
+    if not filters:
+        return None
+    result = {}
+    for key in _LIST_KEYS:
+        values = sorted({str(v).strip() for v in filters.get(key) or [] if str(v).strip()})
+        if values:
+            result[key] = values
+    for key in ("date_from", "date_to"):
+        if filters.get(key):
+            result[key] = str(filters[key])[:10]
+    return result or None
+
+def describe_filters(filters):
+    """日志 / 前端提示用的简短描述"""
+    if not filters:
+        return ""
+    parts = [f"{key}={','.join(filters[key])}" for key in _LIST_KEYS if key in filters]
+    if "date_from" in filters or "date_to" in filters:
+        parts.append(f"date={filters.get('date_from', '')}~{filters.get('date_to', '')}")
+    return " ".join(parts)
+
+def filters_key(filters):
+    return json.dumps(filters or {}, sort_keys=True, ensure_ascii=False)
+
+def build_qdrant_filter(filters):
+    """转换成 Qdrant Filter，在向量检索内部完成过滤 (配合 payload 索引)"""
+    if not filters:
+        return None
+    must = [
+        models.FieldCondition(key=_FIELDS[key], match=models.MatchAny(any=filters[key]))
+        for key in _LIST_KEYS if key in filters
+    ]
+    if "date_from" in filters or "date_to" in filters:
+        must.append(models.FieldCondition(
+            key="doc_date",
+            range=models.DatetimeRange(gte=filters.get("date_from"), lte=filters.get("date_to")),
+        ))
+    return models.Filter(must=must)
+
+_YEAR_MONTH_RE = re.compile(r"((?:19|20)\d{2})\s*(?:年|-|/)\s*(\d{1,2})\s*月?")
+_YEAR_RE = re.compile(r"((?:19|20)\d{2})\s*年")
+
+def _mentions(question, name):
+    """name 作为完整的词出现在问题里 (前后不能紧挨字母数字，"a.pdf" 不会匹配 "data.pdf")，忽略大小写"""
+    pattern = r"(?<![0-9A-Za-z_])" + re.escape(name) + r"(?![0-9A-Za-z_])"
+    return re.search(pattern, question, re.IGNORECASE) is not None
+
+def _mentions_file(question, filename, min_stem=QUERY_FILENAME_MIN_STEM):
+    if _mentions(question, filename):
+        return True
+    stem = filename.rsplit(".", 1)[0]
+    return stem != filename and len(stem) >= min_stem and _mentions(question, stem)
+
+def parse_query_filters(question, doc_types=(), filenames=()):
+    """
+    从问题里识别明确的筛选条件：
+    - 提到的文件名 (完整文件名，或足够长的去掉扩展名的文件名，都要按整词出现)
+    - 已有的文档类型名称
+    - 年份 / 年月 ("2024年", "2024年3月", "2024-03")，按文档日期过滤
+    """
+    filters = {}
+    names = [f for f in filenames if _mentions_file(question, f)]
+    if names:
+        filters["filenames"] = names
+    types = [t for t in doc_types if t and t != "General" and t in question]
+    if types:
+        filters["doc_types"] = types
+
+    m = _YEAR_MONTH_RE.search(question)
+    if m and 1 <= int(m.group(2)) <= 12:
+        year, month = int(m.group(1)), int(m.group(2))
+        last_day = calendar.monthrange(year, month)[1]
+        filters["date_from"] = f"{year:04d}-{month:02d}-01"
+        filters["date_to"] = f"{year:04d}-{month:02d}-{last_day:02d}"
+    else:
+        m = _YEAR_RE.search(question)
+        if m:
+            filters["date_from"] = f"{m.group(1)}-01-01"
+            filters["date_to"] = f"{m.group(1)}-12-31"
+    return normalize_filters(filters)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="向量库集合管理")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("info", help="查看集合布局")
+    serve = sub.add_parser("serve", help="在本机运行 Qdrant 服务 (多进程访问)，就绪后设置 QDRANT_URL (QDRANT_MODE=server)")
+    serve.add_argument("--binary", default=QDRANT_BINARY)
+    serve.add_argument("--storage", default=QDRANT_SERVER_STORAGE)
+    serve.add_argument("--port", type=int, default=6333)
+    serve.add_argument("--grpc-port", type=int, default=QDRANT_GRPC_PORT)
+    migrate = sub.add_parser("migrate", help="离线把集合重建成新布局 (嵌入模式需先停掉前端和入库 worker)")
+    migrate.add_argument("--quantization", choices=QUANTIZATION_KINDS, default=QDRANT_QUANTIZATION)
+    migrate.add_argument("--on-disk", type=int, choices=(0, 1), default=int(QDRANT_VECTORS_ON_DISK), help="原始向量是否放磁盘")
+    migrate.add_argument("--batch-size", type=int, default=256)
+    migrate.add_argument("--keep-backup", action="store_true", help="完成后保留备份集合")
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        serve_local(args.binary, args.storage, args.port, args.grpc_port)
+        raise SystemExit(0)
+
+    from modules.ingestion import get_client, COLLECTION_NAME
+
+    client = get_client()
+    if args.command == "info":
+        print(collection_layout(client, COLLECTION_NAME))
+    else:
+        migrate_collection(client, COLLECTION_NAME, quantization=args.quantization, on_disk=bool(args.on_disk),
+                           batch_size=args.batch_size, keep_backup=args.keep_backup)
@@ -0,0 +1,75 @@
+# --- START OF FILE warmup.py ---
+# 后台预热：登录后在独立线程里提前导入重依赖、加载模型，第一次问答 / 入库不用再等冷启动
+
+import time
+import threading
+
+from config import WARMUP_TARGETS, INGEST_WORKER_MODE
+from modules.telemetry import span
+
+
+def _warm_reranker():
+    from modules.rag_engine import warm_up_reranker
+    warm_up_reranker()
+
+
+def _warm_retriever():
+    from modules.rag_engine import get_retriever_engine
+    get_retriever_engine()
+
+
+def _warm_parser():
+    # 启动解析进程池，各子进程加载 Docling 模型和分词器
+    from modules.pipeline import get_pipeline
+    get_pipeline().warm_up()
+
+
+TARGETS = {
+    "reranker": _warm_reranker,
+    "retriever": _warm_retriever,
+    "parser": _warm_parser,
+}
+
+_lock = threading.Lock()
+_status = {}  # {组件: "排队" / "进行中" / "完成 (x.xs)" / "失败: ..."}
+_thread = None
+
+
+def run_warmup(targets):
+    """依次预热，单个组件失败不影响其他组件 (真正用到时会再按原路径加载并报错)"""
+    for name in targets:
+        _status[name] = "进行中"
+        t0 = time.perf_counter()
+        try:
+            with span(f"warmup.{name}"):
+                TARGETS[name]()
+            _status[name] = f"完成 ({time.perf_counter() - t0:.1f}s)"
+        except Exception as e:
+            _status[name] = f"失败: {e}"
+            print(f"⚠️ 预热 {name} 失败: {e}")
+    print(f"🔥 预热结束: {_status}")
+
+
+def start_warmup(targets=None):
+    """每个进程只启动一次；process 模式下解析在独立 worker 进程里，前端不预热 Docling"""
+    global _thread
+    targets = list(WARMUP_TARGETS if targets is None else targets)
+    if INGEST_WORKER_MODE != "thread" and "parser" in targets:
+        targets.remove("parser")
+    unknown = [t for t in targets if t not in TARGETS]
+    if unknown:
+        print(f"⚠️ 未知的预热组件: {unknown}")
+    targets = [t for t in targets if t in TARGETS]
+
+    with _lock:
+        if _thread is not None or not targets:
+            return _thread
+        for name in targets:
+            _status[name] = "排队"
+        _thread = threading.Thread(target=run_warmup, args=(targets,), daemon=True, name="warmup")
+        _thread.start()
+    return _thread
+
+
+def warmup_status():
+    return dict(_status)
@@ -0,0 +1,217 @@
+# --- START OF FILE worker.py ---
+"""
+后台入库 worker：从 jobs 表领取任务，执行 process_single_file。
+
+两种运行方式：
+- thread：前端进程内起若干后台线程 (start_background_workers)，适用于本地 Qdrant 目录模式；
+  解析交给共用的解析进程池，其余阶段在线程里执行 (见 modules/pipeline.py)
+- process：独立运行 `python -m modules.worker --workers 4`，多进程并行 (需要 QDRANT_MODE=server，见 python -m modules.vector_store serve)
+任务状态都在 SQLite 里，前端只负责提交任务和轮询进度，刷新页面不会中断入库。
+"""
+
+import os
+import time
+import socket
+import argparse
+import threading
+import traceback
+import multiprocessing
+
+from config import (
+    INGEST_WORKERS,
+    QDRANT_MODE,
+    JOB_RETRY_BASE_SECONDS,
+    JOB_RETRY_MAX_SECONDS,
+    JOB_HEARTBEAT_TIMEOUT,
+    JOB_POLL_INTERVAL,
+    JOB_MAX_ATTEMPTS,
+)
+from modules.database import (
+    init_db, claim_job, touch_job, finish_job, retry_job, recover_stale_jobs,
+    find_orphan_documents, enqueue_jobs, update_document_failed,
+)
+
+# 心跳间隔：超时阈值的 1/5，长时间的解析阶段里也能及时续约
+_HEARTBEAT_INTERVAL = max(JOB_HEARTBEAT_TIMEOUT / 5, 1.0)
+
+
+def retry_delay(attempts):
+    """第 attempts 次失败后的等待秒数 (指数退避，有上限)"""
+    return min(JOB_RETRY_BASE_SECONDS * 2 ** max(attempts - 1, 0), JOB_RETRY_MAX_SECONDS)
+
+
+def recover():
+    """崩溃恢复：回收心跳超时的任务，给停在 processing 的孤儿文档补提交任务"""
+    stale = recover_stale_jobs(JOB_HEARTBEAT_TIMEOUT)
+    if stale:
+        print(f"♻️ 回收 {stale} 个中断的任务")
+
+    orphans = find_orphan_documents()
+    requeue = [(d["filename"], d["file_path"]) for d in orphans if d["file_path"] and os.path.exists(d["file_path"])]
+    for d in orphans:
+        if (d["filename"], d["file_path"]) not in requeue:
+            update_document_failed(d["filename"], "处理中断，源文件已不存在")
+    if requeue:
+        enqueue_jobs(requeue, max_attempts=JOB_MAX_ATTEMPTS)
+        print(f"♻️ {len(requeue)} 个中断的文档已重新排队")
+
+
+class IngestionWorker:
+    """单个 worker：循环领取任务并执行，直到 stop_event 被设置"""
+
+    def __init__(self, worker_id, stop_event=None):
+        self.worker_id = worker_id
+        self.stop_event = stop_event or threading.Event()
+
+    def run_forever(self):
+        print(f"👷 入库 worker 启动: {self.worker_id}")
+        while not self.stop_event.is_set():
+            try:
+                if not self.run_once():
+                    self.stop_event.wait(JOB_POLL_INTERVAL)
+            except Exception:
+                # 数据库暂时不可用等情况：记录后稍等再试，worker 不退出
+                traceback.print_exc()
+                self.stop_event.wait(JOB_POLL_INTERVAL * 5)
+
+    def run_once(self):
+        """领取并执行一个任务；队列为空返回 False"""
+        job = claim_job(self.worker_id)
+        if job is None:
+            return False
+        self.execute(job)
+        return True
+
+    def execute(self, job):
+        from modules.ingestion import process_single_file, is_retryable, IngestionCancelled
+
+        job_id = job["id"]
+        last_beat = [0.0]
+
+        def on_stage(name):
+            if touch_job(job_id, progress=name):
+                raise IngestionCancelled()
+            last_beat[0] = time.time()
+
+        # 阶段内部可能很久 (大文件解析)，单独的心跳线程保证不被误判为崩溃
+        done = threading.Event()
+
+        def heartbeat():
+            while not done.wait(_HEARTBEAT_INTERVAL):
+                if time.time() - last_beat[0] >= _HEARTBEAT_INTERVAL:
+                    try:
+                        touch_job(job_id)
+                    except Exception as e:
+                        print(f"⚠️ 任务心跳失败: {e}")
+
+        beat_thread = threading.Thread(target=heartbeat, daemon=True)
+        beat_thread.start()
+        print(f"📥 [{self.worker_id}] 任务 #{job_id} {job['filename']} (第 {job['attempts']} 次)")
+        try:
+            if not os.path.exists(job["file_path"]):
+                ok, msg, pages = False, "源文件不存在", 0
+            else:
+                ok, msg, pages = process_single_file(job["file_path"], on_stage=on_stage)
+        except Exception as e:
+            traceback.print_exc()
+            ok, msg, pages = False, f"处理失败: {e}", 0
+        finally:
+            done.set()
+            beat_thread.join()
+
+        if ok:
+            finish_job(job_id, "completed", msg, pages)
+        elif msg == "已取消":
+            finish_job(job_id, "cancelled", msg)
+        elif not is_retryable(msg) or job["attempts"] >= job["max_attempts"]:
+            # 文件本身的问题 (解析为空、格式不支持、损坏) 重试也一样，直接判为失败
+            finish_job(job_id, "failed", msg)
+        else:
+            delay = retry_delay(job["attempts"])
+            print(f"🔁 任务 #{job_id} 失败，{delay:.0f}s 后重试: {msg}")
+            retry_job(job_id, msg, delay)
+
+
+def _worker_name(index):
+    return f"{socket.gethostname()}:{os.getpid()}:{index}"
+
+
+# --- thread 模式：在前端进程里运行 ---
+
+def start_background_workers(count=INGEST_WORKERS):
+    """启动 count 个后台线程 + 一个维护线程 (崩溃恢复)，返回 stop_event"""
+    init_db()
+    stop_event = threading.Event()
+    recover()
+    for i in range(count):
+        worker = IngestionWorker(_worker_name(i), stop_event)
+        threading.Thread(target=worker.run_forever, daemon=True, name=f"ingest-worker-{i}").start()
+    threading.Thread(target=_maintenance_loop, args=(stop_event,), daemon=True, name="ingest-maintenance").start()
+    return stop_event
+
+
+def _maintenance_loop(stop_event):
+    while not stop_event.wait(JOB_HEARTBEAT_TIMEOUT / 2):
+        try:
+            recover()
+        except Exception as e:
+            print(f"⚠️ 任务恢复失败: {e}")
+
+
+# --- process 模式：独立进程池 ---
+
+def _worker_process(index):
+    from dotenv import load_dotenv
+    from config import init_settings
+    from modules.telemetry import start_exporter
+    from modules.pipeline import configure_pipeline
+
+    load_dotenv()
+    init_db()
+    init_settings()
+    # 每个 worker 进程同一时间只处理一个文件，进程本身就是解析的并行单位，不再开解析子进程
+    configure_pipeline(parse_workers=0)
+    # 多个 worker 进程不能共用一个端口，只写指标文件 (METRICS_FILE 里用 {pid} 区分)
+    start_exporter(port=0)
+    IngestionWorker(_worker_name(index)).run_forever()
+
+
+def run_process_pool(count):
+    """主进程只做监督：定期崩溃恢复，子进程意外退出后自动补上"""
+    init_db()
+    recover()
+    ctx = multiprocessing.get_context("spawn")
+    procs = {}
+    last_recover = time.time()
+    try:
+        while True:
+            for i in range(count):
+                p = procs.get(i)
+                if p is None or not p.is_alive():
+                    if p is not None:
+                        print(f"⚠️ worker {i} 已退出 (exit={p.exitcode})，重新启动")
+                    p = ctx.Process(target=_worker_process, args=(i,), daemon=True)
+                    p.start()
+                    procs[i] = p
+            time.sleep(5)
+            if time.time() - last_recover >= JOB_HEARTBEAT_TIMEOUT / 2:
+                recover()
+                last_recover = time.time()
+    except KeyboardInterrupt:
+        print("🛑 停止入库 worker ...")
+    finally:
+        for p in procs.values():
+            p.terminate()
+        for p in procs.values():
+            p.join()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="后台入库 worker")
+    parser.add_argument("--workers", type=int, default=INGEST_WORKERS, help="worker 进程数")
+    args = parser.parse_args()
+    if QDRANT_MODE != "server":
+        # 嵌入模式的目录锁只允许一个进程，内存模式各进程的数据互不可见
+        raise SystemExit(f"❌ 多进程入库需要 Qdrant 服务 (当前 QDRANT_MODE={QDRANT_MODE})：设置 QDRANT_URL (QDRANT_MODE=server)，"
+                         f"或用 thread 模式 (INGEST_WORKER_MODE=thread) 在前端进程内入库")
+    run_process_pool(args.workers)
@@ -0,0 +1,20 @@
+# --- START OF FILE conftest.py ---
+# 离线单元测试：不联网、不需要 API Key，模型用 benchmarks/fakes.py 里的假实现
+# 运行: python -m pytest -q (在仓库根目录)
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def corpus_db(tmp_path, monkeypatch):
+    """每个测试一个独立的 corpus.db (已执行全部迁移)"""
+    from modules import database
+
+    monkeypatch.setattr(database, "DB_PATH", str(tmp_path / "corpus.db"))
+    database.init_db()
+    return database
@@ -0,0 +1,49 @@
+# --- START OF FILE test_answer_cache.py ---
+
+from modules.answer_cache import SemanticAnswerCache, make_scope
+
+DOCS = ["a.pdf", "b.pdf", "c.pdf"]
+VEC = [1.0, 0.0, 0.0]
+
+
+def scope(generation, filenames=None):
+    return make_scope(generation, DOCS, "", filenames=filenames)
+
+
+def fill(cache, generation):
+    cache.put("a 的内容", VEC, scope(generation, ["a.pdf"]), "答案 a")
+    cache.put("b 的内容", VEC, scope(generation, ["b.pdf"]), "答案 b")
+    cache.put("全部文档", VEC, scope(generation), "答案 all")
+
+
+def test_bump_evicts_only_entries_touching_changed_files(corpus_db):
+    cache = SemanticAnswerCache(ttl_seconds=0, changes_since=corpus_db.get_generation_changes)
+    generation = corpus_db.get_collection_generation()
+    fill(cache, generation)
+
+    corpus_db.bump_collection_generation(["a.pdf"])
+    corpus_db.bump_collection_generation(["c.pdf"])
+    generation = corpus_db.get_collection_generation()
+
+    assert cache.lookup_exact("b 的内容", scope(generation, ["b.pdf"]))["answer"] == "答案 b"
+    assert cache.lookup_exact("a 的内容", scope(generation, ["a.pdf"])) is None
+    assert cache.lookup_exact("全部文档", scope(generation)) is None
+    assert cache.stats()["invalidations"] == 2
+
+
+def test_whole_library_change_clears_everything(corpus_db):
+    cache = SemanticAnswerCache(ttl_seconds=0, changes_since=corpus_db.get_generation_changes)
+    fill(cache, corpus_db.get_collection_generation())
+
+    corpus_db.bump_collection_generation()  # 快照导入 / 集合迁移
+    generation = corpus_db.get_collection_generation()
+
+    assert cache.lookup_exact("b 的内容", scope(generation, ["b.pdf"])) is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_answer_from_an_older_generation_is_not_cached():
+    cache = SemanticAnswerCache(ttl_seconds=0, changes_since=lambda since: set())
+    cache.lookup_exact("任意", scope(6))
+    cache.put("a 的内容", VEC, scope(5, ["a.pdf"]), "旧答案")
+    assert cache.stats()["entries"] == 0
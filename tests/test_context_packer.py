@@ -0,0 +1,86 @@
+# --- START OF FILE test_context_packer.py ---
+
+import io
+
+from PIL import Image
+from llama_index.core.schema import ImageDocument, NodeWithScore, TextNode
+
+from modules.context_packer import (
+    estimate_tokens, image_tokens, rank_pages, pack_context, DEFAULT_IMAGE_TOKENS, IMAGE_TILE_TOKENS,
+)
+
+
+def node(text, page, score, file_name="a.pdf"):
+    meta = {"file_name": file_name, "page_start": page, "page_end": page, "page_label": str(page)}
+    return NodeWithScore(node=TextNode(text=text, metadata=meta), score=score)
+
+
+def png(width, height):
+    buf = io.BytesIO()
+    Image.new("RGB", (width, height), "white").save(buf, format="PNG")
+    return ImageDocument(image=buf.getvalue(), image_mimetype="image/png")
+
+
+def test_estimate_tokens():
+    assert estimate_tokens("") == 0
+    assert estimate_tokens("设备维护") == 4
+    assert estimate_tokens("abcdefgh") == 2
+    assert estimate_tokens("电压 220V") == 2 + 2
+
+
+def test_image_tokens_by_tile():
+    assert image_tokens(png(300, 300)) == IMAGE_TILE_TOKENS
+    assert image_tokens(png(1240, 1754)) == 2 * 3 * IMAGE_TILE_TOKENS
+    assert image_tokens(ImageDocument(image=b"not an image")) == DEFAULT_IMAGE_TOKENS
+
+
+def test_rank_pages_by_best_score():
+    nodes = [node("x", 1, 0.2), node("y", 3, 0.9), node("z", 1, 0.5), node("w", 2, 0.9, "b.pdf")]
+    # 同分时保持相关度顺序
+    assert rank_pages(nodes, max_images=3) == [("a.pdf", 2), ("b.pdf", 1), ("a.pdf", 0)]
+
+
+def test_duplicates_are_dropped():
+    text = "变压器额定电压为 220V，额定功率 10kW，适用于室内安装。" * 3
+    nodes = [node(text, 1, 0.9), node(text + "补充", 2, 0.8), node("完全不同的另一段内容，关于维护周期。", 3, 0.5)]
+    context, _, _, used, stats = pack_context(nodes, [], [], budget=2000)
+    assert stats["duplicates"] == 1
+    assert [n.score for n in used] == [0.9, 0.5]
+    assert context.count("--- 文档: a.pdf") == 2
+
+
+def test_pages_attached_as_images_skip_their_text():
+    nodes = [node("第一页正文" * 10, 1, 0.9), node("第二页正文" * 10, 2, 0.8)]
+    context, images, pages, used, stats = pack_context(nodes, [png(300, 300)], [("a.pdf", 0)], budget=2000)
+    assert stats["covered"] == 1
+    assert "第一页正文" not in context and "第二页正文" in context
+    # 被附图覆盖的片段仍然算作来源
+    assert len(used) == 2
+    assert pages == [("a.pdf", 0)] and len(images) == 1
+
+
+def test_budget_truncates_and_drops():
+    nodes = [node("甲" * 300, 1, 0.9), node("乙" * 300, 2, 0.8), node("丙" * 300, 3, 0.7)]
+    context, _, _, used, stats = pack_context(nodes, [], [], budget=500)
+    assert stats["total_tokens"] <= 500
+    assert stats["truncated"] == 1 and stats["over_budget"] == 1
+    assert "甲" * 300 in context and "丙" not in context
+    assert len(used) == 2
+
+
+def test_images_over_their_share_are_dropped():
+    images = [png(1240, 1754), png(1240, 1754)]
+    pages = [("a.pdf", 0), ("a.pdf", 1)]
+    _, kept, kept_pages, _, stats = pack_context([], images, pages, budget=4000, image_ratio=0.5)
+    # 每张约 1548 token，预算的一半只放得下一张
+    assert kept_pages == [("a.pdf", 0)] and len(kept) == 1
+    assert stats["image_tokens"] == 6 * IMAGE_TILE_TOKENS
+
+
+def test_higher_scores_win_the_budget():
+    nodes = [node("低分" * 200, 1, 0.1), node("高分" * 200, 2, 0.9)]
+    context, _, _, used, stats = pack_context(nodes, [], [], budget=600)
+    assert context.startswith("--- 文档: a.pdf [第 2 页]")
+    assert stats["truncated"] == 1
+    # 来源仍按传入 (相关度) 顺序排列
+    assert [n.score for n in used] == [0.1, 0.9]
@@ -0,0 +1,84 @@
+# --- START OF FILE test_embed_cache.py ---
+
+import types
+
+from benchmarks.fakes import FakeEmbedding
+from modules import embed_cache
+from modules.embed_cache import CachedEmbedding, EmbeddingCacheStore, text_key
+
+
+class CountingEmbedding(FakeEmbedding):
+    """记录每次交给底层模型的文本"""
+
+    seen: list = []
+
+    def _call(self, texts):
+        self.seen.append(list(texts))
+        return super()._call(texts)
+
+
+def make_model(tmp_path, max_entries=1000):
+    store = EmbeddingCacheStore(str(tmp_path / "embed_cache.db"), max_entries)
+    inner = CountingEmbedding(seen=[])
+    return CachedEmbedding(inner, store), inner, store
+
+
+def test_miss_then_hit(tmp_path):
+    model, inner, store = make_model(tmp_path)
+    texts = ["设备维护", "voltage 220V", "设备维护"]
+
+    first = model.get_text_embedding_batch(texts)
+    # 同一批里重复的文本只算一次
+    assert inner.seen == [["设备维护", "voltage 220V"]]
+    assert first[0] == first[2]
+
+    second = model.get_text_embedding_batch(texts)
+    assert len(inner.seen) == 1
+    assert second == first
+    assert store.stats()["hits"] == 3
+    assert store.stats()["misses"] == 3
+
+
+def test_whitespace_variants_share_an_entry(tmp_path):
+    model, inner, _ = make_model(tmp_path)
+    model.get_text_embedding_batch(["voltage  220V\n"])
+    model.get_text_embedding_batch(["voltage 220V"])
+    assert len(inner.seen) == 1
+
+
+def test_query_and_text_vectors_are_cached_separately(tmp_path):
+    model, inner, _ = make_model(tmp_path)
+    model.get_text_embedding("合同金额")
+    model.get_query_embedding("合同金额")
+    assert len(inner.seen) == 2
+    model.get_query_embedding("合同金额")
+    assert len(inner.seen) == 2
+
+
+def test_lru_eviction_keeps_recently_used(tmp_path, monkeypatch):
+    clock = iter(range(1, 100))
+    monkeypatch.setattr(embed_cache, "time", types.SimpleNamespace(time=lambda: next(clock)))
+    store = EmbeddingCacheStore(str(tmp_path / "embed_cache.db"), max_entries=10)
+    keys = [text_key(f"t{i}") for i in range(11)]
+    for key in keys[:10]:
+        store.put_many("m", [(key, [0.1, 0.2])])
+
+    # 访问最早写入的一条，它就不再是最久未用的
+    assert keys[0] in store.get_many("m", [keys[0]])
+    store.put_many("m", [(keys[10], [0.3, 0.4])])
+
+    # 超过上限后淘汰到 90%：最久未访问的 t1、t2 被删掉
+    found = store.get_many("m", keys)
+    assert store.stats()["entries"] == 9
+    assert keys[1] not in found and keys[2] not in found
+    assert keys[0] in found and keys[10] in found
+
+
+def test_cache_survives_reopen(tmp_path):
+    model, inner, store = make_model(tmp_path)
+    vector = model.get_text_embedding("持久化")
+    store._conn.close()
+
+    reopened, inner2, _ = make_model(tmp_path)
+    assert reopened.get_text_embedding("持久化") == vector
+    assert inner2.seen == []
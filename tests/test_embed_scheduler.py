@@ -0,0 +1,196 @@
+# --- START OF FILE test_embed_scheduler.py ---
+
+import time
+import types
+import threading
+
+import pytest
+
+from benchmarks.fakes import FakeEmbedding, RateLimitError
+from modules import embed_scheduler
+from modules.embed_cache import CachedEmbedding, EmbeddingCacheStore
+from modules.embed_scheduler import EmbeddingScheduler, PartialEmbeddingError, TokenBucket
+
+
+class ScriptedEmbedding(FakeEmbedding):
+    """记录每次请求的批大小；fail(texts) 返回异常时这次请求失败"""
+
+    batches: list = []
+    fail: object = None
+
+    def _call(self, texts):
+        error = self.fail(texts) if self.fail else None
+        if error is not None:
+            raise error
+        self.batches.append(list(texts))
+        return super()._call(texts)
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    """退避不真的等待，只记录等待时长"""
+    recorded = []
+    fake_time = types.SimpleNamespace(monotonic=time.monotonic, sleep=recorded.append)
+    monkeypatch.setattr(embed_scheduler, "time", fake_time)
+    return recorded
+
+
+def test_splits_by_batch_size():
+    inner = ScriptedEmbedding(batches=[])
+    scheduler = EmbeddingScheduler(inner, max_batch_size=4, linger_ms=50)
+    vectors = scheduler.get_text_embedding_batch([f"t{i}" for i in range(10)])
+    assert [len(b) for b in inner.batches] == [4, 4, 2]
+    assert vectors == FakeEmbedding()._call([f"t{i}" for i in range(10)])
+
+
+def test_merges_concurrent_callers_into_one_batch():
+    inner = ScriptedEmbedding(batches=[])
+    scheduler = EmbeddingScheduler(inner, max_batch_size=100, linger_ms=300)
+    barrier = threading.Barrier(2)
+    results = {}
+
+    def ingest(name):
+        barrier.wait()
+        results[name] = scheduler.get_text_embedding_batch([f"{name}-{i}" for i in range(3)])
+
+    threads = [threading.Thread(target=ingest, args=(name,)) for name in ("a", "b")]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert [len(b) for b in inner.batches] == [6]
+    # 结果按各自调用方的顺序返回
+    assert results["a"] == FakeEmbedding()._call([f"a-{i}" for i in range(3)])
+    assert scheduler.stats()["requests"] == 1
+
+
+def test_token_limit_starts_a_new_batch():
+    inner = ScriptedEmbedding(batches=[])
+    scheduler = EmbeddingScheduler(inner, max_batch_size=100, max_batch_tokens=10, linger_ms=50)
+    scheduler.get_text_embedding_batch(["x" * 15, "y" * 15, "z" * 15])
+    assert [len(b) for b in inner.batches] == [2, 1]
+
+
+def test_rate_limit_backs_off_and_retries(sleeps):
+    attempts = []
+
+    def fail(texts):
+        attempts.append(texts)
+        return RateLimitError("429 RESOURCE_EXHAUSTED") if len(attempts) <= 2 else None
+
+    inner = ScriptedEmbedding(batches=[], fail=fail)
+    scheduler = EmbeddingScheduler(inner, max_batch_size=10, max_retries=3, linger_ms=10)
+    assert len(scheduler.get_text_embedding_batch(["a", "b"])) == 2
+
+    stats = scheduler.stats()
+    assert stats["throttled"] == 2 and stats["retries"] == 2
+    # 指数退避：第二次的等待区间 [0.5, 1.5) 在第一次 [0.25, 0.75) 之后翻倍
+    assert len(sleeps) == 2
+    assert 0.25 <= sleeps[0] < 0.75 and 0.5 <= sleeps[1] < 1.5
+
+
+def test_gives_up_after_max_retries(sleeps):
+    inner = ScriptedEmbedding(batches=[], fail=lambda texts: ValueError("bad request"))
+    scheduler = EmbeddingScheduler(inner, max_batch_size=10, max_retries=2, linger_ms=10)
+    with pytest.raises(PartialEmbeddingError) as info:
+        scheduler.get_text_embedding_batch(["a"])
+    assert isinstance(info.value.error, ValueError)
+    assert len(sleeps) == 2
+    assert scheduler.stats()["failed_batches"] == 1
+
+
+def test_token_bucket_throttles_and_recovers():
+    bucket = TokenBucket(600)
+    bucket.throttle()
+    assert bucket.rate == pytest.approx(5.0)
+    for _ in range(10):
+        bucket.throttle()
+    # 不低于配置速率的 10%
+    assert bucket.rate == pytest.approx(1.0)
+    for _ in range(100):
+        bucket.recover()
+    assert bucket.rate == pytest.approx(10.0)
+
+
+def test_partial_progress_is_cached_and_resumed(tmp_path, sleeps):
+    broken = {"on": True}
+
+    def fail(texts):
+        return ValueError("boom") if broken["on"] and "bad" in texts else None
+
+    inner = ScriptedEmbedding(batches=[], fail=fail)
+    scheduler = EmbeddingScheduler(inner, max_batch_size=2, max_retries=0, linger_ms=50)
+    model = CachedEmbedding(scheduler, EmbeddingCacheStore(str(tmp_path / "embed_cache.db")))
+    texts = ["a", "b", "bad", "c"]
+
+    with pytest.raises(PartialEmbeddingError) as info:
+        model.get_text_embedding_batch(texts)
+    assert [r is not None for r in info.value.results] == [True, True, False, False]
+
+    # 重试时只补算上次失败的那一批
+    broken["on"] = False
+    inner.batches.clear()
+    vectors = model.get_text_embedding_batch(texts)
+    assert inner.batches == [["bad", "c"]]
+    assert len(vectors) == 4
+
+
+def test_cache_hits_skip_the_scheduler(tmp_path):
+    inner = ScriptedEmbedding(batches=[])
+    scheduler = EmbeddingScheduler(inner, max_batch_size=10, linger_ms=10)
+    model = CachedEmbedding(scheduler, EmbeddingCacheStore(str(tmp_path / "embed_cache.db")))
+    model.get_text_embedding_batch(["a", "b"])
+    model.get_text_embedding_batch(["a", "b"])
+    model.get_query_embedding("q")
+    model.get_query_embedding("q")
+    # 命中缓存的文本不进队列、不占限流额度
+    assert scheduler.stats()["requests"] == 2
+    assert scheduler.stats()["texts"] == 3
+
+
+def test_one_scheduler_batch_is_one_api_call():
+    # 内层模型默认 embed_batch_size=10，调度器的一批不能被它再切开
+    inner = ScriptedEmbedding(batches=[])
+    scheduler = EmbeddingScheduler(inner, max_batch_size=50, linger_ms=10)
+    scheduler.get_text_embedding_batch([f"t{i}" for i in range(30)])
+    assert [len(b) for b in inner.batches] == [30]
+    assert inner.calls == 1 and scheduler.stats()["requests"] == 1
+
+
+def test_bad_text_only_fails_its_own_caller(sleeps):
+    inner = ScriptedEmbedding(batches=[], fail=lambda texts: ValueError("invalid input") if "bad" in texts else None)
+    scheduler = EmbeddingScheduler(inner, max_batch_size=100, max_retries=1, linger_ms=300)
+    barrier = threading.Barrier(2)
+    results = {}
+
+    def ingest(name, texts):
+        barrier.wait()
+        try:
+            results[name] = scheduler.get_text_embedding_batch(texts)
+        except PartialEmbeddingError as e:
+            results[name] = e
+
+    threads = [
+        threading.Thread(target=ingest, args=("ok", ["a", "b", "c"])),
+        threading.Thread(target=ingest, args=("broken", ["d", "bad"])),
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    # 两个文件的文本进了同一批；拆开重试后，只有含 "bad" 的调用方失败
+    assert results["ok"] == FakeEmbedding()._call(["a", "b", "c"])
+    assert isinstance(results["broken"], PartialEmbeddingError)
+    assert [r is not None for r in results["broken"].results] == [True, False]
+    stats = scheduler.stats()
+    assert stats["split_batches"] >= 1 and stats["failed_batches"] == 1
+
+
+def test_rate_limited_batch_is_not_split(sleeps):
+    inner = ScriptedEmbedding(batches=[], fail=lambda texts: RateLimitError("429"))
+    scheduler = EmbeddingScheduler(inner, max_batch_size=10, max_retries=1, linger_ms=10)
+    with pytest.raises(PartialEmbeddingError):
+        scheduler.get_text_embedding_batch(["a", "b", "c"])
+    assert scheduler.stats()["split_batches"] == 0
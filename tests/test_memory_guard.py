@@ -0,0 +1,67 @@
+# --- START OF FILE test_memory_guard.py ---
+
+import pytest
+
+from modules import ingestion, memory_guard
+from modules.memory_guard import MemoryGuard
+
+
+@pytest.fixture
+def rss(monkeypatch):
+    """可控的进程 RSS (MB)"""
+    value = {"mb": 3000.0}
+    monkeypatch.setattr(memory_guard, "current_rss_mb", lambda: value["mb"])
+    return value
+
+
+def test_limit_applies_to_growth_not_resident_memory(rss):
+    # 进程里已经常驻 3 GB (前端、模型、缓存)，远超上限本身，但本文件没有增长
+    with MemoryGuard(limit_mb=500, interval=60) as guard:
+        assert guard.check(20) == 20
+        rss["mb"] = 3400
+        assert guard.check(20) == 20
+    assert guard.peak_growth_mb == 400
+
+
+def test_window_halves_then_aborts(rss):
+    with MemoryGuard(limit_mb=500, interval=60) as guard:
+        rss["mb"] = 3600
+        assert guard.check(20) == 10
+        assert guard.check(2) == 1
+        with pytest.raises(MemoryError):
+            guard.check(1)
+
+
+def test_subprocess_parse_memory_counts(rss):
+    with MemoryGuard(limit_mb=500, interval=60) as guard:
+        assert guard.check(8, external_mb=300) == 8
+        assert guard.check(8, external_mb=600) == 4
+
+
+def test_zero_limit_never_shrinks(rss):
+    with MemoryGuard(limit_mb=0, interval=60) as guard:
+        rss["mb"] = 10 ** 6
+        assert guard.check(20) == 20
+
+
+def test_page_windows_shrink_and_abort_under_memory_pressure(rss, monkeypatch):
+    windows = []
+
+    def fake_parse(file_path, page_range=None, seen=None):
+        windows.append(page_range)
+        # 每解析一个窗口，进程内存涨 300 MB (不释放)
+        rss["mb"] += 300
+        return [f"node-{page_range[0]}"], None, seen, 0.0
+
+    monkeypatch.setattr(ingestion, "pdf_page_count", lambda path: 100)
+    monkeypatch.setattr(ingestion, "parse_document", fake_parse)
+
+    produced = []
+    with MemoryGuard(limit_mb=1000, interval=60) as guard:
+        with pytest.raises(MemoryError):
+            for batch in ingestion.iter_chunk_batches("big.pdf", guard, window_pages=8, batch_size=1):
+                produced.extend(batch)
+
+    # 前三个窗口后增长 900 MB 仍在上限内；之后每个窗口减半，1 页还超出就放弃
+    assert windows == [(1, 8), (9, 16), (17, 24), (25, 32), (33, 36), (37, 38), (39, 39)]
+    assert produced == [f"node-{start}" for start, _ in windows]
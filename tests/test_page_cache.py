@@ -0,0 +1,60 @@
+# --- START OF FILE test_page_cache.py ---
+
+import io
+
+import fitz
+import pytest
+from PIL import Image
+
+from modules import page_cache
+from modules.page_cache import PageImageCache
+
+
+@pytest.fixture
+def pdf_path(tmp_path):
+    path = tmp_path / "a.pdf"
+    pdf = fitz.open()
+    for i in range(3):
+        pdf.new_page().insert_text((50, 80), f"page {i}")
+    pdf.save(str(path))
+    pdf.close()
+    return str(path)
+
+
+def make_cache(tmp_path, **kwargs):
+    return PageImageCache(str(tmp_path / "cache"), 64 * 1024 * 1024, **kwargs)
+
+
+@pytest.mark.parametrize("fmt", ["png", "jpeg"])
+def test_render_in_process(tmp_path, pdf_path, fmt):
+    cache = make_cache(tmp_path, fmt=fmt)
+    data = cache.get_page_image(pdf_path, 1, dpi=72)
+    img = Image.open(io.BytesIO(data))
+    assert img.format == fmt.upper() and img.size == (595, 842)
+    assert cache.get_page_image(pdf_path, 3, dpi=72) is None
+
+
+def test_png_is_encoded_outside_the_fitz_lock(tmp_path, pdf_path, monkeypatch):
+    held = []
+    encode = page_cache.encode_page
+
+    def checked_encode(*args, **kwargs):
+        held.append(page_cache.fitz_lock.locked())
+        return encode(*args, **kwargs)
+
+    monkeypatch.setattr(page_cache, "encode_page", checked_encode)
+    assert make_cache(tmp_path).get_page_image(pdf_path, 0, dpi=72)
+    assert held == [False]
+
+
+def test_render_in_subprocess_matches_in_process(tmp_path, pdf_path):
+    pooled = make_cache(tmp_path, processes=2)
+    try:
+        data = pooled.get_page_image(pdf_path, 2, dpi=72)
+        assert pooled.get_page_image(pdf_path, 5, dpi=72) is None
+    finally:
+        pooled.shutdown()
+    local = make_cache(tmp_path / "local")
+    assert data == local.get_page_image(pdf_path, 2, dpi=72)
+    # 渲染结果写进了磁盘缓存，换一个实例也能命中
+    assert make_cache(tmp_path).get_page_image(pdf_path, 2, dpi=72) == data
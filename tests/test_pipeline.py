@@ -0,0 +1,74 @@
+# --- START OF FILE test_pipeline.py ---
+
+import os
+import time
+import threading
+
+import pytest
+
+from modules.pipeline import IngestPipeline
+
+
+def test_stage_limits_concurrency_and_reports_queue_depth():
+    pipeline = IngestPipeline(parse_workers=0, embed_workers=2)
+    running, peak = [0], [0]
+    lock = threading.Lock()
+    release = threading.Event()
+
+    def embed():
+        with pipeline.stage("embed"):
+            with lock:
+                running[0] += 1
+                peak[0] = max(peak[0], running[0])
+            release.wait(5)
+            with lock:
+                running[0] -= 1
+
+    threads = [threading.Thread(target=embed) for _ in range(5)]
+    for t in threads:
+        t.start()
+    deadline = time.time() + 5
+    while pipeline.stats()["embed_queue_depth"] < 3 and time.time() < deadline:
+        time.sleep(0.01)
+
+    stats = pipeline.stats()
+    assert stats["embed_running"] == 2 and stats["embed_queue_depth"] == 3
+    release.set()
+    for t in threads:
+        t.join()
+
+    stats = pipeline.stats()
+    assert peak[0] == 2
+    assert stats["embed_processed"] == 5 and stats["embed_max_queue_depth"] == 3
+    assert stats["embed_queue_depth"] == 0 and stats["embed_throughput"] > 0
+
+
+def test_uncontended_stage_does_not_queue():
+    pipeline = IngestPipeline(parse_workers=0, metadata_workers=4)
+    with pipeline.stage("metadata"):
+        pass
+    assert pipeline.stats()["metadata_max_queue_depth"] == 0
+
+
+def test_failures_are_counted():
+    pipeline = IngestPipeline(parse_workers=0)
+    with pytest.raises(ValueError):
+        with pipeline.stage("upsert"):
+            raise ValueError("boom")
+    stats = pipeline.stats()
+    assert stats["upsert_failed"] == 1 and stats["upsert_processed"] == 0
+    assert stats["upsert_running"] == 0
+
+
+def test_parse_runs_in_the_calling_thread_without_a_pool():
+    pipeline = IngestPipeline(parse_workers=0)
+    assert pipeline.parse(os.getpid) == os.getpid()
+    assert pipeline.stats()["parse_processed"] == 1
+
+
+def test_parse_runs_in_a_subprocess():
+    pipeline = IngestPipeline(parse_workers=1)
+    try:
+        assert pipeline.parse(os.getpid) != os.getpid()
+    finally:
+        pipeline.shutdown()
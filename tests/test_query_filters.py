@@ -0,0 +1,54 @@
+# --- START OF FILE test_query_filters.py ---
+
+import pytest
+
+from modules.vector_store import parse_query_filters, normalize_filters, build_qdrant_filter, filters_key
+
+FILES = ["a.pdf", "report.pdf", "合同.pdf", "data.pdf", "HT-2024-001.pdf", "设备维护手册2023.pdf"]
+
+
+@pytest.mark.parametrize("question", [
+    "HT-2024-002 voltage?",          # a.pdf 的文件名 "a" 只是子串
+    "show the report summary",       # 常见词做文件名
+    "合同金额是多少",
+    "metadata.pdf 在哪里",           # data.pdf 只是后缀
+])
+def test_short_or_partial_names_do_not_filter(question):
+    assert parse_query_filters(question, filenames=FILES) is None
+
+
+@pytest.mark.parametrize("question, expected", [
+    ("a.pdf 里的电压", ["a.pdf"]),
+    ("Report.PDF 的结论", ["report.pdf"]),
+    ("HT-2024-001 的金额", ["HT-2024-001.pdf"]),
+    ("设备维护手册2023 第三章", ["设备维护手册2023.pdf"]),
+    ("对比 合同.pdf 和 data.pdf", ["data.pdf", "合同.pdf"]),
+])
+def test_whole_filenames_and_long_stems_filter(question, expected):
+    assert parse_query_filters(question, filenames=FILES)["filenames"] == expected
+
+
+def test_year_and_month():
+    assert parse_query_filters("2024年3月的合同") == {"date_from": "2024-03-01", "date_to": "2024-03-31"}
+    assert parse_query_filters("2024-02 的报告") == {"date_from": "2024-02-01", "date_to": "2024-02-29"}
+    assert parse_query_filters("2023年的采购") == {"date_from": "2023-01-01", "date_to": "2023-12-31"}
+    assert parse_query_filters("型号 2024-13") is None
+
+
+def test_document_types():
+    filters = parse_query_filters("技术手册里的电压", doc_types=["技术手册", "General", "财报"])
+    assert filters == {"doc_types": ["技术手册"]}
+
+
+def test_normalize_and_key():
+    assert normalize_filters({"doc_types": [], "keywords": [" "]}) is None
+    a = normalize_filters({"doc_types": ["合同", "财报"], "date_from": "2024-01-01T00:00"})
+    b = normalize_filters({"doc_types": ["财报", "合同", "合同"], "date_from": "2024-01-01"})
+    assert a == b and filters_key(a) == filters_key(b)
+
+
+def test_build_qdrant_filter():
+    f = build_qdrant_filter({"filenames": ["a.pdf"], "date_from": "2024-01-01", "date_to": "2024-12-31"})
+    keys = [c.key for c in f.must]
+    assert keys == ["filename", "doc_date"]
+    assert build_qdrant_filter(None) is None
@@ -0,0 +1,75 @@
+# --- START OF FILE test_retrieval.py ---
+
+import pytest
+from llama_index.core.schema import NodeWithScore, TextNode
+
+from modules.retrieval import rrf_fuse
+from modules.rerank import CrossEncoderReranker
+
+
+def test_rrf_rewards_items_found_by_both_lists():
+    fused = rrf_fuse([["a", "b", "c"], ["c", "d", "a"]], k=60)
+    ids = [i for i, _ in fused]
+    assert ids[:2] == ["a", "c"]
+    assert set(ids) == {"a", "b", "c", "d"}
+
+
+def test_rrf_scores_are_normalized():
+    fused = dict(rrf_fuse([["a", "b"], ["a", "c"]], k=60))
+    # 两路都排第一 = 1.0；只在一路出现最多 0.5
+    assert fused["a"] == pytest.approx(1.0)
+    assert fused["b"] == pytest.approx((1 / 62) / (2 / 61))
+    assert fused["b"] < 0.5
+
+
+def test_rrf_top_k_and_empty_lists():
+    assert [i for i, _ in rrf_fuse([["a", "b", "c"], []], top_k=2)] == ["a", "b"]
+    assert rrf_fuse([[], []]) == []
+
+
+def test_rrf_single_list_keeps_order():
+    assert [i for i, _ in rrf_fuse([["x", "y", "z"]])] == ["x", "y", "z"]
+
+
+class FakeCrossEncoder:
+    """分数 = 文本里 "hit" 出现的次数，和向量分 / 融合分无关"""
+
+    tokenizer = None
+
+    def __init__(self):
+        self.pairs = 0
+
+    def predict(self, pairs, batch_size=16, show_progress_bar=False):
+        self.pairs += len(pairs)
+        return [text.count("hit") for _, text in pairs]
+
+
+@pytest.fixture
+def reranker(monkeypatch):
+    monkeypatch.setattr(CrossEncoderReranker, "_load_model", lambda self, backend: FakeCrossEncoder())
+    return CrossEncoderReranker("fake", top_n=2, skip_margin=0.15)
+
+
+def fused_nodes():
+    # 前两名两路都命中 (融合分约 0.98)，后两名只有一路 (不超过 0.5)：分差远大于 skip_margin
+    texts_scores = [("a", 0.99), ("b", 0.97), ("hit hit", 0.49), ("hit", 0.48)]
+    return [NodeWithScore(node=TextNode(id_=t, text=t), score=s) for t, s in texts_scores]
+
+
+def test_margin_skip_applies_to_dense_scores(reranker):
+    result = reranker.postprocess_nodes(fused_nodes(), query_str="q")
+    assert [n.node.node_id for n in result] == ["a", "b"]
+    assert reranker.skipped == 1 and reranker.model.pairs == 0
+
+
+def test_fused_scores_are_always_reranked(reranker):
+    result = reranker.postprocess_nodes(fused_nodes(), query_str="q", allow_skip=False)
+    assert [n.node.node_id for n in result] == ["hit hit", "hit"]
+    assert reranker.skipped == 0 and reranker.model.pairs == 4
+
+
+def test_rerank_scores_are_cached(reranker):
+    reranker.postprocess_nodes(fused_nodes(), query_str="q", allow_skip=False)
+    reranker.postprocess_nodes(fused_nodes(), query_str="q", allow_skip=False)
+    assert reranker.model.pairs == 4
+    assert reranker.stats()["cache_hit_rate"] == pytest.approx(0.5)
@@ -0,0 +1,32 @@
+# --- START OF FILE test_worker.py ---
+
+import pytest
+
+from modules import ingestion
+from modules.worker import IngestionWorker
+
+
+def run_job(corpus_db, path):
+    corpus_db.enqueue_jobs([(path.name, str(path))], max_attempts=3)
+    assert IngestionWorker("test").run_once()
+    return corpus_db.list_jobs()[0]
+
+
+def test_corrupt_file_fails_without_retry(corpus_db, tmp_path):
+    path = tmp_path / "broken.pdf"
+    path.write_bytes(b"not a pdf at all")
+    job = run_job(corpus_db, path)
+    assert job["status"] == "failed" and job["attempts"] == 1
+    assert job["result_msg"].startswith(ingestion.UNPARSEABLE_PREFIX)
+
+
+@pytest.mark.parametrize("message, status", [
+    ("解析结果为空", "failed"),
+    ("处理失败: 429 Resource exhausted", "queued"),
+])
+def test_only_transient_failures_are_retried(corpus_db, tmp_path, monkeypatch, message, status):
+    path = tmp_path / "a.pdf"
+    path.write_bytes(b"%PDF")
+    monkeypatch.setattr(ingestion, "process_single_file", lambda file_path, on_stage=None: (False, message, 0))
+    job = run_job(corpus_db, path)
+    assert job["status"] == status and job["attempts"] == 1